@@ -0,0 +1,217 @@
+"""
+Approximate nearest-neighbour (IVF) engine for VectorSearchService
+Vectors are clustered with spherical k-means; a query only scores the rows of
+the `nprobe` clusters whose centroids are closest to it. nprobe is tuned at
+build time against exact search so the index reports the recall it delivers.
+
+Usage:
+    VECTOR_SEARCH_ENGINE=ivf                          enable the engine
+    python ann_index.py build [--nlist N] [--target-recall 0.95]
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+from vector_index import top_k
+
+VECTOR_ANN_PATH = os.environ.get(
+    'VECTOR_ANN_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vector_store', 'ivf_index.npz')
+)
+# Below this many vectors exact search is fast enough and always exact
+VECTOR_ANN_MIN_ROWS = int(os.environ.get('VECTOR_ANN_MIN_ROWS', '20000'))
+# Overrides the tuned nprobe when set (> 0)
+VECTOR_ANN_NPROBE = int(os.environ.get('VECTOR_ANN_NPROBE', '0'))
+VECTOR_ANN_TARGET_RECALL = float(os.environ.get('VECTOR_ANN_TARGET_RECALL', '0.95'))
+
+
+class IVFIndex:
+    """Centroids, per-entry list assignments and tuning results of one build"""
+
+    def __init__(self, centroids: np.ndarray, entry_ids: List[str], lists: np.ndarray,
+                 nprobe: int, tuned_recall: float, recall_k: int, built_at: str):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.entry_ids = list(entry_ids)
+        self.lists = np.asarray(lists, dtype=np.int32)
+        self.nprobe = nprobe
+        self.tuned_recall = tuned_recall
+        self.recall_k = recall_k
+        self.built_at = built_at
+        self._list_by_id: Optional[Dict[str, int]] = None
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'engine': 'ivf',
+            'nlist': self.nlist,
+            'nprobe': VECTOR_ANN_NPROBE or self.nprobe,
+            'tuned_nprobe': self.nprobe,
+            'tuned_recall': round(self.tuned_recall, 4),
+            'recall_at': self.recall_k,
+            'vectors_at_build': len(self.entry_ids),
+            'built_at': self.built_at
+        }
+
+    def assign(self, block: np.ndarray) -> np.ndarray:
+        """Nearest centroid for each (normalized) row of block"""
+        return np.argmax(np.asarray(block, dtype=np.float32) @ self.centroids.T, axis=1).astype(np.int32)
+
+    def probe(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """Ids of the lists whose centroids are closest to the query"""
+        nprobe = nprobe or VECTOR_ANN_NPROBE or self.nprobe
+        return top_k(self.centroids @ query, min(nprobe, self.nlist))
+
+    def lists_for(self, entry_ids: List[str]) -> np.ndarray:
+        """Build-time list of each entry, -1 for entries the build has not seen"""
+        if self._list_by_id is None:
+            self._list_by_id = dict(zip(self.entry_ids, self.lists.tolist()))
+        return np.fromiter((self._list_by_id.get(e, -1) for e in entry_ids),
+                           dtype=np.int32, count=len(entry_ids))
+
+    def save(self, path: str):
+        """Write the build next to the vector store, replacing any previous one atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            entry_ids=np.array(self.entry_ids, dtype=str),
+            lists=self.lists,
+            params=np.array([self.nprobe, self.recall_k], dtype=np.int64),
+            tuned_recall=np.array([self.tuned_recall], dtype=np.float64),
+            built_at=np.array([self.built_at])
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        with np.load(path) as data:
+            return cls(
+                centroids=data['centroids'],
+                entry_ids=data['entry_ids'].tolist(),
+                lists=data['lists'],
+                nprobe=int(data['params'][0]),
+                tuned_recall=float(data['tuned_recall'][0]),
+                recall_k=int(data['params'][1]),
+                built_at=str(data['built_at'][0])
+            )
+
+
+def _assign_all(index, centroids: np.ndarray) -> np.ndarray:
+    lists = np.empty(index.row_count, dtype=np.int32)
+    for start, block in index.iter_row_blocks():
+        lists[start:start + block.shape[0]] = np.argmax(np.asarray(block) @ centroids.T, axis=1)
+    return lists
+
+
+def train_centroids(sample: np.ndarray, nlist: int, iterations: int = 15, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: centroids are kept unit-length so assignment is a dot product"""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # Re-seed empty clusters from random sample points
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = sample[rng.choice(sample.shape[0], empty.size, replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+def tune_nprobe(index, centroids: np.ndarray, lists: np.ndarray, target_recall: float,
+                num_queries: int = 100, k: int = 10, seed: int = 1):
+    """Smallest nprobe whose recall@k against exact search reaches target_recall"""
+    rng = np.random.default_rng(seed)
+    live = np.flatnonzero(lists >= 0)
+    query_rows = np.sort(rng.choice(live, min(num_queries, live.size), replace=False))
+    queries = index.gather_rows(query_rows)
+
+    # Exact neighbours, excluding each query's own row
+    scores = np.empty((queries.shape[0], index.row_count), dtype=np.float32)
+    for start, block in index.iter_row_blocks():
+        scores[:, start:start + block.shape[0]] = queries @ np.asarray(block).T
+    scores[:, lists < 0] = -np.inf
+    scores[np.arange(query_rows.size), query_rows] = -np.inf
+    exact = [set(top_k(row_scores, k).tolist()) for row_scores in scores]
+
+    centroid_scores = queries @ centroids.T
+    nprobe, recall = centroids.shape[0], 1.0
+    candidate = 1
+    while candidate <= centroids.shape[0]:
+        hits = 0
+        for q in range(queries.shape[0]):
+            probed = top_k(centroid_scores[q], candidate)
+            rows = np.flatnonzero(np.isin(lists, probed))
+            approx = rows[top_k(scores[q, rows], k)]
+            hits += len(exact[q].intersection(approx.tolist()))
+        candidate_recall = hits / max(1, sum(len(e) for e in exact))
+        print(f"   nprobe={candidate}: recall@{k}={candidate_recall:.4f}")
+        if candidate_recall >= target_recall:
+            nprobe, recall = candidate, candidate_recall
+            break
+        candidate *= 2
+    return nprobe, recall, k
+
+
+def build_ivf(index, nlist: int = 0, target_recall: float = VECTOR_ANN_TARGET_RECALL,
+              sample_size: int = 50000, path: str = VECTOR_ANN_PATH) -> IVFIndex:
+    """Train, tune and persist an IVF index over the rows of a loaded vector index"""
+    started = time.time()
+    index.refresh()
+    with index.lock:
+        live = index.live_rows()
+        if live.size < 2:
+            raise ValueError("Not enough vectors to build an IVF index")
+        nlist = nlist or max(1, int(4 * np.sqrt(live.size)))
+        nlist = min(nlist, live.size)
+
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(live, min(sample_size, live.size), replace=False))
+        sample = index.gather_rows(sample_rows)
+        print(f"🔧 Training IVF: {live.size} vectors, nlist={nlist}, sample={sample.shape[0]}")
+        centroids = train_centroids(sample, nlist)
+
+        lists = _assign_all(index, centroids)
+        dead = np.ones(index.row_count, dtype=bool)
+        dead[live] = False
+        lists[dead] = -1
+
+        print(f"🔧 Tuning nprobe for recall >= {target_recall}")
+        nprobe, recall, k = tune_nprobe(index, centroids, lists, target_recall)
+        ids = [index.ids[row] for row in live.tolist()]
+        ivf = IVFIndex(centroids, ids, lists[live], nprobe, recall, k, datetime.now().isoformat())
+
+    ivf.save(path)
+    print(f"✅ IVF index built in {time.time() - started:.1f}s: {ivf.describe()}")
+    return ivf
+
+
+if __name__ == '__main__':
+    from services import get_db
+    from vector_index import get_vector_index
+
+    parser = argparse.ArgumentParser(description='Build the IVF index for vector search')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--nlist', type=int, default=0, help='number of clusters (default 4*sqrt(n))')
+    parser.add_argument('--target-recall', type=float, default=VECTOR_ANN_TARGET_RECALL)
+    args = parser.parse_args()
+
+    vector_index = get_vector_index(get_db(), 'vector_embeddings', 3072)
+    build_ivf(vector_index, nlist=args.nlist, target_recall=args.target_recall)
+    sys.exit(0)
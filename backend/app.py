@@ -8,7 +8,6 @@ from bson import ObjectId
 from bson.json_util import dumps
 import json
 from azure.storage.blob import BlobServiceClient
-import io
 
 from config import Config
 
@@ -48,7 +47,11 @@ except Exception as e:
 # Import services after app initialization
 from services import DocumentService, VectorSearchService, FileProcessingService
 from intelligent_qa import IntelligentQAService
+from lexical_index import keyword_search, tokenize
+from blob_io import open_blob, forget_blob, client_options as blob_client_options
+from jobs import get_job_queue
 import time
+import threading
 
 # Allow time for dependent services to start
 if os.environ.get('FLASK_ENV') != 'development':
@@ -59,7 +62,7 @@ blob_service_client = None
 try:
     storage_connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
     if storage_connection_string:
-        blob_service_client = BlobServiceClient.from_connection_string(storage_connection_string)
+        blob_service_client = BlobServiceClient.from_connection_string(storage_connection_string, **blob_client_options())
         app.logger.info("Azure Blob Storage initialized successfully")
     else:
         app.logger.warning("AZURE_STORAGE_CONNECTION_STRING not set, file uploads will fail")
@@ -73,12 +76,18 @@ if db is not None:
     vector_service = VectorSearchService(db)
     file_service = FileProcessingService(db)
     qa_service = IntelligentQAService(db)
+    job_queue = get_job_queue(db)
 else:
     app.logger.warning("Services not initialized due to database connection failure")
     doc_service = None
     vector_service = None
     file_service = None
     qa_service = None
+    job_queue = None
+
+# Embed the canned suggestion prompts off the request path so they hit the query cache
+if qa_service is not None and os.environ.get('EMBEDDING_CACHE_PREWARM', 'true').lower() == 'true':
+    threading.Thread(target=qa_service.warm_suggestions, daemon=True).start()
 
 # Helper functions for Azure Blob Storage
 def upload_to_blob(file, filename):
@@ -96,16 +105,12 @@ def upload_to_blob(file, filename):
         raise
 
 def download_from_blob(filename):
-    """Download file from Azure Blob Storage and return as bytes"""
+    """Open a file from Azure Blob Storage (disk-cached by ETag, streamed in chunks); close it after use"""
     if not blob_service_client:
         raise Exception("Blob storage not configured")
     
     try:
-        blob_client = blob_service_client.get_blob_client(container="uploads", blob=filename)
-        stream = io.BytesIO()
-        blob_client.download_blob().readinto(stream)
-        stream.seek(0)
-        return stream
+        return open_blob(blob_service_client, filename)
     except Exception as e:
         app.logger.error(f"Failed to download from blob storage: {str(e)}")
         raise
@@ -118,6 +123,7 @@ def delete_from_blob(filename):
     try:
         blob_client = blob_service_client.get_blob_client(container="uploads", blob=filename)
         blob_client.delete_blob()
+        forget_blob(filename)
     except Exception as e:
         app.logger.warning(f"Failed to delete from blob storage: {str(e)}")
 
@@ -218,9 +224,14 @@ def delete_document(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
-        # Delete from database collections
+        # Delete from database collections (vectors first, legacy ones are found through rfp_entries)
+        if vector_service is not None:
+            vector_service.remove_document(str(doc_id))
+        else:
+            db.vector_embeddings.delete_many({'document_id': str(doc_id)})
         db.rfp_entries.delete_many({'document_id': doc_id})
-        db.vector_embeddings.delete_many({'document_id': str(doc_id)})
+        db.ingest_checkpoints.delete_many({'document_id': str(doc_id)})
+        db.rfp_entry_history.delete_many({'document_id': doc_id})
         db.documents.delete_one({'_id': doc_id})
         
         # Delete blob from Azure Storage
@@ -255,6 +266,15 @@ def upload_document():
         if document_type not in ['RFP', 'Documentation']:
             return jsonify({'error': 'Invalid document type'}), 400
         
+        # New version of an earlier upload: unchanged rows reuse its embeddings
+        previous_document = None
+        if request.form.get('previous_document_id'):
+            previous_document = db.documents.find_one({'_id': ObjectId(request.form['previous_document_id'])})
+            if not previous_document:
+                return jsonify({'error': 'Previous document version not found'}), 404
+            if document_type != 'RFP' or previous_document.get('document_type') != 'RFP':
+                return jsonify({'error': 'Versioned uploads are only supported for RFP workbooks'}), 400
+        
         # Upload file to Azure Blob Storage
         filename = secure_filename(file.filename)
         file_id = ObjectId()
@@ -275,11 +295,12 @@ def upload_document():
         # Extract metadata from filename using AI
         auto_metadata = extract_metadata_from_filename(filename)
         
-        # Merge user-provided metadata with auto-extracted (user takes precedence)
+        # Merge user-provided metadata with the previous version's and auto-extracted (user takes precedence)
+        previous_metadata = previous_document.get('metadata', {}) if previous_document else {}
         metadata = {
-            'bank_name': user_metadata.get('bank_name') or auto_metadata.get('bank_name', ''),
-            'product': user_metadata.get('product') or auto_metadata.get('product', ''),
-            'rfp_name': user_metadata.get('rfp_name') or auto_metadata.get('rfp_name', filename)
+            'bank_name': user_metadata.get('bank_name') or previous_metadata.get('bank_name') or auto_metadata.get('bank_name', ''),
+            'product': user_metadata.get('product') or previous_metadata.get('product') or auto_metadata.get('product', ''),
+            'rfp_name': user_metadata.get('rfp_name') or previous_metadata.get('rfp_name') or auto_metadata.get('rfp_name', filename)
         }
         
         document = {
@@ -296,39 +317,48 @@ def upload_document():
             'created_at': datetime.utcnow(),
             'uploaded_by': request.form.get('uploaded_by', 'anonymous')
         }
+        if previous_document:
+            document['previous_version_id'] = previous_document['_id']
+            document['version'] = previous_document.get('version', 1) + 1
         
         db.documents.insert_one(document)
         
-        # Process file SYNCHRONOUSLY (Celery/async disabled for reliability)
-        if file_service is not None:
+        # Process in the background, progress is reported by /api/documents/<id>/status
+        if job_queue is not None:
             try:
-                # Always process synchronously for immediate feedback
-                app.logger.info(f"Starting synchronous processing for document: {str(file_id)}")
-                file_service.process_document(str(file_id))
-                app.logger.info(f"Successfully processed document: {str(file_id)}")
+                job_id = job_queue.submit('process_document', str(file_id),
+                                          priority=request.form.get('priority', 'normal'))
+                app.logger.info(f"Queued processing job {job_id} for document: {str(file_id)}")
                 
-                return jsonify({
+                response = {
                     'document_id': str(file_id),
-                    'status': 'completed',
+                    'job_id': job_id,
+                    'status': 'processing',
                     'processing_mode': processing_mode,
                     'metadata': metadata,
-                    'message': f'Document uploaded and processed successfully ({processing_mode} mode)'
-                }), 200
+                    'message': f'Document uploaded, processing in the background ({processing_mode} mode)'
+                }
+                if previous_document:
+                    response['previous_version_id'] = str(previous_document['_id'])
+                    response['version'] = document['version']
+                    # Prefill for the mapping screen
+                    response['suggested_mappings'] = previous_document.get('column_mappings')
+                return jsonify(response), 202
                 
-            except Exception as sync_error:
-                app.logger.error(f"Processing failed: {str(sync_error)}")
+            except Exception as queue_error:
+                app.logger.error(f"Could not queue processing: {str(queue_error)}")
                 app.logger.exception("Full traceback:")
                 # Update document status to failed
                 db.documents.update_one(
                     {'_id': file_id},
-                    {'$set': {'status': 'failed', 'error': str(sync_error)}}
+                    {'$set': {'status': 'failed', 'error': str(queue_error)}}
                 )
                 
                 return jsonify({
                     'document_id': str(file_id),
                     'status': 'failed',
-                    'error': str(sync_error),
-                    'message': 'Document uploaded but processing failed'
+                    'error': str(queue_error),
+                    'message': 'Document uploaded but processing could not be queued'
                 }), 500
         else:
             app.logger.warning("File service not available, document uploaded but not processed")
@@ -352,9 +382,9 @@ def upload_document():
 
 @app.route('/api/documents/<document_id>/process', methods=['POST'])
 def process_document_manually(document_id):
-    """Manually trigger document processing (synchronous)"""
+    """Manually trigger document processing (runs as a background job)"""
     try:
-        if not file_service:
+        if not job_queue:
             return jsonify({'error': 'File processing service not available'}), 503
         
         # Get document
@@ -362,53 +392,29 @@ def process_document_manually(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
+        processing_mode = document.get('processing_mode', 'professional')
+        if processing_mode != 'simple':
+            # Professional mode requires column mapping
+            return jsonify({
+                'error': 'Professional mode requires column mapping',
+                'message': 'Please use the column mapping interface to process this document'
+            }), 400
+        
         # Update status to processing
         db.documents.update_one(
             {'_id': ObjectId(document_id)},
             {'$set': {'status': 'processing'}}
         )
         
-        # Process synchronously (not using Celery)
-        try:
-            processing_mode = document.get('processing_mode', 'professional')
-            
-            if processing_mode == 'simple':
-                if document.get('document_type') == 'RFP':
-                    file_service._process_simple_rfp(document)
-                else:
-                    file_service._process_documentation(document)
-            else:
-                # Professional mode requires column mapping
-                return jsonify({
-                    'error': 'Professional mode requires column mapping',
-                    'message': 'Please use the column mapping interface to process this document'
-                }), 400
-            
-            # Update status to completed
-            db.documents.update_one(
-                {'_id': ObjectId(document_id)},
-                {'$set': {
-                    'status': 'completed',
-                    'completed_at': datetime.utcnow()
-                }}
-            )
-            
-            return jsonify({
-                'message': 'Document processed successfully',
-                'document_id': document_id,
-                'status': 'completed'
-            })
-            
-        except Exception as process_error:
-            # Update status to failed
-            db.documents.update_one(
-                {'_id': ObjectId(document_id)},
-                {'$set': {
-                    'status': 'failed',
-                    'error': str(process_error)
-                }}
-            )
-            raise process_error
+        data = request.get_json(silent=True) or {}
+        job_id = job_queue.submit('process_document', document_id, priority=data.get('priority', 'normal'))
+        
+        return jsonify({
+            'message': 'Document processing queued',
+            'document_id': document_id,
+            'job_id': job_id,
+            'status': 'processing'
+        }), 202
             
     except Exception as e:
         app.logger.error(f"Processing error: {str(e)}")
@@ -477,17 +483,37 @@ def get_document_status(document_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
         
+        job = job_queue.latest_for_document(document_id) if job_queue else None
+        
         return jsonify({
             'document_id': str(document['_id']),
             'status': document.get('status', 'unknown'),
             'records_processed': document.get('records_processed', 0),
             'total_records': document.get('total_records', 0),
+            'sheets': document.get('sheets', []),
+            'version_diff': document.get('version_diff'),
             'errors': document.get('error_details', []),
-            'completed_at': document.get('completed_at').isoformat() if document.get('completed_at') else None
+            'completed_at': document.get('completed_at').isoformat() if document.get('completed_at') else None,
+            'job': job_queue.describe(job, document) if job else None
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get status and live progress of a background processing job"""
+    try:
+        if not job_queue:
+            return jsonify({'error': 'Job queue not available'}), 503
+        
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify(job_queue.describe(job))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/api/documents/<document_id>/analyze', methods=['GET'])
 def analyze_document(document_id):
     """Analyze Excel document and return column information"""
@@ -501,9 +527,12 @@ def analyze_document(document_id):
         if document.get('document_type') != 'RFP':
             return jsonify({'error': 'Only RFP documents can be analyzed'}), 400
         
-        # Read Excel file
-        file_path = document['file_path']
-        df = pd.read_excel(file_path)
+        # Read Excel file (blob uploads come from the local blob cache after the first read)
+        if 'blob_name' in document:
+            with download_from_blob(document['blob_name']) as source:
+                df = pd.read_excel(source)
+        else:
+            df = pd.read_excel(document['file_path'])
         
         # Get column names
         columns = [str(col) for col in df.columns]
@@ -562,13 +591,16 @@ def submit_column_mapping(document_id):
             }
             db.templates.insert_one(template)
         
-        # Apply mapping and process
-        file_service.apply_mapping_and_process.delay(str(document_id), mappings)
+        # Apply mapping and process in the background (someone is waiting on the mapping screen)
+        db.documents.update_one({'_id': ObjectId(document_id)}, {'$set': {'status': 'processing'}})
+        job_id = job_queue.submit('apply_mapping', str(document_id), {'mappings': mappings},
+                                  priority=data.get('priority', 'high'))
         
         return jsonify({
             'status': 'processing',
+            'job_id': job_id,
             'message': 'Column mapping applied. Processing records...'
-        })
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
@@ -579,6 +611,7 @@ def query_rag():
     query = data.get('query')
     top_n = data.get('top_n', 10)
     filters = data.get('filters', {})
+    mode = data.get('mode')  # 'vector' or 'hybrid' (default: SEARCH_MODE)
     
     if not query or len(query) < 3:
         return jsonify({'error': 'Query must be at least 3 characters'}), 400
@@ -588,7 +621,7 @@ def query_rag():
         return jsonify({'error': 'Vector search service not available'}), 503
     
     # Perform vector search
-    results = vector_service.search(query, top_n, filters)
+    results = vector_service.search(query, top_n, filters, mode=mode)
     
     return jsonify({
         'query': query,
@@ -607,12 +640,14 @@ def search_documents():
             query = data.get('query', '').strip()
             limit = int(data.get('top_n', data.get('limit', 50)))
             filters = data.get('filters', {})
+            mode = data.get('mode')
             document_id = filters.get('document_id', '')
         else:
             # GET request
             query = request.args.get('query', '').strip()
             limit = int(request.args.get('limit', 50))
             document_id = request.args.get('document_id', '')
+            mode = request.args.get('mode')
             filters = {}
             if document_id:
                 filters['document_id'] = document_id
@@ -629,7 +664,7 @@ def search_documents():
             return jsonify({'error': 'Search service not available'}), 503
         
         # Perform vector search
-        results = vector_service.search(query, limit, filters)
+        results = vector_service.search(query, limit, filters, mode=mode)
         
         return jsonify({
             'query': query,
@@ -640,6 +675,16 @@ def search_documents():
         app.logger.error(f"Search error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search/index', methods=['GET'])
+def get_search_index_info():
+    """Describe the vector index (store mode, engine, tuned recall)"""
+    try:
+        if vector_service is None:
+            return jsonify({'error': 'Search service not available'}), 503
+        return jsonify(vector_service.index_info())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/search/ask', methods=['POST'])
 def intelligent_ask():
     """Ask an intelligent question using GPT-4o RAG or fallback to simple search"""
@@ -692,13 +737,8 @@ def _simple_text_search(question: str, limit: int = 5) -> dict:
                 'confidence': 0.0
             }
         
-        # Perform case-insensitive text search on requirement field
-        search_terms = question.lower().split()
-        
-        # Build regex query for MongoDB
-        regex_patterns = [{'requirement': {'$regex': term, '$options': 'i'}} for term in search_terms if len(term) > 2]
-        
-        if not regex_patterns:
+        # Token search on the in-memory lexical index (no collection scan)
+        if not tokenize(question):
             return {
                 'answer': 'Please provide more specific search terms (at least 3 characters each).',
                 'sources': [],
@@ -707,9 +747,7 @@ def _simple_text_search(question: str, limit: int = 5) -> dict:
             }
         
         # Search in rfp_entries collection
-        results = list(db.rfp_entries.find(
-            {'$or': regex_patterns}
-        ).limit(limit))
+        results = keyword_search(db, question, limit)
         
         if not results:
             return {
@@ -0,0 +1,241 @@
+"""
+Streaming Azure Blob Storage downloads with a local disk cache
+Blobs are streamed in fixed-size chunks straight to a file (or a spooled
+buffer), with parallel range reads for large blobs, so a download never holds
+the whole file in memory. Downloaded files are kept in a size-bounded disk
+cache keyed by blob name and ETag: analyze, mapping and reprocess of the same
+upload reuse one download, and a re-uploaded blob (new ETag) is fetched again.
+Ingestion reads a cached file through a lease, a hard link of its own that
+eviction never touches, so a long extraction (or a pool process reopening the
+file) keeps working when the cache entry is evicted or replaced meanwhile.
+
+Usage:
+    BLOB_CACHE_DIR=/tmp/rfp-blob-cache      local cache directory
+    BLOB_CACHE_MAX_BYTES=2147483648         cache budget (0 disables the cache)
+    BLOB_CHUNK_SIZE=4194304                 bytes per ranged GET
+    BLOB_MAX_CONCURRENCY=4                  parallel range reads for large blobs
+    BLOB_DOWNLOAD_TIMEOUT_SECONDS=3600      abandoned .partial downloads are removed after this
+"""
+
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import tempfile
+from typing import Dict, Any, Optional, IO
+
+BLOB_CONTAINER = os.environ.get('BLOB_CONTAINER', 'uploads')
+BLOB_CACHE_DIR = os.environ.get('BLOB_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'rfp-blob-cache'))
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+BLOB_CHUNK_SIZE = int(os.environ.get('BLOB_CHUNK_SIZE', str(4 * 1024 ** 2)))
+BLOB_MAX_CONCURRENCY = int(os.environ.get('BLOB_MAX_CONCURRENCY', '4'))
+# Blobs at least this large are fetched with BLOB_MAX_CONCURRENCY parallel range reads
+BLOB_PARALLEL_THRESHOLD = int(os.environ.get('BLOB_PARALLEL_THRESHOLD', str(16 * 1024 ** 2)))
+# In-memory part of open_blob buffers, larger blobs spill to disk
+BLOB_SPOOL_MAX_BYTES = int(os.environ.get('BLOB_SPOOL_MAX_BYTES', str(8 * 1024 ** 2)))
+# Cached files used this recently are never evicted (another request may be about to open them)
+BLOB_CACHE_MIN_AGE_SECONDS = 60
+# A .partial download not written to for this long was abandoned by a crashed process
+BLOB_DOWNLOAD_TIMEOUT_SECONDS = float(os.environ.get('BLOB_DOWNLOAD_TIMEOUT_SECONDS', '3600'))
+# Leased copies of cached files, named <pid>-<random> so leases of dead processes can be swept
+BLOB_LEASE_DIR = os.path.join(BLOB_CACHE_DIR, 'leases')
+
+
+def client_options() -> Dict[str, Any]:
+    """BlobServiceClient keyword arguments that make downloads use BLOB_CHUNK_SIZE ranges"""
+    return {'max_single_get_size': BLOB_CHUNK_SIZE, 'max_chunk_get_size': BLOB_CHUNK_SIZE}
+
+
+def cache_enabled() -> bool:
+    return BLOB_CACHE_MAX_BYTES > 0
+
+
+def _name_key(blob_name: str) -> str:
+    return hashlib.sha256(blob_name.encode('utf-8')).hexdigest()[:32]
+
+
+def _cache_path(blob_name: str, etag: str) -> str:
+    etag_key = hashlib.sha256(etag.strip('"').encode('utf-8')).hexdigest()[:16]
+    return os.path.join(BLOB_CACHE_DIR, f"{_name_key(blob_name)}-{etag_key}{os.path.splitext(blob_name)[1]}")
+
+
+def _stream_to(blob_client, stream: IO[bytes], size: Optional[int] = None):
+    """Stream a blob into a seekable file object in BLOB_CHUNK_SIZE ranges, returns the downloader"""
+    concurrency = BLOB_MAX_CONCURRENCY if size is not None and size >= BLOB_PARALLEL_THRESHOLD else 1
+    downloader = blob_client.download_blob(max_concurrency=concurrency)
+    downloader.readinto(stream)
+    return downloader
+
+
+def download_to_temp(service_client, blob_name: str) -> str:
+    """Stream a blob to a new temporary file (the caller deletes it)"""
+    blob_client = service_client.get_blob_client(container=BLOB_CONTAINER, blob=blob_name)
+    size = blob_client.get_blob_properties().size
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(blob_name)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _stream_to(blob_client, f, size)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def fetch_blob(service_client, blob_name: str) -> str:
+    """
+    Local path of a blob's current version: served from the disk cache when its ETag is
+    cached, otherwise streamed into the cache. A cached path is shared and may be evicted at
+    any time: never delete it, and read it through a lease (see lease_blob) when the read
+    takes a while. With the cache disabled this is a temporary file the caller deletes.
+    """
+    if not cache_enabled():
+        return download_to_temp(service_client, blob_name)
+
+    blob_client = service_client.get_blob_client(container=BLOB_CONTAINER, blob=blob_name)
+    properties = blob_client.get_blob_properties()
+    path = _cache_path(blob_name, properties.etag)
+    if os.path.exists(path):
+        os.utime(path)  # recency for eviction
+        print(f"📦 Blob cache hit: {blob_name}")
+        return path
+
+    os.makedirs(BLOB_CACHE_DIR, exist_ok=True)
+    started = time.time()
+    fd, partial = tempfile.mkstemp(dir=BLOB_CACHE_DIR, suffix='.partial')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            downloader = _stream_to(blob_client, f, properties.size)
+        # Name the file after the version actually downloaded, it may have changed meanwhile
+        path = _cache_path(blob_name, downloader.properties.etag or properties.etag)
+        os.replace(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+
+    print(f"📥 Downloaded blob {blob_name} ({properties.size / 1024 ** 2:.1f} MB) in {time.time() - started:.1f}s")
+    _forget_versions(blob_name, keep=path)
+    evict()
+    return path
+
+
+def lease_blob(service_client, blob_name: str) -> str:
+    """
+    Private path of a blob's current version that stays readable until the caller deletes it,
+    whatever happens to the cache meanwhile. A hard link of the cached file (no copy), or a
+    temporary file with the cache disabled; either way the caller deletes it like a temp file.
+    """
+    if not cache_enabled():
+        return download_to_temp(service_client, blob_name)
+    os.makedirs(BLOB_LEASE_DIR, exist_ok=True)
+    lease = os.path.join(BLOB_LEASE_DIR, f"{os.getpid()}-{uuid.uuid4().hex}{os.path.splitext(blob_name)[1]}")
+    for attempt in range(2):
+        path = fetch_blob(service_client, blob_name)
+        try:
+            os.link(path, lease)
+            return lease
+        except FileNotFoundError:
+            # Evicted by another process between fetch and link, fetch it again
+            if attempt:
+                raise
+        except OSError:
+            shutil.copyfile(path, lease)  # no hard links on this filesystem
+            return lease
+
+
+def open_blob(service_client, blob_name: str) -> IO[bytes]:
+    """Readable, seekable file object of a blob (cached file, or a spooled buffer without cache)"""
+    if cache_enabled():
+        return open(fetch_blob(service_client, blob_name), 'rb')
+    blob_client = service_client.get_blob_client(container=BLOB_CONTAINER, blob=blob_name)
+    stream = tempfile.SpooledTemporaryFile(max_size=BLOB_SPOOL_MAX_BYTES)
+    _stream_to(blob_client, stream, blob_client.get_blob_properties().size)
+    stream.seek(0)
+    return stream
+
+
+def _forget_versions(blob_name: str, keep: Optional[str] = None) -> int:
+    if not os.path.isdir(BLOB_CACHE_DIR):
+        return 0
+    prefix = _name_key(blob_name) + '-'
+    removed = 0
+    for entry in os.scandir(BLOB_CACHE_DIR):
+        if entry.name.startswith(prefix) and entry.path != keep:
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def forget_blob(blob_name: str) -> int:
+    """Drop every cached version of a blob (after it was deleted)"""
+    return _forget_versions(blob_name)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by another user
+    return True
+
+
+def sweep_leases() -> int:
+    """Delete leases left behind by processes that died before releasing them"""
+    if not os.path.isdir(BLOB_LEASE_DIR):
+        return 0
+    removed = 0
+    for entry in os.scandir(BLOB_LEASE_DIR):
+        pid = entry.name.split('-', 1)[0]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def evict() -> int:
+    """
+    Remove least recently used cache files until the cache fits BLOB_CACHE_MAX_BYTES, and
+    downloads abandoned by crashed processes. Leased files stay readable through their lease
+    (see lease_blob).
+    """
+    if not os.path.isdir(BLOB_CACHE_DIR):
+        return 0
+    sweep_leases()
+    files = []
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(BLOB_CACHE_DIR):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        if not entry.name.endswith('.partial'):
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        elif now - stat.st_mtime >= BLOB_DOWNLOAD_TIMEOUT_SECONDS:
+            # Downloads in progress keep writing, so their mtime stays fresh
+            try:
+                os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    used = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if used <= BLOB_CACHE_MAX_BYTES:
+            break
+        if now - mtime < BLOB_CACHE_MIN_AGE_SECONDS:
+            continue
+        try:
+            os.unlink(path)
+            used -= size
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,151 @@
+"""
+Incremental ingestion of a new version of an RFP workbook
+An upload can name the document it revises (previous_document_id). Its rows
+are fingerprinted by normalized mapped content and matched against the
+previous version's rfp_entries: matched rows carry their stored vector over
+instead of being embedded again, so only added or edited rows cost embedding
+requests. Once the new version is ingested, the previous version's entries are
+moved to rfp_entry_history (rows without a counterpart tombstoned), its
+vectors leave the search index and the document is marked superseded.
+"""
+
+import hashlib
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReplaceOne
+from vector_index import decode_vector
+
+HISTORY_COLLECTION = 'rfp_entry_history'
+
+# rfp_entries fields that make up a row's content (document and position fields do not)
+FINGERPRINT_FIELDS = ('requirement', 'product', 'requirement_category', 'response_category',
+                      'effort_required', 'comments')
+
+
+def content_fingerprint(entry: Dict[str, Any]) -> str:
+    """Hash of a row's mapped content with whitespace folded and blanks equal to missing"""
+    values = [' '.join(str(entry.get(field) or '').split()) for field in FINGERPRINT_FIELDS]
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+class VersionDiff:
+    """Matches the rows of a document being ingested against the version it revises"""
+
+    def __init__(self, db, document: Dict[str, Any], vector_collection: str = 'vector_embeddings'):
+        self.db = db
+        self.document_id = document['_id']
+        self.previous_id = ObjectId(document['previous_version_id'])
+        self.vector_collection = vector_collection
+        self._carried: Dict[ObjectId, ObjectId] = {}  # previous entry id -> new entry id
+        self._lock = threading.Lock()
+        self.unchanged = 0
+        self.new_or_changed = 0
+        self._previous = self._fingerprints(self.previous_id)
+        self.previous_rows = sum(len(ids) for ids in self._previous.values())
+        print(f"🔀 Diffing against version {self.previous_id}: {self.previous_rows} previous rows")
+
+    def _fingerprints(self, document_id: ObjectId) -> Dict[str, List[ObjectId]]:
+        """Entry ids of a version's rows by content fingerprint"""
+        fingerprints: Dict[str, List[ObjectId]] = {}
+        projection = {field: 1 for field in FINGERPRINT_FIELDS}
+        for entry in self.db.rfp_entries.find({'document_id': document_id}, projection).batch_size(1000):
+            fingerprints.setdefault(content_fingerprint(entry), []).append(entry['_id'])
+        return fingerprints
+
+    def _rebuild_carried(self):
+        """
+        Match every committed row of this version against the previous version from scratch.
+        match() only sees the batches a run reads, this pass covers every row that made it into
+        rfp_entries, including rows written by an earlier, interrupted run.
+        """
+        previous = self._fingerprints(self.previous_id)
+        carried = {}
+        for fingerprint, entry_ids in self._fingerprints(self.document_id).items():
+            candidates = sorted(previous.get(fingerprint, []))
+            for previous_id, entry_id in zip(candidates, sorted(entry_ids)):
+                carried[previous_id] = entry_id
+        total = self.db.rfp_entries.count_documents({'document_id': self.document_id})
+        with self._lock:
+            self._carried = carried
+            self.unchanged = len(carried)
+            self.new_or_changed = total - len(carried)
+
+    def match(self, batch: List[Tuple[int, Dict[str, Any], Tuple[str, str, Dict[str, Any]]]]) -> Dict[int, ObjectId]:
+        """Previous entry id of every batch row whose content is unchanged, by position in the batch"""
+        matched = {}
+        with self._lock:
+            for i, (_, entry, _) in enumerate(batch):
+                candidates = self._previous.get(content_fingerprint(entry))
+                if candidates:
+                    previous = candidates.pop()
+                    self._carried[previous] = entry['_id']
+                    matched[i] = previous
+            self.unchanged += len(matched)
+            self.new_or_changed += len(batch) - len(matched)
+        return matched
+
+    def vectors(self, matched: Dict[int, ObjectId]) -> Dict[int, Any]:
+        """Stored vectors of matched previous entries (rows whose vector is missing get embedded)"""
+        if not matched:
+            return {}
+        stored = {
+            doc['entry_id']: decode_vector(doc['vector'])
+            for doc in self.db[self.vector_collection].find(
+                {'entry_id': {'$in': [str(previous) for previous in matched.values()]}},
+                {'_id': 0, 'entry_id': 1, 'vector': 1}
+            )
+        }
+        return {i: stored[str(previous)] for i, previous in matched.items() if str(previous) in stored}
+
+    def finalize(self, vector_service, processed: int) -> Optional[Dict[str, Any]]:
+        """
+        Retire the previous version once this one is fully ingested. Returns the diff summary,
+        or None when the new version produced no rows (most likely a wrong column mapping).
+        History and counts come from the committed rows of both versions, not from this run.
+        """
+        previous = self.db.documents.find_one({'_id': self.previous_id}, {'superseded_by': 1})
+        if previous is None or previous.get('superseded_by') == self.document_id:
+            return None  # gone, or already retired by an earlier run of this ingestion
+        if processed == 0 and self.previous_rows:
+            print(f"⚠️ Version {self.document_id} has no rows, keeping version {self.previous_id} live")
+            return None
+
+        self._rebuild_carried()
+        now = datetime.utcnow()
+        removed = 0
+        batch = []
+        for entry in self.db.rfp_entries.find({'document_id': self.previous_id}).batch_size(1000):
+            successor = self._carried.get(entry['_id'])
+            removed += successor is None
+            batch.append(ReplaceOne({'_id': entry['_id']}, {
+                **entry,
+                'superseded_by': self.document_id,
+                'superseded_at': now,
+                'carried_to': successor,
+                'tombstone': successor is None
+            }, upsert=True))
+            if len(batch) >= 1000:
+                self.db[HISTORY_COLLECTION].bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            self.db[HISTORY_COLLECTION].bulk_write(batch, ordered=False)
+        # Vectors first: ones stored without a document_id are found through the rfp_entries
+        vector_service.remove_document(str(self.previous_id))
+        self.db.rfp_entries.delete_many({'document_id': self.previous_id})
+        self.db.ingest_checkpoints.delete_many({'document_id': str(self.previous_id)})
+        self.db.documents.update_one(
+            {'_id': self.previous_id},
+            {'$set': {'status': 'superseded', 'superseded_by': self.document_id, 'superseded_at': now}}
+        )
+
+        summary = {
+            'previous_version_id': str(self.previous_id),
+            'unchanged': self.unchanged,
+            'new_or_changed': self.new_or_changed,
+            'removed': removed
+        }
+        print(f"🔀 Version diff: {summary['unchanged']} unchanged (vectors carried over), "
+              f"{summary['new_or_changed']} new or changed, {removed} removed")
+        return summary
@@ -0,0 +1,318 @@
+"""
+Two-tier caches of embeddings
+Tier 1 is an in-process LRU, tier 2 a MongoDB collection shared by every worker
+(TTL index on last use, bounded in size). Keys are a hash of the normalized text
+and the embedding model, so a model change never serves stale vectors.
+Search queries and ingested content live in separate collections: content is
+far larger, kept longer, and deduplicates requirement wording reused across
+RFPs as well as rows re-embedded when a document is reprocessed.
+
+Usage:
+    EMBEDDING_CACHE_SIZE=2048                 in-process query entries (0 disables the query cache)
+    EMBEDDING_DEDUP=true                      look ingested text up by content hash before embedding
+    python embedding_cache.py warm            embed the suggested questions ahead of time
+    python embedding_cache.py stats           show tier sizes and hit counters
+"""
+
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import numpy as np
+from bson import Binary
+from pymongo import UpdateOne
+
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '2048'))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.environ.get('EMBEDDING_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '100000'))
+# Size check of the MongoDB tier runs once per this many stores
+EMBEDDING_CACHE_EVICT_EVERY = int(os.environ.get('EMBEDDING_CACHE_EVICT_EVERY', '100'))
+
+EMBEDDING_DEDUP = os.environ.get('EMBEDDING_DEDUP', 'true').lower() == 'true'
+EMBEDDING_DEDUP_MEMORY_SIZE = int(os.environ.get('EMBEDDING_DEDUP_MEMORY_SIZE', '512'))
+EMBEDDING_DEDUP_TTL_SECONDS = int(os.environ.get('EMBEDDING_DEDUP_TTL_SECONDS', str(180 * 24 * 3600)))
+EMBEDDING_DEDUP_MAX_ENTRIES = int(os.environ.get('EMBEDDING_DEDUP_MAX_ENTRIES', '1000000'))
+
+CACHE_COLLECTION = 'query_embedding_cache'
+CONTENT_CACHE_COLLECTION = 'content_embedding_cache'
+
+
+def normalize_query(text: str) -> str:
+    """Cache key text: case and whitespace differences embed to (nearly) the same vector"""
+    return ' '.join((text or '').lower().split())
+
+
+def normalize_content(text: str) -> str:
+    """Content key text: only whitespace is folded, case can carry meaning (product codes)"""
+    return ' '.join((text or '').split())
+
+
+class EmbeddingCache:
+    """In-process LRU in front of a shared, TTL-bounded MongoDB collection"""
+
+    def __init__(self, db, model: str, max_size: int = EMBEDDING_CACHE_SIZE,
+                 collection_name: str = CACHE_COLLECTION,
+                 ttl_seconds: int = EMBEDDING_CACHE_TTL_SECONDS,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 normalize: Callable[[str], str] = normalize_query):
+        self.db = db
+        self.model = model
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.normalize = normalize
+        self.collection = db[collection_name] if db is not None else None
+        self._lru: 'OrderedDict[str, List[float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores_since_evict = 0
+        self.counters = {'memory_hits': 0, 'mongo_hits': 0, 'misses': 0, 'stores': 0, 'evicted': 0}
+        self._ensure_indexes()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _ensure_indexes(self):
+        if self.collection is None or not self.enabled:
+            return
+        try:
+            self.collection.create_index('last_used_at', expireAfterSeconds=self.ttl_seconds)
+        except Exception as e:
+            print(f"Embedding cache index info: {e}")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{self.normalize(text)}".encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Cached embedding of text, or None"""
+        if not self.enabled:
+            return None
+        key = self.key(text)
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return vector
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one_and_update(
+                    {'_id': key},
+                    {'$set': {'last_used_at': datetime.now()}, '$inc': {'hits': 1}},
+                    projection={'vector': 1}
+                )
+            except Exception as e:
+                print(f"⚠️ Embedding cache lookup failed: {e}")
+                doc = None
+            if doc is not None:
+                vector = np.frombuffer(bytes(doc['vector']), dtype='<f4').tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.counters['mongo_hits'] += 1
+                return vector
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, text: str, vector: List[float]):
+        """Store an embedding in both tiers"""
+        if not self.enabled:
+            return
+        key = self.key(text)
+        self._remember(key, vector)
+        evict = self._count_stores(1)
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(*self._upsert(key, text, vector, datetime.now()), upsert=True)
+            if evict:
+                self.evict()
+        except Exception as e:
+            print(f"⚠️ Embedding cache store failed: {e}")
+
+    def get_many(self, texts: List[str]) -> Dict[str, List[float]]:
+        """Cached embeddings of many texts with one MongoDB round trip, keyed by text"""
+        if not self.enabled or not texts:
+            return {}
+        keys = {text: self.key(text) for text in texts}
+        found: Dict[str, List[float]] = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys.values()):
+                vector = self._lru.get(key)
+                if vector is None:
+                    missing.append(key)
+                    continue
+                self._lru.move_to_end(key)
+                found[key] = vector
+                self.counters['memory_hits'] += 1
+
+        docs = []
+        if missing and self.collection is not None:
+            try:
+                docs = list(self.collection.find({'_id': {'$in': missing}}, {'vector': 1}))
+                if docs:
+                    self.collection.update_many(
+                        {'_id': {'$in': [doc['_id'] for doc in docs]}},
+                        {'$set': {'last_used_at': datetime.now()}, '$inc': {'hits': 1}}
+                    )
+            except Exception as e:
+                print(f"⚠️ Embedding cache lookup failed: {e}")
+                docs = []
+            for doc in docs:
+                vector = np.frombuffer(bytes(doc['vector']), dtype='<f4').tolist()
+                self._remember(doc['_id'], vector)
+                found[doc['_id']] = vector
+
+        with self._lock:
+            self.counters['mongo_hits'] += len(docs)
+            self.counters['misses'] += len(missing) - len(docs)
+        return {text: found[key] for text, key in keys.items() if key in found}
+
+    def put_many(self, items: List[Tuple[str, List[float]]]):
+        """Store many (text, embedding) pairs in both tiers with one bulk write"""
+        if not self.enabled or not items:
+            return
+        now = datetime.now()
+        operations = []
+        for text, vector in items:
+            key = self.key(text)
+            self._remember(key, vector)
+            operations.append(UpdateOne(*self._upsert(key, text, vector, now), upsert=True))
+        evict = self._count_stores(len(items))
+        if self.collection is None:
+            return
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            if evict:
+                self.evict()
+        except Exception as e:
+            print(f"⚠️ Embedding cache store failed: {e}")
+
+    def _upsert(self, key: str, text: str, vector: List[float], now: datetime) -> Tuple[Dict, Dict]:
+        return (
+            {'_id': key},
+            {
+                '$set': {
+                    'model': self.model,
+                    'query': self.normalize(text),
+                    'vector': Binary(np.asarray(vector, dtype='<f4').tobytes()),
+                    'last_used_at': now
+                },
+                '$setOnInsert': {'created_at': now, 'hits': 0}
+            }
+        )
+
+    def _count_stores(self, stores: int) -> bool:
+        """Record stores, True when the size of the MongoDB tier is due for a check"""
+        with self._lock:
+            self.counters['stores'] += stores
+            self._stores_since_evict += stores
+            if self._stores_since_evict < EMBEDDING_CACHE_EVICT_EVERY:
+                return False
+            self._stores_since_evict = 0
+            return True
+
+    def evict(self) -> int:
+        """Drop the least recently used MongoDB entries above max_entries"""
+        excess = self.collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return 0
+        stale = [doc['_id'] for doc in self.collection.find({}, {'_id': 1}).sort('last_used_at', 1).limit(excess)]
+        removed = self.collection.delete_many({'_id': {'$in': stale}}).deleted_count
+        with self._lock:
+            self.counters['evicted'] += removed
+        return removed
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        vector = self.get(text)
+        if vector is None:
+            vector = compute(text)
+            self.put(text, vector)
+        return vector
+
+    def warm(self, texts: List[str], compute: Callable[[str], List[float]]) -> int:
+        """Embed every text that is not cached yet, returns number of new embeddings"""
+        embedded = 0
+        for text in texts:
+            if self.get(text) is None:
+                self.put(text, compute(text))
+                embedded += 1
+        print(f"✅ Embedding cache warmed: {embedded} new, {len(texts) - embedded} already cached")
+        return embedded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._lru)
+        lookups = stats['memory_hits'] + stats['mongo_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['mongo_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_capacity'] = self.max_size
+        stats['model'] = self.model
+        if self.collection is not None and self.enabled:
+            try:
+                stats['mongo_entries'] = self.collection.estimated_document_count()
+            except Exception:
+                stats['mongo_entries'] = None
+        return stats
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_query_cache(db, model: str) -> EmbeddingCache:
+    """Process-wide cache for a database and embedding model (shared by every service)"""
+    key = f"{getattr(db, 'name', None)}.{model}"
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = EmbeddingCache(db, model)
+            _caches[key] = cache
+        return cache
+
+
+def get_content_cache(db, model: str) -> EmbeddingCache:
+    """Process-wide content-hash cache of ingested text for a database and embedding model"""
+    key = f"{getattr(db, 'name', None)}.{model}.content"
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = EmbeddingCache(
+                db, model,
+                max_size=EMBEDDING_DEDUP_MEMORY_SIZE if EMBEDDING_DEDUP else 0,
+                collection_name=CONTENT_CACHE_COLLECTION,
+                ttl_seconds=EMBEDDING_DEDUP_TTL_SECONDS,
+                max_entries=EMBEDDING_DEDUP_MAX_ENTRIES,
+                normalize=normalize_content
+            )
+            _caches[key] = cache
+        return cache
+
+
+if __name__ == '__main__':
+    from services import get_db, VectorSearchService
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    service = VectorSearchService(get_db())
+    if command == 'warm':
+        from intelligent_qa import IntelligentQAService
+        service.warm_query_cache(IntelligentQAService(service.db).suggest_questions())
+    elif command == 'stats':
+        print(service.query_cache.stats())
+        print(service.content_cache.stats())
+    else:
+        print("Usage: python embedding_cache.py warm|stats")
+        sys.exit(1)
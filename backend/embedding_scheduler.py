@@ -0,0 +1,228 @@
+"""
+Rate-limited, concurrent scheduler for Azure OpenAI embedding requests
+Requests run on a bounded thread pool and draw from two token buckets sized
+from the deployment's RPM and TPM quota. Throttled (429) and transient
+failures are retried with the server's Retry-After when it sends one, and
+jittered exponential backoff otherwise; a 429 pauses every worker, not just
+the one that hit it. Each run reports the throughput it achieved so the
+quota settings can be tuned to saturate the deployment without throttling.
+
+Usage:
+    EMBEDDING_RPM=300                 requests per minute this process may send (0 = no limit)
+    EMBEDDING_TPM=350000              tokens per minute this process may send (0 = no limit)
+    EMBEDDING_CONCURRENCY=4           requests in flight at once
+    EMBEDDING_MAX_RETRIES=6           attempts after the first before a request fails
+
+The quota belongs to the deployment, so with several workers give each
+process its share of it.
+"""
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Callable, Union
+from openai import APIConnectionError
+
+EMBEDDING_RPM = float(os.environ.get('EMBEDDING_RPM', '0'))
+EMBEDDING_TPM = float(os.environ.get('EMBEDDING_TPM', '0'))
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', '4'))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', '6'))
+EMBEDDING_BACKOFF_BASE_SECONDS = float(os.environ.get('EMBEDDING_BACKOFF_BASE_SECONDS', '1'))
+EMBEDDING_BACKOFF_MAX_SECONDS = float(os.environ.get('EMBEDDING_BACKOFF_MAX_SECONDS', '60'))
+# Azure evaluates quota over short windows, so bursts are capped at this many seconds of quota
+EMBEDDING_RATE_WINDOW_SECONDS = float(os.environ.get('EMBEDDING_RATE_WINDOW_SECONDS', '10'))
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 units per second, holding at most one window of quota"""
+
+    def __init__(self, per_minute: float, window_seconds: float = EMBEDDING_RATE_WINDOW_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(self.rate * window_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float) -> float:
+        """Block until `amount` units are available and take them, returns seconds waited"""
+        if not self.enabled:
+            return 0.0
+        # A request larger than a full bucket still has to go out eventually
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """Empty the bucket after the server reported throttling"""
+        with self._lock:
+            self.tokens = 0.0
+            self.updated_at = time.monotonic()
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Delay the server asked for (retry-after-ms / retry-after headers), if any"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    for header, unit in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(float(value) * unit, 0.0)
+        except (TypeError, ValueError):
+            continue  # HTTP-date form, fall back to backoff
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        return isinstance(error, APIConnectionError)
+    return status in RETRYABLE_STATUS or status >= 500
+
+
+class EmbeddingScheduler:
+    """Runs embedding requests concurrently within the deployment's RPM/TPM quota"""
+
+    def __init__(self, client, model: str, rpm: float = EMBEDDING_RPM, tpm: float = EMBEDDING_TPM,
+                 concurrency: int = EMBEDDING_CONCURRENCY, max_retries: int = EMBEDDING_MAX_RETRIES):
+        # Retries are ours: the SDK's own backoff would ignore the shared buckets
+        self.client = client.with_options(max_retries=0) if hasattr(client, 'with_options') else client
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = max(concurrency, 1)
+        self.max_retries = max_retries
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.counters = {'requests': 0, 'inputs': 0, 'tokens': 0, 'throttled': 0,
+                         'retries': 0, 'failures': 0, 'wait_seconds': 0.0}
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def _wait_for_pause(self) -> float:
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full jitter keeps workers that failed together from retrying together
+            delay = random.uniform(0, min(EMBEDDING_BACKOFF_MAX_SECONDS,
+                                          EMBEDDING_BACKOFF_BASE_SECONDS * 2 ** attempt))
+        else:
+            delay += random.uniform(0, EMBEDDING_BACKOFF_BASE_SECONDS)
+        if getattr(error, 'status_code', None) == 429:
+            # Everyone holds off until the window the server named has passed
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.requests.drain()
+            self.tokens.drain()
+        return delay
+
+    def create(self, inputs: Union[str, List[str]], tokens: int):
+        """One embeddings.create call within quota, retried on throttling and transient errors"""
+        attempt = 0
+        while True:
+            waited = self._wait_for_pause()
+            waited += self.requests.acquire(1)
+            waited += self.tokens.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(input=inputs, model=self.model)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self._count(failures=1, wait_seconds=waited)
+                    raise
+                delay = self._backoff(attempt, e)
+                self._count(retries=1, throttled=int(getattr(e, 'status_code', None) == 429),
+                            wait_seconds=waited + delay)
+                print(f"⚠️ Embedding request failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._count(requests=1, inputs=1 if isinstance(inputs, str) else len(inputs),
+                        tokens=tokens, wait_seconds=waited)
+            return response
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                    thread_name_prefix='embedding')
+            return self._executor
+
+    def run_all(self, job: Callable[[Any], None], items: List[Any]) -> List[Optional[Exception]]:
+        """Run job(item) for every item on the worker pool, returns the exception of each (or None)"""
+        if not items:
+            return []
+        before = self.stats()
+        started = time.monotonic()
+        futures = [self._pool().submit(job, item) for item in items]
+        errors = [future.exception() for future in futures]
+        self._report(before, time.monotonic() - started)
+        return errors
+
+    def _report(self, before: Dict[str, Any], elapsed: float):
+        after = self.stats()
+        run = {name: after[name] - before[name] for name in self.counters}
+        minutes = max(elapsed, 1e-6) / 60.0
+        run['seconds'] = round(elapsed, 2)
+        run['requests_per_minute'] = round(run['requests'] / minutes, 1)
+        run['tokens_per_minute'] = round(run['tokens'] / minutes, 1)
+        run['tpm_utilization'] = round(run['tokens_per_minute'] / (self.tokens.rate * 60), 3) if self.tokens.enabled else None
+        self.last_run = run
+        utilization = f" ({run['tpm_utilization']:.0%} of TPM)" if run['tpm_utilization'] is not None else ''
+        print(f"📈 Embedded {run['inputs']} inputs in {run['requests']} requests over {elapsed:.1f}s: "
+              f"{run['requests_per_minute']:.0f} req/min, {run['tokens_per_minute']:.0f} tokens/min{utilization}, "
+              f"{run['throttled']} throttled, {run['retries']} retries")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats['rpm_limit'] = self.requests.rate * 60 if self.requests.enabled else None
+        stats['tpm_limit'] = self.tokens.rate * 60 if self.tokens.enabled else None
+        stats['concurrency'] = self.concurrency
+        stats['last_run'] = self.last_run
+        return stats
+
+
+_schedulers: Dict[str, EmbeddingScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_embedding_scheduler(client, model: str) -> EmbeddingScheduler:
+    """Process-wide scheduler per client and deployment, so every service shares one quota"""
+    key = f"{id(client)}.{model}"
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = EmbeddingScheduler(client, model)
+            _schedulers[key] = scheduler
+        return scheduler
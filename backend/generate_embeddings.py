@@ -7,7 +7,8 @@ import os
 import sys
 from pymongo import MongoClient
 from openai import AzureOpenAI
-from datetime import datetime
+
+from services import VectorSearchService, EMBEDDING_BATCH_MAX_INPUTS
 
 # Configuration from environment variables
 MONGO_URI = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/rfp_db')
@@ -66,83 +67,80 @@ def generate_embeddings():
         print(f"❌ Failed to fetch entries: {e}")
         return False
     
-    # 4. Generate embeddings for each entry
+    # 4. Generate embeddings in batches (many inputs per Azure request)
     print("\n🔄 Generating embeddings...")
-    print(f"   This will take approximately {int(total_entries * 2)} seconds...")
+    print(f"   Up to {EMBEDDING_BATCH_MAX_INPUTS} entries per embedding request")
     print()
     
+    vector_service = VectorSearchService(db)
+    vector_service.azure_client = azure_client  # use the client configured above
+    
+    # One query for the entries that already have embeddings
+    existing = {doc['entry_id'] for doc in db.vector_embeddings.find({}, {'_id': 0, 'entry_id': 1})}
+    
     entries = db.rfp_entries.find({})
     processed = 0
     skipped = 0
     errors = 0
+    batch = []
+    
+    def flush():
+        nonlocal processed, errors
+        stored = vector_service.index_documents(batch)
+        processed += stored.count(True)
+        errors += stored.count(False)
+        for (entry_id, _, _), ok in zip(batch, stored):
+            if not ok:
+                print(f"   ❌ Error processing entry {entry_id}")
+        batch.clear()
+        progress = ((processed + skipped + errors) / total_entries) * 100
+        print(f"   📊 Progress: {processed + skipped + errors}/{total_entries} ({progress:.1f}%)")
     
     for entry in entries:
         entry_id = str(entry['_id'])
         
-        try:
-            # Check if embedding already exists
-            existing = db.vector_embeddings.find_one({'entry_id': entry_id})
-            if existing:
-                skipped += 1
-                if skipped % 10 == 0:
-                    print(f"   ⏭️  Skipped {skipped} (already have embeddings)")
-                continue
-            
-            # Prepare text for embedding
-            requirement = entry.get('requirement', '')
-            product = entry.get('product', '')
-            category = entry.get('requirement_category', '')
-            
-            # Combine fields for better semantic search
-            text_to_embed = f"{product} {category}: {requirement}"
-            
-            # Generate embedding
-            response = azure_client.embeddings.create(
-                input=text_to_embed,
-                model=AZURE_EMBEDDING_MODEL
-            )
-            vector = response.data[0].embedding
-            
-            # Store in MongoDB
-            vector_doc = {
-                'entry_id': entry_id,
-                'document_id': entry.get('document_id'),
-                'vector': vector,
-                'metadata': {
-                    'product': entry.get('product'),
-                    'requirement': entry.get('requirement'),
-                    'requirement_category': entry.get('requirement_category'),
-                    'response_category': entry.get('response_category'),
-                    'effort_required': entry.get('effort_required'),
-                    'comments': entry.get('comments'),
-                    'sheet_name': entry.get('sheet_name'),
-                    'file_name': entry.get('file_name'),
-                    'rfp_name': entry.get('rfp_name'),
-                    'bank_name': entry.get('bank_name'),
-                    'date': entry.get('date')
-                },
-                'created_at': datetime.now()
-            }
-            
-            db.vector_embeddings.upsert_one(
-                {'entry_id': entry_id},
-                {'$set': vector_doc},
-                upsert=True
-            )
-            
-            processed += 1
-            
-            if processed % 10 == 0:
-                progress = (processed / total_entries) * 100
-                print(f"   📊 Progress: {processed}/{total_entries} ({progress:.1f}%)")
+        # Skip entries that already have an embedding
+        if entry_id in existing:
+            skipped += 1
+            continue
         
-        except Exception as e:
-            errors += 1
-            print(f"   ❌ Error processing entry {entry_id}: {e}")
+        # Combine fields for better semantic search
+        requirement = entry.get('requirement', '')
+        product = entry.get('product', '')
+        category = entry.get('requirement_category', '')
+        text_to_embed = f"{product} {category}: {requirement}"
+        
+        batch.append((entry_id, text_to_embed, {
+            'product': entry.get('product'),
+            'requirement': entry.get('requirement'),
+            'requirement_category': entry.get('requirement_category'),
+            'response_category': entry.get('response_category'),
+            'effort_required': entry.get('effort_required'),
+            'comments': entry.get('comments'),
+            'sheet_name': entry.get('sheet_name'),
+            'file_name': entry.get('file_name'),
+            'rfp_name': entry.get('rfp_name'),
+            'bank_name': entry.get('bank_name'),
+            'document_id': str(entry['document_id']) if entry.get('document_id') else None,
+            'date': entry.get('date')
+        }))
+        if len(batch) >= EMBEDDING_BATCH_MAX_INPUTS:
+            try:
+                flush()
+            except Exception as e:
+                print(f"   ❌ Error embedding batch: {e}")
+                return False
             if errors > 10:
                 print("   ⚠️  Too many errors, stopping...")
                 return False
     
+    if batch:
+        try:
+            flush()
+        except Exception as e:
+            print(f"   ❌ Error embedding batch: {e}")
+            return False
+    
     # 5. Summary
     print("\n" + "="*80)
     print("✅ Embedding Generation Complete!")
@@ -0,0 +1,70 @@
+"""
+Checkpoints of committed ingestion batches
+Every row batch that was fully written to rfp_entries and indexed is recorded
+per document and sheet with the content hash of each of its rows. Entries have
+deterministic ids derived from (document, sheet, row), so writes are
+idempotent: when ingestion is restarted after a crash or timeout, batches whose
+checkpoint matches the freshly extracted rows are skipped and only the
+unfinished tail is written and embedded again.
+"""
+
+import json
+import hashlib
+from datetime import datetime
+from typing import List, Dict, Any, Tuple
+
+CHECKPOINTS_COLLECTION = 'ingest_checkpoints'
+
+# Metadata that changes on every run without the row changing
+VOLATILE_FIELDS = ('date', 'created_at', 'last_modified')
+
+
+def row_hash(text: str, metadata: Dict[str, Any]) -> str:
+    """Content hash of one row's indexed text and metadata"""
+    stable = {k: v for k, v in metadata.items() if k not in VOLATILE_FIELDS}
+    payload = json.dumps([text, stable], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def batch_hashes(batch: List[Tuple[int, Dict[str, Any], Tuple[str, str, Dict[str, Any]]]]) -> Tuple[str, List[str]]:
+    """(batch hash, row hashes) of a batch of (row number, rfp entry, vector item) rows"""
+    rows = [row_hash(text, metadata) for _, _, (_, text, metadata) in batch]
+    numbers = ','.join(str(row_number) for row_number, _, _ in batch)
+    digest = hashlib.sha1(f"{numbers}:{''.join(rows)}".encode('utf-8')).hexdigest()
+    return digest, rows
+
+
+class IngestCheckpoints:
+    """Committed batches of one database, one record per (document, sheet, first row)"""
+
+    def __init__(self, db):
+        self.collection = db[CHECKPOINTS_COLLECTION]
+        try:
+            self.collection.create_index([('document_id', 1), ('sheet_name', 1), ('first_row', 1)], unique=True)
+        except Exception as e:
+            print(f"Checkpoint index info: {e}")
+
+    def load(self, document_id: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """Committed batches of a document by (sheet name, first row)"""
+        committed = {}
+        for checkpoint in self.collection.find({'document_id': str(document_id)},
+                                               {'sheet_name': 1, 'first_row': 1, 'hash': 1, 'rows': 1}):
+            committed[(checkpoint['sheet_name'], checkpoint['first_row'])] = checkpoint
+        return committed
+
+    def commit(self, document_id: str, sheet_name: str, row_numbers: List[int],
+               digest: str, row_hashes: List[str]):
+        """Record a batch as fully written and indexed"""
+        key = {'document_id': str(document_id), 'sheet_name': sheet_name, 'first_row': row_numbers[0]}
+        self.collection.update_one(key, {'$set': {
+            **key,
+            'last_row': row_numbers[-1],
+            'hash': digest,
+            'rows': len(row_numbers),
+            'row_numbers': row_numbers,
+            'row_hashes': row_hashes,
+            'committed_at': datetime.utcnow()
+        }}, upsert=True)
+
+    def clear(self, document_id: str) -> int:
+        return self.collection.delete_many({'document_id': str(document_id)}).deleted_count
@@ -7,6 +7,7 @@ import os
 from typing import List, Dict, Any, Optional
 from openai import AzureOpenAI
 from services import VectorSearchService, get_db
+from lexical_index import keyword_search, tokenize
 
 # Azure OpenAI configuration
 # Support multiple environment variable names for flexibility
@@ -378,10 +379,10 @@ Please provide a comprehensive answer based on the RFP requirements above."""
         Fallback to simple MongoDB text search when vector/GPT unavailable
         """
         try:
-            from services import get_db
-            db = get_db()
+            # Reuse the service's connection (and its process-wide lexical index)
+            db = self.vector_service.db
             
-            if not db:
+            if db is None:
                 return {
                     'answer': "Database connection not available.",
                     'sources': [],
@@ -389,14 +390,8 @@ Please provide a comprehensive answer based on the RFP requirements above."""
                     'confidence': 0.0
                 }
             
-            # Simple text search on requirement field
-            search_terms = question.lower().split()
-            regex_patterns = [
-                {'requirement': {'$regex': term, '$options': 'i'}} 
-                for term in search_terms if len(term) > 2
-            ]
-            
-            if not regex_patterns:
+            # Token search on the in-memory lexical index (no collection scan)
+            if not tokenize(question):
                 return {
                     'answer': "Please provide more specific search terms.",
                     'sources': [],
@@ -404,7 +399,7 @@ Please provide a comprehensive answer based on the RFP requirements above."""
                     'confidence': 0.0
                 }
             
-            results = list(db.rfp_entries.find({'$or': regex_patterns}).limit(top_n))
+            results = keyword_search(db, question, top_n, self.vector_service._metadata_filters(filters))
             
             if not results:
                 return {
@@ -589,6 +584,14 @@ Please provide a comprehensive answer based on the RFP requirements above."""
         ]
         
         return suggestions
+    
+    def warm_suggestions(self) -> int:
+        """Pre-compute query embeddings for the suggested questions"""
+        try:
+            return self.vector_service.warm_query_cache(self.suggest_questions())
+        except Exception as e:
+            print(f"⚠️ Could not pre-warm query embeddings: {e}")
+            return 0
 
 
 # Example usage and testing
@@ -0,0 +1,311 @@
+"""
+Background ingestion jobs
+Uploads, column mappings and reprocessing run as jobs instead of inside the
+HTTP request. Every job is recorded in MongoDB (type, priority, status,
+timings, error) and runs on Celery when a broker with at least one live worker
+answers, otherwise on a bounded in-process worker pool. Record counts stay on
+the document, which the status endpoints merge into the job's progress.
+A running job holds a lease that its worker renews while it runs; when the
+worker is killed the lease expires and the job is claimed and run again
+(ingestion resumes from its checkpoints).
+
+Usage:
+    JOB_BACKEND=auto            auto (Celery if a worker answers) | local | celery
+    JOB_WORKERS=2               jobs running at once in each web process (local backend)
+    JOB_LEASE_SECONDS=300       a running job whose worker stopped renewing for this long is run again
+"""
+
+import os
+import time
+import queue
+import socket
+import itertools
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+from bson import ObjectId
+from pymongo import ReturnDocument, DESCENDING
+from pymongo.errors import PyMongoError
+
+from services import celery, get_db, FileProcessingService
+
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'auto').lower()
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# How long a Celery availability check is trusted
+JOB_BACKEND_CHECK_SECONDS = float(os.environ.get('JOB_BACKEND_CHECK_SECONDS', '60'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '300'))
+
+JOBS_COLLECTION = 'jobs'
+# Lower runs first (same convention as Celery message priorities)
+PRIORITIES = {'high': 0, 'normal': 5, 'low': 9}
+
+_handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def job_handler(job_type: str):
+    """Register the function that runs jobs of a type"""
+    def register(func):
+        _handlers[job_type] = func
+        return func
+    return register
+
+
+@job_handler('process_document')
+def _process_document(job: Dict[str, Any]):
+    FileProcessingService.process_document(job['document_id'])
+
+
+@job_handler('apply_mapping')
+def _apply_mapping(job: Dict[str, Any]):
+    FileProcessingService.apply_mapping_and_process(job['document_id'], job['args']['mappings'])
+
+
+def _lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def _renew_lease(db, job_id: ObjectId, claim: ObjectId, done: threading.Event):
+    """Heartbeat of a running job, until it finishes or another worker took it over"""
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            result = db[JOBS_COLLECTION].update_one(
+                {'_id': job_id, 'claim': claim, 'status': 'running'},
+                {'$set': {'lease_until': _lease_until(), 'heartbeat_at': datetime.utcnow()}}
+            )
+        except PyMongoError as e:
+            # A blip or an election must not let the lease lapse, try again on the next tick
+            print(f"⚠️ Lease renewal of job {job_id} failed, retrying: {e}")
+            continue
+        if result.matched_count == 0:
+            return
+
+
+def run_job(db, job_id: ObjectId) -> bool:
+    """
+    Claim a queued job, or a running one whose lease expired, and run it.
+    Returns False if it is claimed by a live worker or finished.
+    """
+    now = datetime.utcnow()
+    claim = ObjectId()
+    job = db[JOBS_COLLECTION].find_one_and_update(
+        {'_id': job_id, '$or': [{'status': 'queued'},
+                                {'status': 'running', 'lease_until': {'$lt': now}}]},
+        {'$set': {'status': 'running', 'started_at': now, 'claim': claim, 'lease_until': _lease_until(),
+                  'worker': f"{socket.gethostname()}:{os.getpid()}"},
+         '$inc': {'attempts': 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        return False
+
+    retry = f" (attempt {job['attempts']})" if job['attempts'] > 1 else ''
+    print(f"▶️ Job {job_id} ({job['type']}) started for document {job['document_id']}{retry}")
+    done = threading.Event()
+    threading.Thread(target=_renew_lease, args=(db, job_id, claim, done), daemon=True).start()
+    error = None
+    try:
+        _handlers[job['type']](job)
+    except Exception as e:
+        error = str(e)
+    finally:
+        done.set()
+
+    # Processing functions record their own failures on the document
+    document = db.documents.find_one({'_id': ObjectId(job['document_id'])}, {'status': 1, 'error_details': 1})
+    if error is None and document and document.get('status') == 'failed':
+        details = document.get('error_details') or [{}]
+        error = details[0].get('error', 'processing failed')
+    db[JOBS_COLLECTION].update_one(
+        {'_id': job_id, 'claim': claim},
+        {'$set': {'status': 'failed' if error else 'completed', 'error': error, 'finished_at': datetime.utcnow()},
+         '$unset': {'lease_until': ''}}
+    )
+    print(f"{'❌' if error else '✅'} Job {job_id} {'failed: ' + error if error else 'completed'}")
+    return True
+
+
+@celery.task(name='jobs.run_job')
+def run_job_task(job_id: str):
+    run_job(get_db(), ObjectId(job_id))
+
+
+class LocalJobPool:
+    """Priority queue drained by a fixed number of daemon threads in this process"""
+
+    def __init__(self, db, workers: int = JOB_WORKERS):
+        self.db = db
+        self.workers = max(workers, 1)
+        self._queue: 'queue.PriorityQueue' = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Started on first use, after any pre-fork of the web server
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            reaper = threading.Thread(target=self._reap, name='job-reaper', daemon=True)
+            reaper.start()
+            self._threads.append(reaper)
+        self.recover()
+
+    def submit(self, job_id: ObjectId, priority: int):
+        self.start()
+        self._queue.put((priority, next(self._order), job_id))
+
+    def recover(self, expired_only: bool = False) -> int:
+        """
+        Re-queue local jobs left queued, or running with an expired lease, by a process that
+        exited (claiming is atomic, a job queued twice runs once)
+        """
+        expired = {'status': 'running', 'lease_until': {'$lt': datetime.utcnow()}}
+        query = expired if expired_only else {'$or': [{'status': 'queued'}, expired]}
+        recovered = 0
+        for job in self.db[JOBS_COLLECTION].find({**query, 'backend': 'local'}, {'priority': 1}):
+            self._queue.put((job.get('priority', PRIORITIES['normal']), next(self._order), job['_id']))
+            recovered += 1
+        if recovered:
+            print(f"🔁 Re-queued {recovered} pending local job(s)")
+        return recovered
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _reap(self):
+        # Jobs of workers killed while this process runs (queued ones are already in a queue)
+        while True:
+            time.sleep(JOB_LEASE_SECONDS)
+            try:
+                self.recover(expired_only=True)
+            except Exception as e:
+                print(f"⚠️ Job recovery failed: {e}")
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            try:
+                run_job(self.db, job_id)
+            except Exception as e:
+                print(f"❌ Job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+class JobQueue:
+    """Submits jobs to Celery when a worker is reachable, else to the local pool"""
+
+    def __init__(self, db):
+        self.db = db
+        self.local = LocalJobPool(db)
+        self._celery_ok: Optional[bool] = None
+        self._celery_checked_at = 0.0
+        try:
+            self.db[JOBS_COLLECTION].create_index([('document_id', 1), ('created_at', DESCENDING)])
+            self.db[JOBS_COLLECTION].create_index('status')
+        except Exception as e:
+            print(f"Jobs index info: {e}")
+
+    def celery_available(self) -> bool:
+        if JOB_BACKEND in ('local', 'celery'):
+            return JOB_BACKEND == 'celery'
+        now = time.time()
+        if self._celery_ok is None or now - self._celery_checked_at >= JOB_BACKEND_CHECK_SECONDS:
+            try:
+                with celery.connection_for_write() as connection:
+                    connection.ensure_connection(max_retries=1)
+                # A reachable broker is not enough, someone has to consume the queue
+                self._celery_ok = bool(celery.control.ping(timeout=1.0))
+            except Exception:
+                self._celery_ok = False
+            self._celery_checked_at = now
+        return self._celery_ok
+
+    def submit(self, job_type: str, document_id: str, args: Optional[Dict[str, Any]] = None,
+               priority: str = 'normal') -> str:
+        """Record and enqueue a job, returns its id"""
+        if job_type not in _handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        level = PRIORITIES.get(priority, PRIORITIES['normal'])
+        backend = 'celery' if self.celery_available() else 'local'
+        if backend == 'local':
+            # Recover leftovers before this job is recorded, so it is not queued twice
+            self.local.start()
+        job_id = ObjectId()
+        self.db[JOBS_COLLECTION].insert_one({
+            '_id': job_id,
+            'type': job_type,
+            'document_id': str(document_id),
+            'args': args or {},
+            'priority': level,
+            'backend': backend,
+            'status': 'queued',
+            'created_at': datetime.utcnow()
+        })
+        print(f"📋 Job {job_id} ({job_type}) queued on {backend} for document {document_id}")
+        if backend == 'celery':
+            try:
+                run_job_task.apply_async(args=[str(job_id)], priority=level)
+            except Exception as e:
+                print(f"⚠️ Celery submit failed ({e}), running job {job_id} locally")
+                self._celery_ok = False
+                self.db[JOBS_COLLECTION].update_one({'_id': job_id}, {'$set': {'backend': 'local'}})
+                self.local.submit(job_id, level)
+        else:
+            self.local.submit(job_id, level)
+        return str(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.db[JOBS_COLLECTION].find_one({'_id': ObjectId(job_id)})
+
+    def latest_for_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+        return self.db[JOBS_COLLECTION].find_one({'document_id': str(document_id)}, sort=[('created_at', DESCENDING)])
+
+    def describe(self, job: Dict[str, Any], document: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """JSON view of a job with the live record counts of its document"""
+        if document is None:
+            document = self.db.documents.find_one(
+                {'_id': ObjectId(job['document_id'])},
+                {'status': 1, 'records_processed': 1, 'total_records': 1, 'sheets': 1}
+            ) or {}
+        processed = document.get('records_processed') or 0
+        total = document.get('total_records') or 0
+        view = {
+            'job_id': str(job['_id']),
+            'type': job['type'],
+            'document_id': job['document_id'],
+            'status': job['status'],
+            'backend': job.get('backend'),
+            'priority': job.get('priority'),
+            'error': job.get('error'),
+            'progress': {
+                'records_processed': processed,
+                'total_records': total,
+                'percent': round(100.0 * processed / total, 1) if total else None,
+                'sheets': document.get('sheets', [])
+            }
+        }
+        for field in ('created_at', 'started_at', 'finished_at'):
+            view[field] = job[field].isoformat() if job.get(field) else None
+        if job['status'] == 'queued' and job.get('backend') == 'local':
+            view['queue_depth'] = self.local.pending()
+        return view
+
+
+_queues: Dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(db) -> JobQueue:
+    """Process-wide job queue for a database"""
+    key = str(getattr(db, 'name', None))
+    with _queues_lock:
+        job_queue = _queues.get(key)
+        if job_queue is None:
+            job_queue = JobQueue(db)
+            _queues[key] = job_queue
+        return job_queue
@@ -0,0 +1,352 @@
+"""
+BM25 inverted index over RFP requirements and documentation chunks
+Exact tokens such as product codes (MLC, EPLC, MT700) are matched lexically
+instead of relying on embeddings. Postings are compact numpy arrays (row ids +
+term frequencies); rows written by ingestion are appended to a small pending
+list that is merged into a term's arrays the first time a query touches it.
+
+Usage:
+    SEARCH_MODE=hybrid           fuse BM25 and vector ranks (reciprocal rank fusion)
+"""
+
+import os
+import re
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+
+from vector_index import (
+    resident_metadata, top_k, FILTER_FIELDS, VECTOR_INDEX_REFRESH_SECONDS, VECTOR_INDEX_REFRESH_WINDOW_SECONDS
+)
+
+# 'vector' ranks by embedding similarity only, 'hybrid' fuses BM25 and vector ranks
+SEARCH_MODE = os.environ.get('SEARCH_MODE', 'vector').lower()
+HYBRID_RRF_K = int(os.environ.get('HYBRID_RRF_K', '60'))
+# Depth of each ranking fed into the fusion
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', '100'))
+BM25_K1 = float(os.environ.get('BM25_K1', '1.2'))
+BM25_B = float(os.environ.get('BM25_B', '0.75'))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its of on or our shall should
+that the their there these this to was we what when where which who will with would you your
+""".split())
+
+# Filterable fields with a per-row value code array (_source tells rfp_entries from chunks)
+LEXICAL_FILTER_FIELDS = FILTER_FIELDS + ('_source',)
+
+RFP_ENTRY_FIELDS = ('product', 'requirement', 'requirement_category', 'response_category',
+                    'effort_required', 'comments', 'sheet_name', 'file_name', 'rfp_name', 'bank_name', 'date')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric tokens without stop words"""
+    return [token for token in TOKEN_PATTERN.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+def document_text(text: str, metadata: Optional[Dict[str, Any]]) -> str:
+    """Indexed text of an entry: its product (codes are strong signals) plus the text itself"""
+    metadata = metadata or {}
+    product = metadata.get('product') or metadata.get('related_product') or ''
+    return f"{product} {text or ''}"
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = HYBRID_RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: score(id) = sum over rankings of 1 / (k + rank)"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, entry_id in enumerate(ranking, 1):
+            fused[entry_id] = fused.get(entry_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    BM25 index of rfp_entries (entry_id = str(_id)) and documentation chunks
+    (vector_embeddings entries whose metadata carries the chunk text).
+
+    Replaced or deleted rows are only marked dead; a full reload compacts them.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._checked_at = 0.0
+        self._reset()
+
+    def _reset(self):
+        self.ids: List[str] = []
+        self.document_ids: List[Optional[str]] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self._row_of: Dict[str, int] = {}
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._live = 0
+        self._total_length = 0.0
+        self._rfp_rows = 0
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        # Per filter field: value -> code, and the code of every row (-1 = no value)
+        self._value_codes: Dict[str, Dict[Any, int]] = {field: {} for field in LEXICAL_FILTER_FIELDS}
+        self._row_codes: Dict[str, np.ndarray] = {field: np.zeros(0, dtype=np.int32)
+                                                  for field in LEXICAL_FILTER_FIELDS}
+        self._loaded_until: Dict[str, Optional[datetime]] = {'rfp_entries': None, 'chunks': None}
+
+    def __len__(self) -> int:
+        return self._live
+
+    def _reserve(self, rows: int):
+        capacity = self._lengths.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        lengths = np.zeros(new_capacity, dtype=np.float32)
+        lengths[:self._size] = self._lengths[:self._size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._lengths, self._alive = lengths, alive
+        for field, codes in self._row_codes.items():
+            grown = np.full(new_capacity, -1, dtype=np.int32)
+            grown[:self._size] = codes[:self._size]
+            self._row_codes[field] = grown
+
+    def _kill(self, row: int):
+        if self._alive[row]:
+            self._alive[row] = False
+            self._live -= 1
+            self._total_length -= float(self._lengths[row])
+            if self.metadata[row].get('_source') == 'rfp_entries':
+                self._rfp_rows -= 1
+
+    def add(self, entry_id: str, text: str, document_id: Optional[str] = None,
+            metadata: Optional[Dict[str, Any]] = None, source: str = 'chunks',
+            created_at: Optional[datetime] = None):
+        """Reflect an entry just written to MongoDB by this process (an unloaded index picks it up on load)"""
+        with self._lock:
+            if self._loaded:
+                self._add(entry_id, text, document_id, metadata, source, created_at)
+
+    def _add(self, entry_id: str, text: str, document_id: Optional[str] = None,
+             metadata: Optional[Dict[str, Any]] = None, source: str = 'chunks',
+             created_at: Optional[datetime] = None, replace: bool = True):
+        """Index (or re-index) one entry; with replace=False an already indexed entry is kept"""
+        if not replace and entry_id in self._row_of:
+            return  # refreshes re-read a window of known entries, skip tokenizing them
+        counts: Dict[str, int] = {}
+        for token in tokenize(document_text(text, metadata)):
+            counts[token] = counts.get(token, 0) + 1
+        with self._lock:
+            if isinstance(created_at, datetime):
+                until = self._loaded_until.get(source)
+                if until is None or created_at > until:
+                    self._loaded_until[source] = created_at
+            if not replace and entry_id in self._row_of:
+                return
+            previous = self._row_of.get(entry_id)
+            if previous is not None:
+                self._kill(previous)
+            row = self._size
+            self._reserve(row + 1)
+            self._size += 1
+            self.ids.append(entry_id)
+            self.document_ids.append(str(document_id) if document_id is not None else None)
+            self.metadata.append({**resident_metadata(metadata), '_source': source})
+            self._row_of[entry_id] = row
+            for field in LEXICAL_FILTER_FIELDS:
+                value = self.document_ids[row] if field == 'document_id' else self.metadata[row].get(field)
+                if value is not None:
+                    codes = self._value_codes[field]
+                    self._row_codes[field][row] = codes.setdefault(value, len(codes))
+            length = float(sum(counts.values()))
+            self._lengths[row] = length
+            self._alive[row] = True
+            self._live += 1
+            self._total_length += length
+            if source == 'rfp_entries':
+                self._rfp_rows += 1
+            for token, tf in counts.items():
+                rows, tfs = self._pending.setdefault(token, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+
+    def remove_document(self, document_id: str) -> int:
+        with self._lock:
+            rows = [row for row, doc_id in enumerate(self.document_ids) if doc_id == document_id and self._alive[row]]
+            for row in rows:
+                self._kill(row)
+            return len(rows)
+
+    def _load_rfp_entries(self, mongo_filter: Dict[str, Any], replace: bool = True):
+        projection = {field: 1 for field in RFP_ENTRY_FIELDS}
+        projection.update({'document_id': 1, 'created_at': 1})
+        for doc in self.db.rfp_entries.find(mongo_filter, projection).batch_size(1000):
+            self._add(str(doc['_id']), doc.get('requirement') or '', doc.get('document_id'), doc,
+                      source='rfp_entries', created_at=doc.get('created_at'), replace=replace)
+
+    def _load_chunks(self, mongo_filter: Dict[str, Any], replace: bool = True):
+        mongo_filter = {'metadata.text': {'$exists': True}, **mongo_filter}
+        projection = {'_id': 0, 'entry_id': 1, 'document_id': 1, 'metadata': 1, 'created_at': 1}
+        for doc in self.db.vector_embeddings.find(mongo_filter, projection).batch_size(1000):
+            metadata = doc.get('metadata') or {}
+            self._add(doc['entry_id'], metadata.get('text') or '', doc.get('document_id'), metadata,
+                      source='chunks', created_at=doc.get('created_at'), replace=replace)
+
+    def load(self):
+        """(Re)build the index from MongoDB"""
+        started = time.time()
+        with self._lock:
+            self._reset()
+            self._load_rfp_entries({})
+            self._load_chunks({})
+            self._compact()
+            self._loaded = True
+            self._checked_at = time.time()
+        print(f"✅ Lexical index loaded: {self._live} entries, {len(self._postings)} terms "
+              f"in {time.time() - started:.2f}s")
+
+    def refresh(self, force: bool = False) -> bool:
+        """Pick up entries written by other processes since the last load (always catches up)"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+                return True
+            if not force and time.time() - self._checked_at < VECTOR_INDEX_REFRESH_SECONDS:
+                return True
+            self._checked_at = time.time()
+            # Also re-read a window below the watermark: created_at is stamped before a batch is
+            # written, so batches can commit out of order (known entries are skipped)
+            window = timedelta(seconds=VECTOR_INDEX_REFRESH_WINDOW_SECONDS)
+            since = {source: {'created_at': {'$gte': until - window}} if until else {}
+                     for source, until in self._loaded_until.items()}
+            self._load_rfp_entries(since['rfp_entries'], replace=False)
+            self._load_chunks(since['chunks'], replace=False)
+            # Deleted entries are only visible as a count mismatch (deleted chunks drop out at hydration);
+            # a reload also compacts rows left dead by re-indexing
+            if (self.db.rfp_entries.estimated_document_count() != self._rfp_rows
+                    or self._size - self._live > max(1000, self._live // 4)):
+                self.load()
+            return True
+
+    def _compact(self):
+        """Merge every pending posting into the arrays"""
+        for term in list(self._pending):
+            self._term_postings(term)
+
+    def _term_postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        pending = self._pending.pop(term, None)
+        postings = self._postings.get(term)
+        if pending is not None:
+            rows = np.asarray(pending[0], dtype=np.int32)
+            tfs = np.asarray(pending[1], dtype=np.float32)
+            if postings is not None:
+                rows = np.concatenate([postings[0], rows])
+                tfs = np.concatenate([postings[1], tfs])
+            postings = (rows, tfs)
+            self._postings[term] = postings
+        return postings
+
+    def _allowed_rows(self, metadata_filters: Optional[Dict[str, List[str]]]) -> np.ndarray:
+        """Mask of live rows passing every filter, one vectorized code lookup per field"""
+        allowed = self._alive[:self._size].copy()
+        for field, values in (metadata_filters or {}).items():
+            codes = self._row_codes.get(field)
+            if codes is None:
+                # Not a resident filter field, no row carries it
+                return np.zeros(self._size, dtype=bool)
+            wanted = [self._value_codes[field][value] for value in values if value in self._value_codes[field]]
+            if not wanted:
+                return np.zeros(self._size, dtype=bool)
+            allowed &= np.isin(codes[:self._size], wanted)
+        return allowed
+
+    def search(self, query: str, top_n: int,
+               metadata_filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[str, float]]:
+        """BM25-ranked (entry_id, score) pairs, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or self._live == 0:
+                return []
+            scores = np.zeros(self._size, dtype=np.float32)
+            average_length = self._total_length / max(self._live, 1)
+            alive = self._alive[:self._size]
+            allowed = self._allowed_rows(metadata_filters) if metadata_filters else alive
+            if not allowed.any():
+                return []
+            for term in terms:
+                postings = self._term_postings(term)
+                if postings is None:
+                    continue
+                rows, tfs = postings
+                # Document frequency counts every live row, only the filtered ones are scored
+                document_frequency = int(np.count_nonzero(alive[rows]))
+                keep = allowed[rows]
+                rows, tfs = rows[keep], tfs[keep]
+                if rows.size == 0:
+                    continue
+                idf = np.log(1.0 + (self._live - document_frequency + 0.5) / (document_frequency + 0.5))
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._lengths[rows] / max(average_length, 1e-6))
+                scores[rows] += idf * tfs * (BM25_K1 + 1.0) / (tfs + norm)
+            matched = np.flatnonzero(scores > 0)
+            if matched.size == 0:
+                return []
+            best = matched[top_k(scores[matched], top_n)]
+            return [(self.ids[row], float(scores[row])) for row in best.tolist()]
+
+    def hydrate(self, entry_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Metadata of rfp_entries hits that have no vector entry (one $in lookup)"""
+        object_ids = [ObjectId(entry_id) for entry_id in entry_ids if ObjectId.is_valid(entry_id)]
+        if not object_ids:
+            return {}
+        projection = {field: 1 for field in RFP_ENTRY_FIELDS}
+        projection['document_id'] = 1
+        hydrated = {}
+        for doc in self.db.rfp_entries.find({'_id': {'$in': object_ids}}, projection):
+            entry_id = str(doc.pop('_id'))
+            if doc.get('document_id') is not None:
+                doc['document_id'] = str(doc['document_id'])
+            hydrated[entry_id] = doc
+        return hydrated
+
+    def describe(self) -> Dict[str, Any]:
+        return {'entries': self._live, 'terms': len(self._postings) + len(self._pending),
+                'dead_rows': self._size - self._live, 'mode': SEARCH_MODE}
+
+
+def keyword_search(db, question: str, limit: int,
+                   metadata_filters: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+    """
+    RFP entries best matching the question's tokens, for the fallbacks used when
+    embeddings are unavailable. Cost depends on the postings of the query terms,
+    not on the size of rfp_entries.
+    """
+    index = get_lexical_index(db)
+    index.refresh()
+    hits = index.search(question, limit, {**(metadata_filters or {}), '_source': ['rfp_entries']})
+    entries = index.hydrate([entry_id for entry_id, _ in hits])
+    results = []
+    for entry_id, score in hits:
+        entry = entries.get(entry_id)
+        if entry is not None:
+            results.append({'_id': entry_id, **entry, 'keyword_score': score})
+    return results
+
+
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(db) -> LexicalIndex:
+    """Process-wide lexical index for a database (shared by every service instance)"""
+    key = str(getattr(db, 'name', None))
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = LexicalIndex(db)
+            _indexes[key] = index
+        return index
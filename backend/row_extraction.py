@@ -0,0 +1,258 @@
+"""
+Streaming, columnar extraction of RFP rows from Excel workbooks
+Sheets are read in fixed-size row chunks (openpyxl read-only mode for
+.xlsx/.xlsm), so memory follows the chunk size rather than the workbook size.
+Each chunk gets the column mapping, NaN cleaning, string stripping, the short
+requirement filter and the simple-mode "col: value | ..." serialization one
+column at a time with pandas string operations, and becomes ready-to-insert
+(row number, rfp entry, vector item) batches for the ingestion flush. Entry
+ids are derived from (document, sheet, row), so re-ingesting a row overwrites
+the entry written the first time instead of duplicating it.
+"""
+
+import os
+import hashlib
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+import numpy as np
+import pandas as pd
+import openpyxl
+from bson import ObjectId
+
+# Requirements shorter than this are headers or stray cells, not requirements
+MIN_REQUIREMENT_LENGTH = 3
+# Simple-mode rows whose serialized text is shorter than this are treated as empty
+MIN_ROW_TEXT_LENGTH = 10
+
+# Cells pd.read_excel reads as NaN by default; streamed chunks treat them the same way
+NA_STRINGS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+STREAMING_EXTENSIONS = {'.xlsx', '.xlsm'}
+
+PendingRow = Tuple[int, Dict[str, Any], Tuple[str, str, Dict[str, Any]]]
+SheetChunk = Tuple[np.ndarray, pd.DataFrame]
+
+
+def column_names(header: Tuple[Any, ...]) -> List[Any]:
+    """Header cells named the way pd.read_excel names them (Unnamed: i, duplicates as name.1)"""
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _chunk_frame(columns: List[Any], rows: List[Tuple[Any, ...]]) -> pd.DataFrame:
+    width = max(len(columns), max(len(row) for row in rows))
+    if width > len(columns):
+        # Cells beyond the header, pandas names them like blank header cells
+        columns = columns + [f"Unnamed: {i}" for i in range(len(columns), width)]
+    values = [row + (None,) * (width - len(row)) for row in rows]
+    frame = pd.DataFrame(values, columns=columns, dtype=object)
+    return frame.mask(frame.isin(NA_STRINGS))
+
+
+def _stream_sheet(sheet, chunk_rows: int) -> Iterator[SheetChunk]:
+    # Declared dimensions are often wrong in generated workbooks, read what is there
+    sheet.reset_dimensions()
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = column_names(header)
+    numbers, chunk = [], []
+    for number, row in enumerate(rows, start=1):
+        if all(value is None for value in row):
+            continue
+        numbers.append(number)
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield np.asarray(numbers), _chunk_frame(columns, chunk)
+            numbers, chunk = [], []
+    if chunk:
+        yield np.asarray(numbers), _chunk_frame(columns, chunk)
+
+
+def _slice_sheet(df: pd.DataFrame, chunk_rows: int) -> Iterator[SheetChunk]:
+    for start in range(0, len(df), chunk_rows):
+        yield np.arange(start + 1, min(start + chunk_rows, len(df)) + 1), df.iloc[start:start + chunk_rows]
+
+
+def read_sheets(file_path: str, chunk_rows: int) -> Iterator[Tuple[str, Iterator[SheetChunk]]]:
+    """
+    Yield (sheet name, chunks) for every sheet, where chunks yields (1-based row numbers,
+    DataFrame) of at most chunk_rows data rows. A sheet's chunks must be consumed before
+    the next sheet is requested. Legacy .xls workbooks are read whole by pandas.
+    """
+    if os.path.splitext(file_path)[1].lower() not in STREAMING_EXTENSIONS:
+        with pd.ExcelFile(file_path) as excel_file:
+            for sheet_name in excel_file.sheet_names:
+                yield sheet_name, _slice_sheet(excel_file.parse(sheet_name), chunk_rows)
+        return
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, _stream_sheet(sheet, chunk_rows)
+    finally:
+        workbook.close()
+
+
+def text_values(values: pd.Series) -> pd.Series:
+    """str() of every cell, stripped (datetimes keep their full str() form)"""
+    return values.astype(object).astype(str).str.strip()
+
+
+def text_column(df: pd.DataFrame, column: Optional[str], default: Optional[str],
+                missing: Optional[str] = None) -> pd.Series:
+    """
+    Cleaned text of a mapped column: NaN cells become `default`, a column the
+    sheet does not have becomes `missing` (default: `default`) on every row
+    """
+    if not column or column not in df.columns:
+        return pd.Series(default if missing is None else missing, index=df.index, dtype=object)
+    values = df[column]
+    text = np.where(values.isna().to_numpy(), default, text_values(values).to_numpy(dtype=object))
+    return pd.Series(text, index=df.index, dtype=object)
+
+
+def _row_numbers(df: pd.DataFrame, row_numbers: Optional[np.ndarray]) -> np.ndarray:
+    return np.arange(1, len(df) + 1) if row_numbers is None else np.asarray(row_numbers)
+
+
+def mapped_frame(df: pd.DataFrame, mappings: Dict[str, str],
+                 row_numbers: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Mapped fields of every row with a usable requirement, plus its 1-based row_number"""
+    frame = pd.DataFrame({
+        'row_number': _row_numbers(df, row_numbers),
+        'product': text_column(df, mappings.get('product'), 'General'),
+        'requirement': text_column(df, mappings.get('requirement'), ''),
+        'requirement_category': text_column(df, mappings.get('requirement_category'), 'Must Have'),
+        'response_category': text_column(df, mappings.get('response_category'), 'Readily Available'),
+        # Optional fields: None when unmapped or blank, '' when mapped to a missing column
+        'effort_required': text_column(df, mappings.get('effort_required'), None, missing='')
+        if mappings.get('effort_required') else None,
+        'comments': text_column(df, mappings.get('comments'), None, missing='')
+        if mappings.get('comments') else None
+    }, index=df.index)
+
+    keep = frame['requirement'].str.len().to_numpy() >= MIN_REQUIREMENT_LENGTH
+    skipped = frame['row_number'].to_numpy()[~keep]
+    if len(skipped):
+        shown = ', '.join(str(n) for n in skipped[:10]) + (', ...' if len(skipped) > 10 else '')
+        print(f"Skipping {len(skipped)} row(s) with empty or too short requirement: {shown}")
+    return frame[keep]
+
+
+def simple_frame(df: pd.DataFrame, row_numbers: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Every non-empty row serialized as "col: value | col: value", plus its 1-based row_number"""
+    text = pd.Series('', index=df.index, dtype=object)
+    for column in df.columns:
+        values = df[column]
+        stripped = text_values(values)
+        present = values.notna().to_numpy() & (stripped.to_numpy() != '')
+        part = pd.Series(np.where(present, f"{column}: " + stripped, ''), index=df.index, dtype=object)
+        separator = np.where((text.to_numpy() != '') & present, ' | ', '')
+        text = text + separator + part
+
+    frame = pd.DataFrame({'row_number': _row_numbers(df, row_numbers), 'text': text}, index=df.index)
+    return frame[frame['text'].str.len().to_numpy() >= MIN_ROW_TEXT_LENGTH]
+
+
+def entry_id(document_id: Any, sheet_name: Optional[str], row_number: int) -> ObjectId:
+    """Deterministic rfp_entries id of a sheet row"""
+    key = f"{document_id}\x00{sheet_name}\x00{row_number}"
+    return ObjectId(hashlib.sha256(key.encode('utf-8')).digest()[:12])
+
+
+def _document_fields(document: Dict[str, Any], sheet_name: Optional[str]) -> Dict[str, Any]:
+    metadata = document.get('metadata', {})
+    return {
+        'sheet_name': sheet_name,
+        'file_name': document['file_name'],
+        'rfp_name': metadata.get('rfp_name', 'Unknown RFP'),
+        'bank_name': metadata.get('bank_name', 'Unknown Bank')
+    }
+
+
+def mapped_row_batches(df: pd.DataFrame, mappings: Dict[str, str], document: Dict[str, Any],
+                       sheet_name: Optional[str], batch_size: int,
+                       row_numbers: Optional[np.ndarray] = None) -> Iterator[List[PendingRow]]:
+    """Ready-to-insert batches of a column-mapped RFP sheet (or chunk of one)"""
+    frame = mapped_frame(df, mappings, row_numbers)
+    fields = _document_fields(document, sheet_name)
+    document_id = document['_id']
+    for start in range(0, len(frame), batch_size):
+        now = datetime.now()
+        batch = []
+        for record in frame.iloc[start:start + batch_size].to_dict('records'):
+            row_number = int(record.pop('row_number'))
+            entry = {
+                '_id': entry_id(document_id, sheet_name, row_number),
+                'document_id': document_id,
+                **record,
+                **fields,
+                'date': now,
+                'created_at': now,
+                'last_modified': now
+            }
+            batch.append((row_number, entry, (
+                str(entry['_id']),
+                entry['requirement'],
+                {
+                    **record,
+                    'effort_required': record['effort_required'] or '',
+                    'comments': record['comments'] or '',
+                    **fields,
+                    'document_id': str(document_id),
+                    'date': now.isoformat()
+                }
+            )))
+        yield batch
+
+
+def simple_row_batches(df: pd.DataFrame, document: Dict[str, Any], sheet_name: Optional[str],
+                       batch_size: int, row_numbers: Optional[np.ndarray] = None) -> Iterator[List[PendingRow]]:
+    """Ready-to-insert batches of a sheet (or chunk of one) processed without column mapping"""
+    frame = simple_frame(df, row_numbers)
+    fields = _document_fields(document, sheet_name)
+    defaults = {
+        'product': 'General',
+        'requirement_category': 'Auto-Processed',
+        'response_category': 'Pending Review',
+        'processing_mode': 'simple'
+    }
+    for start in range(0, len(frame), batch_size):
+        now = datetime.now()
+        chunk = frame.iloc[start:start + batch_size]
+        batch = []
+        for row_number, text in zip(chunk['row_number'].tolist(), chunk['text'].tolist()):
+            entry = {
+                '_id': entry_id(document['_id'], sheet_name, row_number),
+                'document_id': document['_id'],
+                'requirement': text,
+                **defaults,
+                'row_number': row_number,
+                **fields,
+                'created_at': now,
+                'last_modified': now
+            }
+            batch.append((row_number, entry, (
+                str(entry['_id']),
+                text,
+                {
+                    'document_id': str(document['_id']),
+                    'requirement': text[:500],  # Truncate for metadata
+                    **defaults,
+                    'row_number': row_number,
+                    **fields
+                }
+            )))
+        yield batch
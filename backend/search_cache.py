@@ -0,0 +1,201 @@
+"""
+Versioned cache of vector search results
+Entries are keyed by (normalized query, filters, top_n, generation). The
+generation is a counter in MongoDB bumped by every ingestion and delete, so a
+write in any worker makes all earlier entries unreachable instead of stale.
+Tier 1 is a per-process LRU bounded in bytes, tier 2 a TTL'd MongoDB collection
+shared by every worker.
+
+Usage:
+    SEARCH_CACHE_MAX_BYTES=33554432       in-process budget (0 disables the cache)
+    SEARCH_CACHE_SHARED=true              also share results through MongoDB
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from pymongo import ReturnDocument
+
+from embedding_cache import normalize_query
+from vector_quant import META_COLLECTION
+
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+SEARCH_CACHE_SHARED = os.environ.get('SEARCH_CACHE_SHARED', 'true').lower() == 'true'
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '3600'))
+# How long a worker trusts its last read of the shared generation
+SEARCH_CACHE_GENERATION_SECONDS = float(os.environ.get('SEARCH_CACHE_GENERATION_SECONDS', '1'))
+
+CACHE_COLLECTION = 'search_result_cache'
+GENERATION_ID = 'search_generation'
+
+
+def bump_generation(db) -> int:
+    """Invalidate every cached search result, returns the new generation"""
+    doc = db[META_COLLECTION].find_one_and_update(
+        {'_id': GENERATION_ID},
+        {'$inc': {'value': 1}, '$set': {'updated_at': datetime.now()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc['value']
+
+
+class SearchResultCache:
+    """Byte-bounded LRU of search results in front of a shared MongoDB tier"""
+
+    def __init__(self, db, max_bytes: int = SEARCH_CACHE_MAX_BYTES, shared: bool = SEARCH_CACHE_SHARED):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.collection = db[CACHE_COLLECTION] if shared and db is not None else None
+        self._lru: 'OrderedDict[str, Tuple[List[Dict], int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._generation_read_at = 0.0
+        self._synced_generation: Optional[int] = None
+        self.counters = {'memory_hits': 0, 'mongo_hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+        self._ensure_indexes()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _ensure_indexes(self):
+        if self.collection is None or not self.enabled:
+            return
+        try:
+            self.collection.create_index('created_at', expireAfterSeconds=SEARCH_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"Search cache index info: {e}")
+
+    def generation(self) -> int:
+        """Current shared generation, re-read at most every SEARCH_CACHE_GENERATION_SECONDS"""
+        now = time.time()
+        if self._generation is None or now - self._generation_read_at >= SEARCH_CACHE_GENERATION_SECONDS:
+            doc = self.db[META_COLLECTION].find_one({'_id': GENERATION_ID}, {'value': 1})
+            self._generation = doc['value'] if doc else 0
+            self._generation_read_at = now
+        return self._generation
+
+    def needs_sync(self, generation: int) -> bool:
+        """True if writes behind `generation` may not have reached this worker's index yet"""
+        return self._synced_generation != generation
+
+    def mark_synced(self, generation: int):
+        self._synced_generation = generation
+
+    def invalidate(self) -> int:
+        """Bump the shared generation after a write this process has already applied to its index"""
+        generation = bump_generation(self.db)
+        with self._lock:
+            # Entries of older generations can never be hit again
+            self._lru.clear()
+            self._bytes = 0
+            self.counters['invalidations'] += 1
+            # Only this bump happened since the last sync; if another process bumped in
+            # between, its writes are not in this index yet and the next search refreshes
+            if self._synced_generation is not None and generation == self._synced_generation + 1:
+                self._synced_generation = generation
+        self._generation = generation
+        self._generation_read_at = time.time()
+        return generation
+
+    @staticmethod
+    def key(query: str, filters: Optional[Dict], top_n: int, generation: int, mode: str = 'vector') -> str:
+        canonical = {
+            field: sorted(map(str, values)) if isinstance(values, (list, tuple, set)) else values
+            for field, values in (filters or {}).items() if values
+        }
+        payload = json.dumps([normalize_query(query), canonical, top_n, generation, mode],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, results: List[Dict], size: int):
+        with self._lock:
+            previous = self._lru.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._lru[key] = (results, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._lru:
+                _, (_, evicted_size) = self._lru.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return copy.deepcopy(entry[0])
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': key}, {'results': 1, 'size': 1})
+            except Exception as e:
+                print(f"⚠️ Search cache lookup failed: {e}")
+                doc = None
+            if doc is not None:
+                self._remember(key, doc['results'], doc.get('size', 0))
+                with self._lock:
+                    self.counters['mongo_hits'] += 1
+                return copy.deepcopy(doc['results'])
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key: str, results: List[Dict]):
+        if not self.enabled:
+            return
+        size = len(json.dumps(results, default=str))
+        if size > self.max_bytes:
+            return
+        self._remember(key, copy.deepcopy(results), size)
+        with self._lock:
+            self.counters['stores'] += 1
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one(
+                {'_id': key},
+                {'_id': key, 'results': results, 'size': size, 'created_at': datetime.now()},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"⚠️ Search cache store failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._lru)
+            stats['memory_bytes'] = self._bytes
+        lookups = stats['memory_hits'] + stats['mongo_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['mongo_hits']) / lookups, 4) if lookups else 0.0
+        stats['memory_capacity_bytes'] = self.max_bytes
+        stats['generation'] = self._generation
+        stats['shared'] = self.collection is not None
+        return stats
+
+
+_caches: Dict[str, SearchResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_search_cache(db) -> SearchResultCache:
+    """Process-wide result cache for a database (shared by every VectorSearchService)"""
+    key = str(getattr(db, 'name', None))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = SearchResultCache(db)
+            _caches[key] = cache
+        return cache
@@ -1,22 +1,38 @@
 import os
 import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from celery import Celery
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
 import json
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 from openai import AzureOpenAI  # Azure OpenAI client
 from azure.storage.blob import BlobServiceClient
 import io
-import tempfile
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from vector_index import (
+    get_vector_index, normalize_vector, truncate_vector, encode_vector, encoding_fields, VECTOR_COARSE_DIMS
+)
+from vector_quant import load_quantizer
+from embedding_cache import get_query_cache, get_content_cache
+from embedding_scheduler import get_embedding_scheduler, EMBEDDING_CONCURRENCY
+from search_cache import get_search_cache
+from blob_io import lease_blob, client_options as blob_client_options
+from row_extraction import read_sheets, mapped_row_batches, simple_row_batches
+from ingest_checkpoints import IngestCheckpoints, batch_hashes
+from document_versions import VersionDiff
+from text_extraction import iter_segments
+from text_chunker import chunk_segments, estimate_tokens, CHUNK_TOKENS
+from lexical_index import get_lexical_index, reciprocal_rank_fusion, SEARCH_MODE, HYBRID_CANDIDATES
 
 # Initialize Celery
 redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
-celery = Celery('tasks', broker=redis_url, backend=redis_url)
+# Job runner tasks live in jobs.py (see JOB_BACKEND)
+celery = Celery('tasks', broker=redis_url, backend=redis_url, include=['jobs'])
 
 # MongoDB connection for Celery tasks
 def get_db():
@@ -41,6 +57,26 @@ AZURE_OPENAI_API_VERSION = os.environ.get('AZURE_OPENAI_API_VERSION', '2024-02-0
 AZURE_EMBEDDING_MODEL = os.environ.get('AZURE_OPENAI_EMBEDDING_DEPLOYMENT', 'text-embedding-3-large')
 USE_AZURE_EMBEDDINGS = os.environ.get('USE_AZURE_EMBEDDINGS', 'true').lower() == 'true'  # Changed default to 'true'
 
+# Batched embedding requests: inputs per request and estimated tokens per request
+EMBEDDING_BATCH_MAX_INPUTS = int(os.environ.get('EMBEDDING_BATCH_MAX_INPUTS', '256'))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.environ.get('EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+
+# Rows buffered by ingestion before one insert_many / bulk upsert flush
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '500'))
+# Sheet chunks extracted, inserted and embedded concurrently
+INGEST_SHEET_WORKERS = int(os.environ.get('INGEST_SHEET_WORKERS', '4'))
+
+# Search filter keys accepted by the API -> pre-filtered index field
+SEARCH_FILTER_FIELDS = {
+    'products': 'product', 'product': 'product',
+    'response_categories': 'response_category', 'response_category': 'response_category',
+    'requirement_categories': 'requirement_category', 'requirement_category': 'requirement_category',
+    'document_ids': 'document_id', 'document_id': 'document_id',
+    'bank_names': 'bank_name', 'bank_name': 'bank_name',
+    'rfp_names': 'rfp_name', 'rfp_name': 'rfp_name',
+    'sheet_names': 'sheet_name', 'sheet_name': 'sheet_name'
+}
+
 print(f"🔧 Vector Search Configuration:")
 print(f"   API Key: {'✅ Set' if AZURE_OPENAI_API_KEY else '❌ Missing'}")
 print(f"   Endpoint: {AZURE_OPENAI_ENDPOINT if AZURE_OPENAI_ENDPOINT else '❌ Missing'}")
@@ -76,7 +112,8 @@ def get_blob_service_client():
         storage_connection_string = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')
         if storage_connection_string:
             try:
-                _blob_service_client = BlobServiceClient.from_connection_string(storage_connection_string)
+                _blob_service_client = BlobServiceClient.from_connection_string(
+                    storage_connection_string, **blob_client_options())
                 print("✅ Azure Blob Storage client initialized")
             except Exception as e:
                 print(f"❌ Failed to initialize Blob Storage client: {e}")
@@ -84,24 +121,16 @@ def get_blob_service_client():
     return _blob_service_client
 
 def download_blob_to_temp(blob_name: str) -> str:
-    """Download blob to temporary file and return path"""
+    """
+    Local copy of a blob, streamed in chunks. Returns a lease of the cached file when the
+    blob cache is enabled (see lease_blob) or a temporary file otherwise; the caller deletes it.
+    """
     blob_client = get_blob_service_client()
     if not blob_client:
         raise ValueError("Blob storage not configured")
     
     try:
-        # Create temporary file
-        suffix = os.path.splitext(blob_name)[1]
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        temp_path = temp_file.name
-        temp_file.close()
-        
-        # Download blob to temp file
-        blob = blob_client.get_blob_client(container="uploads", blob=blob_name)
-        with open(temp_path, "wb") as f:
-            f.write(blob.download_blob().readall())
-        
-        return temp_path
+        return lease_blob(blob_client, blob_name)
     except Exception as e:
         print(f"Failed to download blob {blob_name}: {e}")
         raise
@@ -115,6 +144,24 @@ class VectorSearchService:
         
         # Create index for vector search if it doesn't exist
         self._ensure_index_exists()
+        
+        # Process-wide float32 matrix shared by every service instance
+        self.index = get_vector_index(self.db, self.collection_name, self.vector_size)
+        
+        # Int8 codec (VECTOR_QUANTIZATION=int8) used to store vector_q8 next to each vector
+        self.quantizer = load_quantizer(self.db)
+        
+        # Query embeddings: in-process LRU backed by a shared MongoDB tier
+        self.query_cache = get_query_cache(self.db, AZURE_EMBEDDING_MODEL)
+        
+        # Ingested text by content hash: reused wording and reprocessed rows skip Azure
+        self.content_cache = get_content_cache(self.db, AZURE_EMBEDDING_MODEL)
+        
+        # Search results keyed by query/filters/top_n and the shared index generation
+        self.result_cache = get_search_cache(self.db)
+        
+        # BM25 index over requirements and documentation chunks (hybrid mode)
+        self.lexical = get_lexical_index(self.db)
     
     def _ensure_index_exists(self):
         """Create MongoDB index for efficient vector search"""
@@ -122,45 +169,220 @@ class VectorSearchService:
             # Create index on document_id for fast lookups
             self.db[self.collection_name].create_index("document_id")
             self.db[self.collection_name].create_index("entry_id")
+            # Lets the resident index pull only vectors written since its last refresh
+            self.db[self.collection_name].create_index("created_at")
             print(f"✅ MongoDB vector collection indexes created")
         except Exception as e:
             print(f"Index creation info: {e}")
     
+    @property
+    def embedder(self):
+        """Process-wide scheduler holding this deployment's RPM/TPM quota"""
+        return get_embedding_scheduler(self.azure_client, AZURE_EMBEDDING_MODEL)
+    
     def embed_text(self, text: str) -> List[float]:
         """Convert text to embedding vector using Azure OpenAI"""
         if not USE_AZURE_EMBEDDINGS or not self.azure_client:
             raise Exception("Azure OpenAI embeddings not configured")
         
         try:
-            # Use Azure OpenAI embeddings
-            response = self.azure_client.embeddings.create(
-                input=text,
-                model=AZURE_EMBEDDING_MODEL
-            )
+            # Use Azure OpenAI embeddings (rate limited, retried on throttling)
+            response = self.embedder.create(text, self.estimate_tokens(text))
             return response.data[0].embedding
         except Exception as e:
             print(f"❌ Azure embedding failed: {e}")
             raise
     
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough token count (~4 characters per token), enough to pack request budgets"""
+        return estimate_tokens(text)
+    
+    def _pack_batches(self, texts: List[str], positions: Optional[List[int]] = None) -> List[List[int]]:
+        """Group input positions (default: all) into requests bounded by input count and token budget"""
+        batches, batch, tokens = [], [], 0
+        for i in range(len(texts)) if positions is None else positions:
+            text = texts[i]
+            if not text or not text.strip():
+                continue  # the API rejects empty inputs
+            cost = self.estimate_tokens(text)
+            if batch and (len(batch) >= EMBEDDING_BATCH_MAX_INPUTS or tokens + cost > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append(i)
+            tokens += cost
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _embed_batch(self, texts: List[str], positions: List[int], vectors: List[Optional[List[float]]]):
+        """Embed one request; an input the API rejects is isolated by splitting the batch"""
+        try:
+            response = self.embedder.create([texts[i] for i in positions],
+                                            sum(self.estimate_tokens(texts[i]) for i in positions))
+        except Exception as e:
+            if getattr(e, 'status_code', None) != 400:
+                raise
+            if len(positions) == 1:
+                print(f"❌ Azure embedding rejected input {positions[0]}: {e}")
+                return
+            middle = len(positions) // 2
+            self._embed_batch(texts, positions[:middle], vectors)
+            self._embed_batch(texts, positions[middle:], vectors)
+            return
+        # Results carry the position of their input within the request
+        for item in response.data:
+            vectors[positions[item.index]] = item.embedding
+    
+    def embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed many texts with as few requests as possible; inputs that failed come back as None"""
+        if not USE_AZURE_EMBEDDINGS or not self.azure_client:
+            raise Exception("Azure OpenAI embeddings not configured")
+        
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        
+        # Text embedded before (by any document or run) comes from the content cache,
+        # and repeats within this call are embedded once
+        cached = self.content_cache.get_many(texts)
+        keys = [self.content_cache.key(text) for text in texts]
+        first: Dict[str, int] = {}
+        for i, text in enumerate(texts):
+            if text in cached:
+                vectors[i] = cached[text]
+            else:
+                first.setdefault(keys[i], i)
+        to_embed = sorted(first.values())
+        if len(to_embed) < len(texts):
+            print(f"♻️ {len(texts) - len(to_embed)}/{len(texts)} inputs reused from cached or duplicate text")
+        
+        batches = self._pack_batches(texts, to_embed)
+        # Requests run concurrently within quota; each fills its own positions of `vectors`
+        errors = self.embedder.run_all(lambda positions: self._embed_batch(texts, positions, vectors), batches)
+        for positions, error in zip(batches, errors):
+            if error is not None:
+                print(f"❌ Azure embedding failed for a batch of {len(positions)} inputs: {error}")
+        
+        self.content_cache.put_many([(texts[i], vectors[i]) for i in to_embed if vectors[i] is not None])
+        for i, key in enumerate(keys):
+            if vectors[i] is None and key in first:
+                vectors[i] = vectors[first[key]]
+        return vectors
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embedding of a search query, served from the query cache when possible"""
+        return self.query_cache.get_or_compute(text, self.embed_text)
+    
+    def warm_query_cache(self, queries: List[str]) -> int:
+        """Pre-compute embeddings of queries users are expected to run"""
+        return self.query_cache.warm(queries, self.embed_text)
+    
     def index_document(self, doc_id: str, text: str, metadata: Dict[str, Any]):
         """Add document embedding to MongoDB"""
-        vector = self.embed_text(text)
+        # Lexical postings first: keyword search keeps working when embedding fails
+        self.lexical.add(doc_id, text, metadata.get('document_id'), metadata,
+                         source='chunks' if 'chunk_index' in metadata else 'rfp_entries')
+        
+        vector = self.content_cache.get_or_compute(text, self.embed_text)
+        self._store_vectors([(doc_id, vector, metadata)])
+    
+    def index_documents(self, items: List[Tuple[str, str, Dict[str, Any]]],
+                        known_vectors: Optional[List[Optional[List[float]]]] = None) -> List[bool]:
+        """
+        Index many (doc_id, text, metadata) items with batched embedding requests and
+        one bulk write. Items with a vector in known_vectors (e.g. carried over from a
+        previous document version) are not embedded. Returns, per item, whether its
+        vector was stored.
+        """
+        if not items:
+            return []
+        for doc_id, text, metadata in items:
+            self.lexical.add(doc_id, text, metadata.get('document_id'), metadata,
+                             source='chunks' if 'chunk_index' in metadata else 'rfp_entries')
         
-        # Store vector in MongoDB
+        vectors = list(known_vectors) if known_vectors is not None else [None] * len(items)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        for i, vector in zip(missing, self.embed_texts([items[i][1] for i in missing]) if missing else []):
+            vectors[i] = vector
+        self._store_vectors([
+            (doc_id, vector, metadata)
+            for (doc_id, _, metadata), vector in zip(items, vectors) if vector is not None
+        ])
+        return [vector is not None for vector in vectors]
+    
+    def _vector_doc(self, doc_id: str, vector: List[float], metadata: Dict[str, Any]) -> Dict[str, Any]:
         vector_doc = {
             'entry_id': doc_id,
             'document_id': metadata.get('document_id'),
-            'vector': vector,
+            'vector': encode_vector(vector),
+            **encoding_fields(),
             'metadata': metadata,
             'created_at': datetime.now()
         }
+        if self.quantizer is not None and len(vector) == self.quantizer.dim:
+            vector_doc['vector_q8'] = self.quantizer.to_codes_field(normalize_vector(vector))
+            vector_doc['q8_version'] = self.quantizer.version
+        if 0 < VECTOR_COARSE_DIMS < len(vector):
+            vector_doc['vector_short'] = encode_vector(truncate_vector(vector, VECTOR_COARSE_DIMS))
+            vector_doc['short_dims'] = VECTOR_COARSE_DIMS
+        return vector_doc
+    
+    def _store_vectors(self, items: List[Tuple[str, List[float], Dict[str, Any]]]):
+        """Upsert (doc_id, vector, metadata) items and apply them to the resident index"""
+        if not items:
+            return
+        vector_docs = [self._vector_doc(doc_id, vector, metadata) for doc_id, vector, metadata in items]
         
         # Upsert to MongoDB (replace if exists)
-        self.db[self.collection_name].update_one(
-            {'entry_id': doc_id},
-            {'$set': vector_doc},
-            upsert=True
-        )
+        self.db[self.collection_name].bulk_write([
+            UpdateOne({'entry_id': doc['entry_id']}, {'$set': doc}, upsert=True) for doc in vector_docs
+        ], ordered=False)
+        
+        # Keep this worker's resident index current (others pick it up on refresh)
+        self.index.apply_writes([
+            (doc['entry_id'], vector, metadata, doc['document_id'], doc['created_at'])
+            for doc, (_, vector, metadata) in zip(vector_docs, items)
+        ])
+        self.result_cache.invalidate()
+    
+    def remove_document(self, document_id: str) -> int:
+        """
+        Delete all vectors of a document from MongoDB and the resident index. Call it before
+        deleting the document's rfp_entries: vectors written without a document_id (legacy
+        professional mode, see `vector_migrate.py document-ids`) are found through them.
+        """
+        legacy = self._legacy_entry_ids(document_id)
+        removed = self.db[self.collection_name].delete_many({'document_id': document_id}).deleted_count
+        self.index.remove_document(document_id)
+        if legacy:
+            removed += self.db[self.collection_name].delete_many(
+                {'entry_id': {'$in': legacy}, 'document_id': None}).deleted_count
+            self.index.remove_entries(legacy)
+        self.lexical.remove_document(document_id)
+        self.result_cache.invalidate()
+        return removed
+
+    def _legacy_entry_ids(self, document_id: str) -> List[str]:
+        """Entry ids of a document's rfp_entries whose vectors carry no document_id"""
+        if not ObjectId.is_valid(document_id):
+            return []
+        if self.db[self.collection_name].find_one({'document_id': None}, {'_id': 1}) is None:
+            return []
+        entry_ids = [str(entry['_id']) for entry in
+                     self.db.rfp_entries.find({'document_id': ObjectId(document_id)}, {'_id': 1})]
+        return [doc['entry_id'] for doc in self.db[self.collection_name].find(
+            {'entry_id': {'$in': entry_ids}, 'document_id': None}, {'_id': 0, 'entry_id': 1})]
+    
+    def index_info(self) -> Dict[str, Any]:
+        """Describe the vector index serving searches (engine, size, tuned recall)"""
+        self.index.refresh()
+        info = self.index.describe()
+        info['query_cache'] = self.query_cache.stats()
+        info['content_cache'] = self.content_cache.stats()
+        info['result_cache'] = self.result_cache.stats()
+        info['lexical'] = self.lexical.describe()
+        if self.azure_client:
+            info['embedding'] = self.embedder.stats()
+        return info
     
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """Calculate cosine similarity between two vectors"""
@@ -168,56 +390,130 @@ class VectorSearchService:
         vec2_np = np.array(vec2)
         return float(np.dot(vec1_np, vec2_np) / (np.linalg.norm(vec1_np) * np.linalg.norm(vec2_np)))
     
-    def search(self, query: str, top_n: int = 10, filters: Dict = None) -> List[Dict]:
-        """Search for similar documents using MongoDB and cosine similarity"""
+    def search(self, query: str, top_n: int = 10, filters: Dict = None, mode: Optional[str] = None) -> List[Dict]:
+        """
+        Search for similar documents using the resident vector index (cosine similarity).
+        mode='hybrid' (default: SEARCH_MODE) fuses the vector ranking with BM25 keyword ranks.
+        """
+        mode = (mode or SEARCH_MODE).lower()
+        
+        # Repeat searches are answered from the cache of the current index generation
+        generation = cache_key = None
         try:
-            query_vector = self.embed_text(query)
+            generation = self.result_cache.generation()
+            cache_key = self.result_cache.key(query, filters, top_n, generation, mode)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        except Exception as e:
+            print(f"⚠️ Search result cache unavailable: {e}")
+        
+        try:
+            query_vector = self.embed_query(query)
         except Exception as e:
             print(f"Failed to generate query embedding: {e}")
             raise Exception(f"Failed to generate embeddings: {str(e)}")
         
-        # Build MongoDB filter
-        mongo_filter = {}
-        if filters:
-            if filters.get('products'):
-                mongo_filter['metadata.product'] = {'$in': filters['products']}
-            if filters.get('response_categories'):
-                mongo_filter['metadata.response_category'] = {'$in': filters['response_categories']}
+        # Bring the resident index up to date (full load on first use); a generation bumped
+        # by another worker means it wrote vectors this index must see before caching. An
+        # index that could not catch up yet answers uncached, it must not be stored as current
+        try:
+            force = cache_key is not None and self.result_cache.needs_sync(generation)
+            synced = self.index.refresh(force=force)
+            if mode == 'hybrid':
+                synced = self.lexical.refresh(force=force) and synced
+            if cache_key is not None:
+                if synced:
+                    self.result_cache.mark_synced(generation)
+                else:
+                    cache_key = None
+        except Exception as e:
+            print(f"Failed to query vector database: {e}")
+            raise Exception(f"Database query failed: {str(e)}")
         
-        # Get all vectors from MongoDB (with filters if any)
+        # Restrict scoring to rows matching the filters (intersected from in-memory posting lists)
+        metadata_filters = self._metadata_filters(filters)
+        
+        # One matrix-vector product + argpartition top-k
+        if mode == 'hybrid':
+            hits = self._hybrid_hits(query, query_vector, top_n, metadata_filters)
+        else:
+            hits = self.index.search(query_vector, top_n, metadata_filters)
+        
+        # Only the returned hits need their full metadata (requirement, comments, ...)
         try:
-            vector_docs = list(self.db[self.collection_name].find(mongo_filter))
+            entry_ids = [hit[0] for hit in hits]
+            full_metadata = self.index.hydrate(entry_ids)
+            if len(full_metadata) < len(entry_ids):
+                # Keyword hits on requirements that have no vector yet
+                full_metadata.update(self.lexical.hydrate([e for e in entry_ids if e not in full_metadata]))
         except Exception as e:
             print(f"Failed to query vector database: {e}")
             raise Exception(f"Database query failed: {str(e)}")
         
-        # Calculate cosine similarity for each document
         results = []
-        for doc in vector_docs:
-            similarity = self.cosine_similarity(query_vector, doc['vector'])
-            metadata = doc.get('metadata', {})
-            results.append({
-                'record_id': doc['entry_id'],
-                'relevance_score': similarity,
-                'product': metadata.get('product'),
-                'requirement': metadata.get('requirement'),
-                'requirement_category': metadata.get('requirement_category'),
-                'response_category': metadata.get('response_category'),
-                'effort_required': metadata.get('effort_required'),
-                'comments': metadata.get('comments'),
-                'sheet_name': metadata.get('sheet_name'),  # Add sheet name
-                'file_name': metadata.get('file_name'),  # Add file name
-                'rfp_name': metadata.get('rfp_name'),
-                'bank_name': metadata.get('bank_name'),
-                'date': metadata.get('date'),
-                'highlight': self._generate_highlight(query, metadata.get('requirement', ''))
-            })
-        
-        # Sort by similarity score (descending)
-        results.sort(key=lambda x: x['relevance_score'], reverse=True)
-        
-        # Return top N results
-        return results[:top_n]
+        for entry_id, similarity, metadata, *fusion in hits:
+            if entry_id not in full_metadata and not metadata:
+                continue  # deleted since the lexical index last refreshed
+            result = self._format_result(entry_id, similarity, full_metadata.get(entry_id, metadata), query)
+            if fusion:
+                result['fusion_score'] = fusion[0]
+            results.append(result)
+        if cache_key is not None:
+            self.result_cache.put(cache_key, results)
+        return results
+    
+    def _hybrid_hits(self, query: str, query_vector: List[float], top_n: int,
+                     metadata_filters: Dict[str, List[str]]) -> List[Tuple[str, float, Dict, float]]:
+        """(entry_id, similarity, metadata, fusion_score) of the reciprocal rank fusion of both rankings"""
+        depth = max(top_n, HYBRID_CANDIDATES)
+        vector_hits = self.index.search(query_vector, depth, metadata_filters)
+        keyword_hits = self.lexical.search(query, depth, metadata_filters)
+        fused = reciprocal_rank_fusion([
+            [entry_id for entry_id, _, _ in vector_hits],
+            [entry_id for entry_id, _ in keyword_hits]
+        ])[:top_n]
+        
+        known = {entry_id: (similarity, metadata) for entry_id, similarity, metadata in vector_hits}
+        # Keyword-only hits still report their cosine similarity when they have a vector
+        similarities = self.index.score_entries(query_vector, [e for e, _ in fused if e not in known])
+        return [
+            (entry_id, known[entry_id][0] if entry_id in known else similarities.get(entry_id, 0.0),
+             known[entry_id][1] if entry_id in known else {}, fusion_score)
+            for entry_id, fusion_score in fused
+        ]
+    
+    def _metadata_filters(self, filters: Optional[Dict]) -> Dict[str, List[str]]:
+        """Map API filters (plural lists or single values) to index fields"""
+        metadata_filters = {}
+        for key, value in (filters or {}).items():
+            field = SEARCH_FILTER_FIELDS.get(key)
+            if field is None or value in (None, '', []):
+                continue
+            values = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+            metadata_filters[field] = metadata_filters.get(field, []) + values
+        return metadata_filters
+    
+    def _format_result(self, entry_id: str, similarity: float, metadata: Dict, query: str) -> Dict:
+        """Build the search result dict returned to the API"""
+        return {
+            'record_id': entry_id,
+            'relevance_score': similarity,
+            'product': metadata.get('product'),
+            'requirement': metadata.get('requirement'),
+            'requirement_category': metadata.get('requirement_category'),
+            'response_category': metadata.get('response_category'),
+            'effort_required': metadata.get('effort_required'),
+            'comments': metadata.get('comments'),
+            'sheet_name': metadata.get('sheet_name'),  # Add sheet name
+            'file_name': metadata.get('file_name'),  # Add file name
+            'rfp_name': metadata.get('rfp_name'),
+            'bank_name': metadata.get('bank_name'),
+            'date': metadata.get('date'),
+            'page_start': metadata.get('page_start'),  # Documentation chunks (PDF)
+            'page_end': metadata.get('page_end'),
+            'highlight': self._generate_highlight(query, metadata.get('requirement') or metadata.get('text') or '')
+        }
     
     def _generate_highlight(self, query: str, text: str) -> str:
         """Generate highlighted snippet"""
@@ -246,6 +542,178 @@ class VectorSearchService:
         
         return text[:200] + "..."
 
+def _index_pending(vector_service: VectorSearchService, pending: List[Tuple[str, str, Dict[str, Any]]],
+                   known_vectors: Optional[List[Optional[List[float]]]] = None) -> int:
+    """Index rows buffered during ingestion with batched embedding requests, returns failures"""
+    if not pending:
+        return 0
+    try:
+        stored = vector_service.index_documents(pending, known_vectors)
+    except Exception as e:
+        print(f"Warning: Failed to index {len(pending)} entries in vector DB: {str(e)}")
+        stored = [False] * len(pending)
+    failed = stored.count(False)
+    if failed:
+        print(f"Warning: {failed}/{len(pending)} entries could not be indexed in vector DB")
+    pending.clear()
+    return failed
+
+def _entry_upsert(entry: Dict[str, Any]) -> UpdateOne:
+    fields = {k: v for k, v in entry.items() if k not in ('_id', 'created_at')}
+    return UpdateOne({'_id': entry['_id']},
+                     {'$set': fields, '$setOnInsert': {'created_at': entry.get('created_at')}},
+                     upsert=True)
+
+def _flush_rows(db, vector_service: VectorSearchService,
+                pending: List[Tuple[int, Dict[str, Any], Tuple[str, str, Dict[str, Any]]]],
+                errors: Optional[List[Dict[str, Any]]] = None,
+                vectors: Optional[Dict[int, Any]] = None) -> Tuple[int, bool]:
+    """
+    Write buffered (row number, rfp entry, vector item) rows with one unordered bulk upsert
+    (entry ids are deterministic, so a re-run overwrites instead of duplicating), then index
+    the written ones, reusing `vectors` (by batch position) instead of embedding those rows.
+    Rows the write rejected are reported per row in `errors`.
+    Returns (entries written, whether every row was written and indexed).
+    """
+    vectors = vectors or {}
+    if not pending:
+        return 0, True
+    failed = {}
+    try:
+        db.rfp_entries.bulk_write([_entry_upsert(entry) for _, entry, _ in pending], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get('writeErrors', []):
+            failed[write_error['index']] = write_error.get('errmsg', 'insert failed')
+    except Exception as e:
+        failed = {i: str(e) for i in range(len(pending))}
+    
+    for i, message in sorted(failed.items()):
+        row_number, entry, _ = pending[i]
+        print(f"Error processing row {row_number}: {message}")
+        if errors is not None:
+            errors.append({'row': row_number, 'sheet': entry.get('sheet_name'), 'error': message})
+    
+    written = [i for i in range(len(pending)) if i not in failed]
+    items = [pending[i][2] for i in written]
+    known = [vectors.get(i) for i in written] if vectors else None
+    pending.clear()
+    count = len(items)
+    unindexed = _index_pending(vector_service, items, known)
+    return count, not failed and not unindexed
+
+def _ingest_sheets(db, vector_service: VectorSearchService, document: Dict[str, Any], file_path: str,
+                   sheet_batches, errors: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Ingest every sheet of a workbook. Sheets are streamed in INGEST_BATCH_SIZE-row chunks
+    and each chunk is handed to a worker that extracts, inserts and embeds it, so memory
+    follows the chunk size and the first rows are searchable while later ones are still
+    being parsed. sheet_batches(df, sheet_name, row_numbers) turns a chunk into
+    ready-to-insert batches (or returns None to skip the sheet). Per-sheet status and
+    counts are kept in documents.sheets. Batches that were fully written and indexed are
+    checkpointed, and a re-run skips every batch whose checkpoint matches its content, so
+    resuming after a crash or timeout only writes and embeds the unfinished tail. A new
+    version of a document (previous_version_id) reuses the vectors of unchanged rows and
+    retires the previous version once every row is in.
+    Returns (total rows, rows processed).
+    """
+    document_id = document['_id']
+    diff = VersionDiff(db, document, vector_service.collection_name) if document.get('previous_version_id') else None
+    checkpoints = IngestCheckpoints(db)
+    committed = checkpoints.load(document_id)
+    if committed:
+        print(f"⏩ Resuming document {document_id}: {len(committed)} committed batch(es), unchanged ones are skipped")
+    db.documents.update_one(
+        {'_id': document_id},
+        {'$set': {'status': 'processing', 'total_records': 0, 'records_processed': 0, 'sheets': []}}
+    )
+    
+    # Chunks parsed but not written yet, bounds memory when parsing outpaces embedding
+    workers = max(INGEST_SHEET_WORKERS, 1)
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    
+    def ingest(position: int, sheet_name: str, batches) -> int:
+        processed = 0
+        try:
+            for batch in batches:
+                if not batch:
+                    continue
+                row_numbers = [row_number for row_number, _, _ in batch]
+                digest, row_hashes = batch_hashes(batch)
+                # Matched on every run, so a resumed run still knows which previous rows live on
+                carried = diff.match(batch) if diff else {}
+                checkpoint = committed.get((sheet_name, row_numbers[0]))
+                if checkpoint is not None and checkpoint['hash'] == digest:
+                    count = checkpoint['rows']
+                else:
+                    vectors = diff.vectors(carried) if carried else None
+                    count, complete = _flush_rows(db, vector_service, batch, errors, vectors)
+                    if complete:
+                        checkpoints.commit(document_id, sheet_name, row_numbers, digest, row_hashes)
+                processed += count
+                # Sheet names may contain '.', so sheets are addressed by position
+                db.documents.update_one(
+                    {'_id': document_id},
+                    {'$inc': {'records_processed': count, f'sheets.{position}.records_processed': count}}
+                )
+            return processed
+        finally:
+            in_flight.release()
+    
+    total = processed = 0
+    sheets = []  # (position, name, chunk futures, status decided while reading)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+        for position, (sheet_name, chunks) in enumerate(read_sheets(file_path, INGEST_BATCH_SIZE)):
+            print(f"Reading sheet '{sheet_name}'")
+            update = {'$push': {'sheets': {'name': sheet_name, 'status': 'processing',
+                                           'total_records': 0, 'records_processed': 0}}}
+            if position == 0:
+                update['$set'] = {'sheet_name': sheet_name}
+            db.documents.update_one({'_id': document_id}, update)
+            
+            futures, status = [], None
+            try:
+                for row_numbers, df in chunks:
+                    batches = sheet_batches(df, sheet_name, row_numbers)
+                    if batches is None:
+                        status = 'skipped'
+                        break
+                    in_flight.acquire()
+                    futures.append(pool.submit(ingest, position, sheet_name, batches))
+                    total += len(df)
+                    db.documents.update_one(
+                        {'_id': document_id},
+                        {'$inc': {'total_records': len(df), f'sheets.{position}.total_records': len(df)}}
+                    )
+            except Exception as e:
+                print(f"Error reading sheet '{sheet_name}': {str(e)}")
+                errors.append({'sheet': sheet_name, 'error': str(e)})
+                status = 'failed'
+            sheets.append((position, sheet_name, futures, status))
+        
+        for position, sheet_name, futures, status in sheets:
+            sheet_processed = 0
+            for future in futures:
+                try:
+                    sheet_processed += future.result()
+                except Exception as e:
+                    print(f"Error processing sheet '{sheet_name}': {str(e)}")
+                    errors.append({'sheet': sheet_name, 'error': str(e)})
+                    status = 'failed'
+            processed += sheet_processed
+            db.documents.update_one(
+                {'_id': document_id},
+                {'$set': {f'sheets.{position}.status': status or 'completed'}}
+            )
+            print(f"Sheet '{sheet_name}': {sheet_processed} records processed ({status or 'completed'})")
+    
+    # A partially ingested version leaves the previous one live until a re-run completes it
+    if diff is not None and not errors:
+        summary = diff.finalize(vector_service, processed)
+        if summary is not None:
+            db.documents.update_one({'_id': document_id}, {'$set': {'version_diff': summary}})
+    
+    return total, processed
+
 class FileProcessingService:
     def __init__(self, db):
         self.vector_service = VectorSearchService(db)
@@ -273,22 +741,23 @@ class FileProcessingService:
                 file_processor = FileProcessingService(db)
                 
                 if document.get('document_type') == 'RFP':
-                    # Process Excel as simple text chunks
-                    file_processor._process_simple_rfp(document)
+                    # Process Excel as simple text chunks ('partial' when some sheets failed)
+                    status = file_processor._process_simple_rfp(document)
                 else:
                     # Process PDF/DOCX as documentation
                     file_processor._process_documentation(document)
+                    status = 'completed'
                 
                 db.documents.update_one(
                     {'_id': ObjectId(document_id)},
                     {
                         '$set': {
-                            'status': 'completed',
+                            'status': status,
                             'completed_at': datetime.now()
                         }
                     }
                 )
-                print(f"Document {document_id} processed successfully in simple mode")
+                print(f"Document {document_id} processed in simple mode ({status})")
                 
             elif document.get('document_type') == 'RFP':
                 # Professional mode: Wait for column mapping
@@ -355,131 +824,15 @@ class FileProcessingService:
                 if not file_path or not os.path.exists(file_path):
                     raise FileNotFoundError(f"File not found: {file_path}")
             
-            # Read Excel file - handle multiple sheets
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names
-            
-            print(f"Found {len(sheet_names)} sheet(s): {sheet_names}")
-            
-            # Get first sheet (or specific sheet if specified)
-            sheet_name = sheet_names[0] if sheet_names else None
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            total_records = len(df)
-            
-            # Debug: Print column names
-            print(f"Excel columns found: {list(df.columns)}")
-            print(f"Mapped requirement column: '{mappings.get('requirement', '')}'")
-            print(f"Column exists in DataFrame: {mappings.get('requirement', '') in df.columns}")
-            
-            # Print first row data
-            if len(df) > 0:
-                first_row = df.iloc[0]
-                print(f"First row data: {dict(first_row)}")
+            def sheet_batches(df: pd.DataFrame, sheet_name: str, row_numbers):
                 req_col = mappings.get('requirement', '')
-                if req_col in df.columns:
-                    print(f"First row requirement value: {repr(first_row[req_col])}")
-                else:
-                    print(f"ERROR: Required column '{req_col}' not found in DataFrame!")
-            
-            db.documents.update_one(
-                {'_id': ObjectId(document_id)},
-                {'$set': {
-                    'total_records': total_records, 
-                    'status': 'processing',
-                    'sheet_name': sheet_name  # Store sheet name
-                }}
-            )
+                if req_col not in df.columns:
+                    print(f"Sheet '{sheet_name}' has no mapped requirement column '{req_col}', skipping it")
+                    return None
+                return mapped_row_batches(df, mappings, document, sheet_name, INGEST_BATCH_SIZE, row_numbers)
             
             errors = []
-            processed = 0
-            
-            for idx, row in df.iterrows():
-                try:
-                    # Extract data based on mapping with proper handling
-                    product_val = row.get(mappings.get('product', ''), 'General')
-                    requirement_val = row.get(mappings.get('requirement', ''), '')
-                    req_category_val = row.get(mappings.get('requirement_category', ''), 'Must Have')
-                    resp_category_val = row.get(mappings.get('response_category', ''), 'Readily Available')
-                    effort_val = row.get(mappings.get('effort_required', ''), '') if mappings.get('effort_required') else None
-                    comments_val = row.get(mappings.get('comments', ''), '') if mappings.get('comments') else None
-                    
-                    # Convert to string and handle NaN/None
-                    def clean_value(val, default=''):
-                        if pd.isna(val) or val is None:
-                            return default
-                        return str(val).strip()
-                    
-                    # Debug: Log the raw values for first 3 rows
-                    if idx < 3:
-                        print(f"Row {idx + 1} DEBUG:")
-                        print(f"  Mappings: {mappings}")
-                        print(f"  Available columns: {list(row.keys())}")
-                        print(f"  requirement column name: '{mappings.get('requirement', '')}'")
-                        print(f"  requirement raw value: {repr(requirement_val)}")
-                        print(f"  requirement cleaned: '{clean_value(requirement_val)}'")
-                    
-                    entry = {
-                        '_id': ObjectId(),
-                        'document_id': ObjectId(document_id),
-                        'product': clean_value(product_val, 'General'),
-                        'requirement': clean_value(requirement_val, ''),
-                        'requirement_category': clean_value(req_category_val, 'Must Have'),
-                        'response_category': clean_value(resp_category_val, 'Readily Available'),
-                        'effort_required': clean_value(effort_val, None) if effort_val is not None else None,
-                        'comments': clean_value(comments_val, None) if comments_val is not None else None,
-                        'sheet_name': sheet_name,  # Add sheet name
-                        'file_name': document['file_name'],  # Add file name
-                        'rfp_name': document.get('metadata', {}).get('rfp_name', 'Unknown RFP'),
-                        'bank_name': document.get('metadata', {}).get('bank_name', 'Unknown Bank'),
-                        'date': datetime.now(),
-                        'created_at': datetime.now(),
-                        'last_modified': datetime.now()
-                    }
-                    
-                    # Skip if requirement is empty or too short
-                    if not entry['requirement'] or len(entry['requirement']) < 3:
-                        print(f"Skipping row {idx + 1}: Empty or too short requirement (value: '{entry['requirement']}')")
-                        continue
-                    
-                    # Insert into MongoDB
-                    db.rfp_entries.insert_one(entry)
-                    
-                    # Index in vector database
-                    try:
-                        vector_service.index_document(
-                            doc_id=str(entry['_id']),
-                            text=entry['requirement'],
-                            metadata={
-                                'product': entry['product'],
-                                'requirement': entry['requirement'],
-                                'requirement_category': entry['requirement_category'],
-                                'response_category': entry['response_category'],
-                                'effort_required': entry['effort_required'] or '',
-                                'comments': entry['comments'] or '',
-                                'sheet_name': sheet_name,  # Add sheet name to vector metadata
-                                'file_name': document['file_name'],  # Add file name
-                                'rfp_name': entry['rfp_name'],
-                                'bank_name': entry['bank_name'],
-                                'date': entry['date'].isoformat()
-                            }
-                        )
-                    except Exception as e:
-                        print(f"Warning: Failed to index entry in vector DB: {str(e)}")
-                    
-                    processed += 1
-                    
-                    # Update progress every 100 records
-                    if processed % 100 == 0:
-                        db.documents.update_one(
-                            {'_id': ObjectId(document_id)},
-                            {'$set': {'records_processed': processed}}
-                        )
-                        print(f"Processed {processed}/{total_records} records")
-                    
-                except Exception as e:
-                    error_msg = f"Row {idx + 1}: {str(e)}"
-                    errors.append({'row': idx + 1, 'error': str(e)})
-                    print(f"Error processing row {idx + 1}: {str(e)}")
+            total_records, processed = _ingest_sheets(db, vector_service, document, file_path, sheet_batches, errors)
             
             # Update document status
             db.documents.update_one(
@@ -487,6 +840,7 @@ class FileProcessingService:
                 {
                     '$set': {
                         'records_processed': processed,
+                        'column_mappings': mappings,
                         'error_details': errors,
                         'status': 'completed' if not errors else 'partial',
                         'completed_at': datetime.now()
@@ -509,7 +863,7 @@ class FileProcessingService:
                 }
             )
         finally:
-            # Clean up temporary file if it was created
+            # Clean up temporary file (or blob cache lease) if it was created
             if temp_file_path and os.path.exists(temp_file_path):
                 try:
                     os.unlink(temp_file_path)
@@ -517,8 +871,8 @@ class FileProcessingService:
                 except Exception as cleanup_error:
                     print(f"Warning: Failed to clean up temp file: {cleanup_error}")
     
-    def _process_simple_rfp(self, document: Dict):
-        """Process RFP Excel file in simple mode (no column mapping)"""
+    def _process_simple_rfp(self, document: Dict) -> str:
+        """Process RFP Excel file in simple mode (no column mapping), returns the status recorded"""
         print(f"Processing RFP in Simple mode: {document['file_name']}")
         
         temp_file_path = None
@@ -534,119 +888,31 @@ class FileProcessingService:
                 if not file_path or not os.path.exists(file_path):
                     raise FileNotFoundError(f"File not found: {file_path}")
             
-            # Read Excel file - handle multiple sheets
-            excel_file = pd.ExcelFile(file_path)
-            sheet_names = excel_file.sheet_names
-            
-            print(f"Found {len(sheet_names)} sheet(s): {sheet_names}")
-            
-            # Get first sheet (or specific sheet if specified)
-            sheet_name = sheet_names[0] if sheet_names else None
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-            total_rows = len(df)
-            
-            print(f"Found {total_rows} rows with columns: {list(df.columns)}")
-            print(f"Processing sheet: {sheet_name}")
-            
-            # Update status
-            self.db.documents.update_one(
-                {'_id': document['_id']},
-                {'$set': {
-                    'total_records': total_rows, 
-                    'status': 'processing',
-                    'sheet_name': sheet_name  # Store sheet name
-                }}
+            # Each row is serialized column-wise as "col: value | ..." text
+            errors = []
+            total_rows, processed = _ingest_sheets(
+                self.db, self.vector_service, document, file_path,
+                lambda df, sheet_name, row_numbers: simple_row_batches(
+                    df, document, sheet_name, INGEST_BATCH_SIZE, row_numbers),
+                errors
             )
             
-            processed = 0
-            
-            # Process each row
-            for idx, row in df.iterrows():
-                try:
-                    # Convert entire row to text (all columns combined)
-                    row_text_parts = []
-                    for col_name in df.columns:
-                        value = row[col_name]
-                        if pd.notna(value) and str(value).strip():
-                            # Include column name for context
-                            row_text_parts.append(f"{col_name}: {str(value).strip()}")
-                    
-                    row_text = " | ".join(row_text_parts)
-                    
-                    # Skip empty rows
-                    if not row_text or len(row_text) < 10:
-                        continue
-                    
-                    # Create entry with minimal structure
-                    entry = {
-                        '_id': ObjectId(),
-                        'document_id': document['_id'],
-                        'requirement': row_text,
-                        'product': 'General',  # Default for simple mode
-                        'requirement_category': 'Auto-Processed',
-                        'response_category': 'Pending Review',
-                        'processing_mode': 'simple',
-                        'row_number': idx + 1,
-                        'sheet_name': sheet_name,  # Add sheet name
-                        'file_name': document['file_name'],  # Add file name
-                        'rfp_name': document.get('metadata', {}).get('rfp_name', 'Unknown RFP'),
-                        'bank_name': document.get('metadata', {}).get('bank_name', 'Unknown Bank'),
-                        'created_at': datetime.now(),
-                        'last_modified': datetime.now()
-                    }
-                    
-                    # Insert into MongoDB
-                    self.db.rfp_entries.insert_one(entry)
-                    
-                    # Index in vector database
-                    try:
-                        self.vector_service.index_document(
-                            doc_id=str(entry['_id']),
-                            text=row_text,
-                            metadata={
-                                'document_id': str(document['_id']),
-                                'requirement': row_text[:500],  # Truncate for metadata
-                                'product': 'General',
-                                'requirement_category': 'Auto-Processed',
-                                'response_category': 'Pending Review',
-                                'processing_mode': 'simple',
-                                'row_number': idx + 1,
-                                'sheet_name': sheet_name,  # Add sheet name to vector metadata
-                                'file_name': document['file_name'],  # Add file name
-                                'rfp_name': entry['rfp_name'],
-                                'bank_name': entry['bank_name']
-                            }
-                        )
-                    except Exception as e:
-                        print(f"Warning: Failed to index entry in vector DB: {str(e)}")
-                    
-                    processed += 1
-                    
-                    # Update progress every 50 records
-                    if processed % 50 == 0:
-                        self.db.documents.update_one(
-                            {'_id': document['_id']},
-                            {'$set': {'records_processed': processed}}
-                        )
-                        print(f"Processed {processed}/{total_rows} rows in simple mode")
-                
-                except Exception as e:
-                    print(f"Error processing row {idx + 1}: {str(e)}")
-                    continue
-            
             # Final update
+            status = 'completed' if not errors else 'partial'
             self.db.documents.update_one(
                 {'_id': document['_id']},
                 {
                     '$set': {
                         'records_processed': processed,
-                        'status': 'completed',
+                        'error_details': errors,
+                        'status': status,
                         'completed_at': datetime.now()
                     }
                 }
             )
             
             print(f"Simple mode processing complete: {processed}/{total_rows} rows processed")
+            return status
             
         except Exception as e:
             print(f"Error in simple RFP processing: {str(e)}")
@@ -654,7 +920,7 @@ class FileProcessingService:
             traceback.print_exc()
             raise
         finally:
-            # Clean up temporary file if it was created
+            # Clean up temporary file (or blob cache lease) if it was created
             if temp_file_path and os.path.exists(temp_file_path):
                 try:
                     os.unlink(temp_file_path)
@@ -679,74 +945,66 @@ class FileProcessingService:
                 if not file_path or not os.path.exists(file_path):
                     raise FileNotFoundError(f"File not found: {file_path}")
             
-            if file_ext == 'pdf':
-                text = self._extract_pdf_text(file_path)
-            elif file_ext == 'docx':
-                text = self._extract_docx_text(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_ext}")
-            
-            # Chunk text and index
-            chunks = self._chunk_text(text)
+            # Pages (PDF) or heading sections (DOCX), numbered for citations, streamed into
+            # the chunker; chunks are embedded as they are produced
+            unit, segments = iter_segments(file_path, file_ext)
+            chunks = chunk_segments(segments, section_headings=unit == 'section')
             metadata = document.get('metadata', {})
+            document_id = str(document['_id'])
+            # Enough chunks to keep every embedding request slot busy
+            batch_size = max(EMBEDDING_BATCH_MAX_TOKENS // CHUNK_TOKENS, 1) * max(EMBEDDING_CONCURRENCY, 1)
             
-            for i, chunk in enumerate(chunks):
-                chunk_id = f"{document['_id']}_chunk_{i}"
-                self.vector_service.index_document(
-                    doc_id=chunk_id,
-                    text=chunk,
-                    metadata={
-                        'document_id': str(document['_id']),
-                        'document_name': metadata.get('document_name', document['file_name']),
-                        'related_product': metadata.get('related_product', 'General'),
-                        'submodule': metadata.get('submodule', ''),
-                        'document_category': metadata.get('document_category', 'Documentation'),
-                        'chunk_index': i,
-                        'total_chunks': len(chunks)
-                    }
-                )
+            # A re-run may produce fewer chunks, stale ones must not stay searchable
+            self.vector_service.remove_document(document_id)
+            
+            count = failed = 0
+            while True:
+                batch = list(itertools.islice(chunks, batch_size))
+                if not batch:
+                    break
+                stored = self.vector_service.index_documents([
+                    (
+                        f"{document_id}_chunk_{count + i}",
+                        chunk,
+                        {
+                            'document_id': document_id,
+                            'document_name': metadata.get('document_name', document['file_name']),
+                            'related_product': metadata.get('related_product', 'General'),
+                            'submodule': metadata.get('submodule', ''),
+                            'document_category': metadata.get('document_category', 'Documentation'),
+                            'chunk_index': count + i,
+                            f'{unit}_start': first,
+                            f'{unit}_end': last,
+                            'text': chunk  # Lets the lexical index rebuild chunk postings
+                        }
+                    )
+                    for i, (chunk, first, last) in enumerate(batch)
+                ])
+                failed += stored.count(False)
+                count += len(batch)
+                self.db.documents.update_one({'_id': document['_id']}, {'$set': {'records_processed': count}})
+            
+            # Only known once the stream is exhausted
+            self.db[self.vector_service.collection_name].update_many(
+                {'document_id': document_id}, {'$set': {'metadata.total_chunks': count}}
+            )
+            print(f"Indexed {count} chunks of {document['file_name']}")
+            if failed:
+                raise Exception(f"Failed to embed {failed}/{count} chunks")
             
             # Update document with processed count
             self.db.documents.update_one(
                 {'_id': document['_id']},
-                {'$set': {'records_processed': len(chunks)}}
+                {'$set': {'records_processed': count}}
             )
         finally:
-            # Clean up temporary file if it was created
+            # Clean up temporary file (or blob cache lease) if it was created
             if temp_file_path and os.path.exists(temp_file_path):
                 try:
                     os.unlink(temp_file_path)
                     print(f"Cleaned up temporary file: {temp_file_path}")
                 except Exception as cleanup_error:
                     print(f"Warning: Failed to clean up temp file: {cleanup_error}")
-    
-    def _extract_pdf_text(self, file_path: str) -> str:
-        """Extract text from PDF"""
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    
-    def _extract_docx_text(self, file_path: str) -> str:
-        """Extract text from DOCX"""
-        doc = DocxDocument(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
-        
-        return chunks
 
 class DocumentService:
     """Service for document operations"""
@@ -0,0 +1,30 @@
+"""
+Tests for text_chunker heading detection and chunk boundaries
+
+Usage:
+    python -m pytest test_text_chunker.py
+"""
+
+from text_chunker import text_units, chunk_segments
+
+
+def test_heading_in_its_own_paragraph():
+    units = list(text_units("Intro.\n\nChapter 2 Overview\n\nBody."))
+    assert units == [('Intro.', False), ('Chapter 2 Overview', True), ('Body.', False)]
+
+
+def test_heading_between_lines_of_one_paragraph():
+    units = list(text_units("Intro.\nChapter 2 Overview\nBody text here."))
+    assert ('Chapter 2 Overview', True) in units
+
+
+def test_trailing_short_line_is_not_a_heading():
+    assert list(text_units("Intro.\n\nChapter 2 Overview")) == [('Intro.', False), ('Chapter 2 Overview', False)]
+
+
+def test_chunk_starts_at_a_paragraph_heading():
+    first = ' '.join(f"Sentence number {i} of the introduction." for i in range(8))
+    text = f"{first}\n\nChapter 2 Overview\n\nThe second chapter starts here."
+    chunks = list(chunk_segments([(1, text)], chunk_tokens=100, overlap_tokens=20))
+    assert len(chunks) == 2
+    assert chunks[1][0].startswith('Chapter 2 Overview')
@@ -0,0 +1,134 @@
+"""
+Streaming, token-aware chunking of documentation text
+Consumes (page or section number, text) segments as extraction produces them
+and yields (chunk, first segment, last segment) as soon as each chunk is full.
+Text is split into paragraphs and sentences and chunks are sized by estimated
+tokens: a chunk closes before the sentence that would overflow it (or at a
+heading once it is half full), and its last sentences open the next chunk as
+overlap. A sentence longer than a whole chunk is split on words, so every
+chunk fits the embedding input and nothing is truncated. Only the chunk being
+built is held in memory.
+
+Usage:
+    CHUNK_TOKENS=1000               estimated tokens per chunk, at most
+    CHUNK_OVERLAP_TOKENS=200        estimated tokens repeated from the previous chunk
+"""
+
+import os
+import re
+from typing import List, Tuple, Iterator, Iterable
+
+CHUNK_TOKENS = int(os.environ.get('CHUNK_TOKENS', '1000'))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', '200'))
+
+# Sentence end: terminal punctuation, whitespace, then something that can start a sentence
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(\[“])')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+HEADING_MAX_WORDS = 12
+TERMINAL_PUNCTUATION = '.,;:!?'
+
+Chunk = Tuple[str, int, int]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), enough to pack request budgets"""
+    return len(text) // 4 + 1
+
+
+def _is_heading(line: str) -> bool:
+    # Short, capitalized or numbered, and not the end of a sentence
+    return (len(line.split()) <= HEADING_MAX_WORDS and (line[0].isupper() or line[0].isdigit())
+            and line[-1] not in TERMINAL_PUNCTUATION)
+
+
+def text_units(text: str) -> Iterator[Tuple[str, bool]]:
+    """(sentence or heading, is heading) of a segment, in order, whitespace folded"""
+    blocks = [[line.strip() for line in block.split('\n') if line.strip()] for block in PARAGRAPH_BREAK.split(text)]
+    blocks = [lines for lines in blocks if lines]
+    for number, lines in enumerate(blocks):
+        followed = number < len(blocks) - 1
+        body: List[str] = []
+        for i, line in enumerate(lines):
+            # A heading stands on its own line (often its own paragraph) after a finished
+            # sentence or at the start, and something follows it
+            previous_done = i == 0 or lines[i - 1][-1] in '.!?:'
+            if previous_done and (i < len(lines) - 1 or followed) and _is_heading(line):
+                yield from _sentences(body)
+                body = []
+                yield ' '.join(line.split()), True
+            else:
+                body.append(line)
+        yield from _sentences(body)
+
+
+def _sentences(lines: List[str]) -> Iterator[Tuple[str, bool]]:
+    text = ' '.join(' '.join(lines).split())
+    if text:
+        for sentence in SENTENCE_BREAK.split(text):
+            yield sentence, False
+
+
+def _fit(unit: str, limit: int) -> Iterator[str]:
+    """The unit itself, or word (and if need be character) pieces of at most `limit` tokens"""
+    if estimate_tokens(unit) <= limit:
+        yield unit
+        return
+    max_chars = max((limit - 1) * 4, 1)
+    piece: List[str] = []
+    length = 0
+    for word in unit.split(' '):
+        while len(word) > max_chars:  # e.g. an encoded blob without spaces
+            if piece:
+                yield ' '.join(piece)
+                piece, length = [], 0
+            yield word[:max_chars]
+            word = word[max_chars:]
+        if piece and length + 1 + len(word) > max_chars:
+            yield ' '.join(piece)
+            piece, length = [], 0
+        length += len(word) + (1 if piece else 0)
+        piece.append(word)
+    if piece:
+        yield ' '.join(piece)
+
+
+def chunk_segments(segments: Iterable[Tuple[int, str]], chunk_tokens: int = CHUNK_TOKENS,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS, section_headings: bool = False) -> Iterator[Chunk]:
+    """
+    Yield (text, first segment number, last segment number) chunks of at most chunk_tokens
+    estimated tokens. With section_headings every segment starts with a heading (DOCX sections).
+    """
+    chunk_tokens = max(chunk_tokens, 2)
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+    parts: List[Tuple[str, int, int]] = []  # (text, tokens, segment number) of the open chunk
+    size = 0
+    fresh = False  # open chunk has more than the overlap carried into it
+
+    def emit() -> Chunk:
+        return ' '.join(text for text, _, _ in parts), parts[0][2], parts[-1][2]
+
+    for number, text in segments:
+        for i, (unit, heading) in enumerate(text_units(text)):
+            if (heading or (section_headings and i == 0)) and fresh and size >= chunk_tokens // 2:
+                # New topic: start a fresh chunk, overlap would only carry the old one in
+                yield emit()
+                parts, size, fresh = [], 0, False
+            for piece in _fit(unit, chunk_tokens):
+                tokens = estimate_tokens(piece)
+                if parts and size + tokens > chunk_tokens:
+                    if fresh:
+                        yield emit()
+                    # Carry the last sentences over, leaving room for this piece
+                    budget = min(overlap_tokens, chunk_tokens - tokens)
+                    carried, carried_size = [], 0
+                    for part in reversed(parts):
+                        if carried_size + part[1] > budget:
+                            break
+                        carried.insert(0, part)
+                        carried_size += part[1]
+                    parts, size, fresh = carried, carried_size, False
+                parts.append((piece, tokens, number))
+                size += tokens
+                fresh = True
+    if parts and fresh:
+        yield emit()
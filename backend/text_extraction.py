@@ -0,0 +1,136 @@
+"""
+Parallel text extraction from PDF and DOCX documentation
+PDF pages are split into contiguous spans parsed by a process pool (PyPDF2 is
+pure Python, so threads would share one core) and come back as an ordered
+stream of (page number, text), with a bounded number of spans in flight; DOCX
+documents stream one (section number, text) piece per heading. Nothing is
+concatenated piece by piece, and the page or section number of every piece is
+kept so chunks can cite where their text came from.
+
+Usage:
+    EXTRACT_WORKERS=0                   processes parsing PDF pages (0 = one per core)
+    EXTRACT_PARALLEL_MIN_PAGES=32       smaller PDFs are parsed in-process
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from typing import List, Tuple, Iterator, Optional
+from PyPDF2 import PdfReader
+from docx import Document as DocxDocument
+
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', '0')) or os.cpu_count() or 1
+EXTRACT_PARALLEL_MIN_PAGES = int(os.environ.get('EXTRACT_PARALLEL_MIN_PAGES', '32'))
+# Pages per pool task, enough to amortize each worker opening the PDF
+EXTRACT_SPAN_PAGES = int(os.environ.get('EXTRACT_SPAN_PAGES', '16'))
+
+TextSegment = Tuple[int, str]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a web or job process that runs threads is not safe
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _page_text(page) -> str:
+    return page.extract_text() or ''
+
+
+def extract_pdf_span(file_path: str, start: int, stop: int) -> List[str]:
+    """Texts of pages [start, stop) of a PDF (runs in a pool process)"""
+    reader = PdfReader(file_path)
+    return [_page_text(reader.pages[i]) for i in range(start, stop)]
+
+
+def _parallel_allowed(page_count: int) -> bool:
+    # Daemonic processes (e.g. Celery prefork children) may not start a pool of their own
+    return (EXTRACT_WORKERS > 1 and page_count >= EXTRACT_PARALLEL_MIN_PAGES
+            and not multiprocessing.current_process().daemon)
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[TextSegment]:
+    """(1-based page number, text) of every page, in order"""
+    reader = PdfReader(file_path)
+    count = len(reader.pages)
+    spans = [(start, min(start + EXTRACT_SPAN_PAGES, count)) for start in range(0, count, EXTRACT_SPAN_PAGES)]
+    parallel = _parallel_allowed(count)
+    # Spans submitted ahead of the consumer, bounds the page texts held in memory
+    futures = deque()
+    ahead = iter(spans)
+
+    def submit_ahead():
+        nonlocal parallel
+        while parallel and len(futures) < EXTRACT_WORKERS * 2:
+            span = next(ahead, None)
+            if span is None:
+                return
+            try:
+                futures.append(_process_pool().submit(extract_pdf_span, file_path, *span))
+            except Exception as e:
+                print(f"⚠️ PDF extraction pool unavailable ({e}), parsing in-process")
+                _reset_pool()
+                parallel = False
+                futures.clear()
+
+    for start, stop in spans:
+        submit_ahead()
+        texts = None
+        if futures:
+            try:
+                texts = futures.popleft().result()
+            except BrokenProcessPool:
+                print("⚠️ PDF extraction pool died, parsing the remaining pages in-process")
+                _reset_pool()
+                parallel = False
+                futures.clear()
+            except OSError as e:
+                # Pool processes reopen the file by path, this process still holds it open
+                print(f"⚠️ PDF not readable in the extraction pool ({e}), parsing the remaining pages in-process")
+                parallel = False
+                futures.clear()
+        if texts is None:
+            texts = [_page_text(reader.pages[page]) for page in range(start, stop)]
+        for offset, text in enumerate(texts):
+            yield start + offset + 1, text
+
+
+def iter_docx_sections(file_path: str) -> Iterator[TextSegment]:
+    """(1-based section number, text) of a DOCX, a new section starting at every heading"""
+    document = DocxDocument(file_path)
+    number, lines = 1, []
+    for paragraph in document.paragraphs:
+        style = paragraph.style.name if paragraph.style is not None else ''
+        if style.startswith('Heading') and lines:
+            yield number, '\n'.join(lines)
+            number, lines = number + 1, []
+        lines.append(paragraph.text)
+    if lines:
+        yield number, '\n'.join(lines)
+
+
+def iter_segments(file_path: str, file_ext: str) -> Tuple[str, Iterator[TextSegment]]:
+    """('page' | 'section', stream of numbered text segments) of a documentation file"""
+    if file_ext == 'pdf':
+        return 'page', iter_pdf_pages(file_path)
+    if file_ext == 'docx':
+        return 'section', iter_docx_sections(file_path)
+    raise ValueError(f"Unsupported file type: {file_ext}")
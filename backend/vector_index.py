@@ -0,0 +1,692 @@
+"""
+Process-resident vector index for VectorSearchService
+Keeps every embedding as one contiguous, pre-normalized float32 matrix so a
+query is a single matrix-vector product followed by an argpartition top-k.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from bson import Binary
+
+# How often (seconds) a worker checks Mongo for vectors written by other processes
+VECTOR_INDEX_REFRESH_SECONDS = float(os.environ.get('VECTOR_INDEX_REFRESH_SECONDS', '5'))
+VECTOR_INDEX_LOAD_BATCH_SIZE = int(os.environ.get('VECTOR_INDEX_LOAD_BATCH_SIZE', '500'))
+# created_at is stamped before a batch is written and batches commit out of order, so every
+# refresh also looks this far below its watermark for vectors it has not seen yet
+VECTOR_INDEX_REFRESH_WINDOW_SECONDS = float(os.environ.get('VECTOR_INDEX_REFRESH_WINDOW_SECONDS', '300'))
+# 'memory': private float32 matrix per worker, 'mmap': shared on-disk shards (see vector_store.py)
+VECTOR_STORE_MODE = os.environ.get('VECTOR_STORE_MODE', 'memory').lower()
+# 'exact': score every row, 'ivf': probe an inverted-file index built by ann_index.py
+VECTOR_SEARCH_ENGINE = os.environ.get('VECTOR_SEARCH_ENGINE', 'exact').lower()
+
+# 'array': BSON array of doubles (legacy), 'binary': one Binary blob of little-endian float32
+VECTOR_ENCODING = os.environ.get('VECTOR_ENCODING', 'array').lower()
+BINARY_VECTOR_ENCODING = 'f32le'
+
+# Matryoshka coarse stage: score a truncated, renormalized prefix first (0 = off)
+VECTOR_COARSE_DIMS = int(os.environ.get('VECTOR_COARSE_DIMS', '0'))
+# Rows surviving the coarse stage that are re-scored with every dimension
+VECTOR_COARSE_CANDIDATES = int(os.environ.get('VECTOR_COARSE_CANDIDATES', '300'))
+
+# Metadata kept per row for filtering; the rest is hydrated for the final top-n only
+RESIDENT_METADATA_FIELDS = ('product', 'response_category', 'requirement_category',
+                            'sheet_name', 'rfp_name', 'bank_name')
+
+# Fields with per-value posting lists for pre-filtering (document_id is a row attribute)
+FILTER_FIELDS = ('product', 'response_category', 'requirement_category', 'document_id',
+                 'bank_name', 'rfp_name', 'sheet_name')
+
+# IVF list ids of rows that are not yet assigned / no longer searchable
+LIST_PENDING = -1
+LIST_DEAD = -2
+
+
+def decode_vector(value) -> np.ndarray:
+    """Stored vector (BSON array or packed float32 Binary) as a float32 array, zero-copy for Binary"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype='<f4')
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_vector(vector):
+    """MongoDB representation of a vector for the configured VECTOR_ENCODING"""
+    if VECTOR_ENCODING == 'binary':
+        return Binary(np.asarray(vector, dtype='<f4').tobytes())
+    return np.asarray(vector, dtype=np.float64).tolist()
+
+
+def encoding_fields() -> Dict[str, Any]:
+    """Marker stored next to encoded vectors so migrations can find unconverted documents"""
+    return {'vector_encoding': BINARY_VECTOR_ENCODING if VECTOR_ENCODING == 'binary' else 'array'}
+
+
+def normalize_vector(vector) -> np.ndarray:
+    """Return a unit-length float32 copy of the vector (zero vectors stay zero)"""
+    vec = decode_vector(vector)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec
+
+
+def resident_metadata(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The filterable subset of an entry's metadata held in memory"""
+    metadata = metadata or {}
+    return {field: metadata[field] for field in RESIDENT_METADATA_FIELDS if metadata.get(field) is not None}
+
+
+def metadata_projection() -> Dict[str, int]:
+    return {f'metadata.{field}': 1 for field in RESIDENT_METADATA_FIELDS}
+
+
+def truncate_vector(vector, dims: int) -> np.ndarray:
+    """Matryoshka prefix: first `dims` components, renormalized to unit length"""
+    return normalize_vector(decode_vector(vector)[..., :dims])
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first"""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class ResidentVectorIndex:
+    """
+    In-memory copy of the vector_embeddings collection.
+
+    Row i of the matrix belongs to ids[i]; metadata[i] and document_ids[i]
+    are kept in the same order so a scored row maps straight back to its entry.
+    metadata[i] only holds RESIDENT_METADATA_FIELDS; callers hydrate the full
+    metadata of the rows they return with `hydrate`.
+
+    Stored vectors are only read through iter_row_blocks, gather_rows and
+    _score_rows, which every store (see MmapVectorIndex) implements.
+    """
+
+    def __init__(self, collection, dim: int):
+        self.collection = collection
+        self.dim = dim
+        self._lock = threading.RLock()
+        # Serializes full rebuilds, which run outside _lock (see load)
+        self._load_lock = threading.Lock()
+        # One delta refresh at a time; it reads MongoDB without holding _lock
+        self._refresh_lock = threading.Lock()
+        self._rebuild_log: Optional[List[Tuple[str, tuple, Dict[str, Any]]]] = None
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self.ids: List[str] = []
+        self.document_ids: List[Optional[str]] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self._row_of: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[Any, set]] = {field: {} for field in FILTER_FIELDS}
+        self._unindexed = set()  # entry ids stored without a usable vector
+        self._loaded = False
+        self._loaded_until: Optional[datetime] = None
+        self._checked_at = 0.0
+        # Optional IVF engine: per-row list assignment, parallel to the matrix rows
+        self.ann = None
+        self._ann_mtime = None
+        self._list_of = np.zeros(0, dtype=np.int32)
+        self._ann_pending = False
+        # Optional int8 codec: rows hold codes and the best candidates are re-ranked exactly
+        self.quantizer = None
+        # Optional Matryoshka prefix matrix, parallel to the matrix rows
+        self.coarse_dims = VECTOR_COARSE_DIMS if 0 < VECTOR_COARSE_DIMS < dim else 0
+        self._coarse = np.zeros((0, self.coarse_dims), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def lock(self) -> threading.RLock:
+        return self._lock
+
+    @property
+    def row_count(self) -> int:
+        """Number of stored rows, including any superseded ones"""
+        return self._size
+
+    def live_rows(self) -> np.ndarray:
+        """Positions of rows that are searchable"""
+        return np.arange(self._size)
+
+    def describe(self) -> Dict[str, Any]:
+        """Summary of the index for the API / logs"""
+        info = {'store': VECTOR_STORE_MODE, 'vectors': len(self), 'dim': self.dim, 'engine': 'exact',
+                'quantization': f"int8 v{self.quantizer.version}" if self.quantizer else 'none',
+                'coarse_dims': self.coarse_dims,
+                'coarse_candidates': VECTOR_COARSE_CANDIDATES if self.coarse_dims else 0}
+        if self.ann is not None:
+            from ann_index import VECTOR_ANN_MIN_ROWS
+            info.update(self.ann.describe())
+            info['exact_below'] = VECTOR_ANN_MIN_ROWS
+        return info
+
+    def _row_dtype(self):
+        return np.int8 if self.quantizer is not None else np.float32
+
+    def _reserve(self, rows: int):
+        """Grow the matrix capacity (doubling) so it can hold at least `rows` rows"""
+        capacity = self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        grown = np.zeros((new_capacity, self.dim), dtype=self._row_dtype())
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+        self._reserve_lists(new_capacity)
+        self._reserve_coarse(new_capacity)
+
+    def _reserve_coarse(self, rows: int):
+        if not self.coarse_dims or rows <= self._coarse.shape[0]:
+            return
+        grown = np.zeros((max(rows, self._coarse.shape[0] * 2, 1024), self.coarse_dims), dtype=np.float32)
+        grown[:self._size] = self._coarse[:self._size]
+        self._coarse = grown
+
+    def _reserve_lists(self, rows: int):
+        if rows <= self._list_of.shape[0]:
+            return
+        grown = np.full(max(rows, self._list_of.shape[0] * 2, 1024), LIST_PENDING, dtype=np.int32)
+        grown[:self._size] = self._list_of[:self._size]
+        self._list_of = grown
+
+    def _reset(self, expected_rows: int = 0):
+        self._matrix = np.zeros((max(expected_rows, 0), self.dim), dtype=self._row_dtype())
+        self._list_of = np.full(max(expected_rows, 0), LIST_PENDING, dtype=np.int32)
+        self._coarse = np.zeros((max(expected_rows, 0) if self.coarse_dims else 0, self.coarse_dims),
+                                dtype=np.float32)
+        self._size = 0
+        self.ids = []
+        self.document_ids = []
+        self.metadata = []
+        self._row_of = {}
+        self._postings = {field: {} for field in FILTER_FIELDS}
+        self._unindexed = set()
+        self._loaded_until = None
+
+    def _filter_values(self, row: int):
+        """(field, value) pairs of a row that are kept in the posting lists"""
+        metadata = self.metadata[row]
+        for field in FILTER_FIELDS:
+            value = self.document_ids[row] if field == 'document_id' else metadata.get(field)
+            if value is not None:
+                yield field, value
+
+    def _post(self, row: int):
+        for field, value in self._filter_values(row):
+            self._postings[field].setdefault(value, set()).add(row)
+
+    def _unpost(self, row: int):
+        for field, value in self._filter_values(row):
+            posting = self._postings[field].get(value)
+            if posting is not None:
+                posting.discard(row)
+                if not posting:
+                    del self._postings[field][value]
+
+    def _track_created_at(self, created_at):
+        if isinstance(created_at, datetime):
+            if self._loaded_until is None or created_at > self._loaded_until:
+                self._loaded_until = created_at
+
+    def upsert(self, entry_id: str, vector, metadata: Dict[str, Any], document_id: Optional[str] = None,
+               created_at: Optional[datetime] = None, codes: Optional[np.ndarray] = None,
+               short=None) -> bool:
+        """
+        Insert or replace a single row, returns False if the vector was unusable.
+
+        In int8 mode precomputed `codes` (vector_q8) can be passed instead of the vector,
+        and a stored Matryoshka prefix (`short`) saves deriving it from the codes.
+        """
+        full = None
+        if self.quantizer is not None and codes is not None:
+            vec = codes
+        else:
+            vec = full = normalize_vector(vector)
+            if self.quantizer is not None and vec.shape == (self.dim,):
+                vec = self.quantizer.encode(vec[None, :])[0]
+        if vec.ndim != 1 or vec.shape[0] != self.dim:
+            print(f"⚠️ Skipping vector for {entry_id}: dimension {vec.shape} != {self.dim}")
+            return False
+        if self.coarse_dims:
+            short = normalize_vector(short) if short is not None else None
+            if short is None or short.shape[0] != self.coarse_dims:
+                source = full if full is not None else self.quantizer.decode(vec)
+                short = truncate_vector(source, self.coarse_dims)
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(('upsert', (entry_id, vector, metadata),
+                                          {'document_id': document_id, 'created_at': created_at,
+                                           'codes': codes, 'short': short}))
+            row = self._row_of.get(entry_id)
+            if row is None:
+                self._reserve(self._size + 1)
+                row = self._size
+                self._size += 1
+                self._row_of[entry_id] = row
+                self.ids.append(entry_id)
+                self.document_ids.append(document_id)
+                self.metadata.append(resident_metadata(metadata))
+            else:
+                self._unpost(row)
+                self.document_ids[row] = document_id
+                self.metadata[row] = resident_metadata(metadata)
+            self._post(row)
+            self._matrix[row] = vec
+            if self.coarse_dims:
+                self._coarse[row] = short
+            self._list_of[row] = LIST_PENDING
+            self._ann_pending = True
+            self._unindexed.discard(entry_id)
+            self._track_created_at(created_at)
+        return True
+
+    def _remove_row(self, row: int):
+        """Remove a row by moving the last row into its slot"""
+        last = self._size - 1
+        removed_id = self.ids[row]
+        self._unpost(row)
+        if row != last:
+            self._unpost(last)
+            self._matrix[row] = self._matrix[last]
+            self._list_of[row] = self._list_of[last]
+            if self.coarse_dims:
+                self._coarse[row] = self._coarse[last]
+            self.ids[row] = self.ids[last]
+            self.document_ids[row] = self.document_ids[last]
+            self.metadata[row] = self.metadata[last]
+            self._row_of[self.ids[row]] = row
+            self._post(row)
+        self.ids.pop()
+        self.document_ids.pop()
+        self.metadata.pop()
+        del self._row_of[removed_id]
+        self._size = last
+
+    def remove_document(self, document_id: str) -> int:
+        """Drop every row belonging to a document, returns number removed"""
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(('remove_document', (document_id,), {}))
+            rows = [i for i, doc_id in enumerate(self.document_ids) if doc_id == document_id]
+            for row in sorted(rows, reverse=True):
+                self._remove_row(row)
+            return len(rows)
+
+    def remove_entries(self, entry_ids: List[str]) -> int:
+        """Drop the rows of specific entries (vectors stored without a document_id)"""
+        with self._lock:
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(('remove_entries', (entry_ids,), {}))
+            rows = [self._row_of[entry_id] for entry_id in entry_ids if entry_id in self._row_of]
+            for row in sorted(rows, reverse=True):
+                self._remove_row(row)
+            self._unindexed.difference_update(entry_ids)
+            return len(rows)
+
+    def _load_cursor(self, cursor) -> int:
+        loaded = 0
+        for doc in cursor:
+            vector = doc.get('vector')
+            codes = doc.get('vector_q8')
+            if codes is not None:
+                from vector_quant import ScalarQuantizer
+                codes = ScalarQuantizer.from_codes_field(codes)
+            indexed = (vector is not None or codes is not None) and self.upsert(
+                doc['entry_id'],
+                vector,
+                doc.get('metadata', {}),
+                document_id=doc.get('document_id'),
+                created_at=doc.get('created_at'),
+                codes=codes,
+                short=doc.get('vector_short') if doc.get('short_dims') == self.coarse_dims else None
+            )
+            if indexed:
+                loaded += 1
+            else:
+                self._unindexed.add(doc.get('entry_id'))
+        return loaded
+
+    def _projection(self, vector_field: str = 'vector') -> Dict[str, int]:
+        projection = {'_id': 0, 'entry_id': 1, 'document_id': 1, vector_field: 1, 'created_at': 1,
+                      **metadata_projection()}
+        if self.coarse_dims and vector_field != 'vector':
+            # Without the full vector the stored prefix is more precise than decoding codes
+            projection.update({'vector_short': 1, 'short_dims': 1})
+        return projection
+
+    def _fetch(self, mongo_filter: Dict[str, Any]) -> int:
+        """Load matching vector documents, reading int8 codes instead of doubles when they are current"""
+        if self.quantizer is None:
+            cursor = self.collection.find(mongo_filter, self._projection())
+            return self._load_cursor(cursor.batch_size(VECTOR_INDEX_LOAD_BATCH_SIZE))
+        version = self.quantizer.version
+        coded = self.collection.find({**mongo_filter, 'q8_version': version}, self._projection('vector_q8'))
+        uncoded = self.collection.find({**mongo_filter, 'q8_version': {'$ne': version}}, self._projection())
+        return (self._load_cursor(coded.batch_size(VECTOR_INDEX_LOAD_BATCH_SIZE)) +
+                self._load_cursor(uncoded.batch_size(VECTOR_INDEX_LOAD_BATCH_SIZE)))
+
+    def _quantizer_changed(self) -> bool:
+        """True when the deployment's int8 quantizer is not the one the rows are coded with"""
+        from vector_quant import VECTOR_QUANTIZATION, quantizer_version
+        if VECTOR_QUANTIZATION != 'int8':
+            return False
+        current = self.quantizer.version if self.quantizer else None
+        return quantizer_version(self.collection.database) != current
+
+    # Everything load() rebuilds, swapped in at once
+    _LOADED_STATE = ('quantizer', '_matrix', '_list_of', '_coarse', '_size', 'ids', 'document_ids',
+                     'metadata', '_row_of', '_postings', '_unindexed', '_loaded_until')
+
+    def load(self, wait: bool = True) -> bool:
+        """
+        (Re)build the whole index from MongoDB. The new matrix is built without holding the
+        lock, searches keep using the current one until it is swapped in. Returns False when
+        wait is False and another thread is already rebuilding.
+        """
+        if not self._load_lock.acquire(blocking=wait):
+            return False
+        try:
+            started = time.time()
+            from vector_quant import VECTOR_QUANTIZATION, load_quantizer
+            fresh = ResidentVectorIndex(self.collection, self.dim)
+            fresh.coarse_dims = self.coarse_dims
+            if VECTOR_QUANTIZATION == 'int8':
+                fresh.quantizer = load_quantizer(self.collection.database)
+            with self._lock:
+                # Writes made by this process meanwhile are replayed onto the new matrix
+                self._rebuild_log = []
+            try:
+                fresh._reset(self.collection.estimated_document_count())
+                loaded = fresh._fetch({})
+            except Exception:
+                with self._lock:
+                    self._rebuild_log = None
+                raise
+            with self._lock:
+                replay, self._rebuild_log = self._rebuild_log, None
+                for name in self._LOADED_STATE:
+                    setattr(self, name, getattr(fresh, name))
+                for method, args, kwargs in replay:
+                    getattr(self, method)(*args, **kwargs)
+                self._loaded = True
+                self._checked_at = time.time()
+                self._ann_mtime = None
+                self._refresh_ann()
+            print(f"✅ Resident vector index loaded: {loaded} vectors in {time.time() - started:.2f}s")
+            return True
+        finally:
+            self._load_lock.release()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Pick up vectors written by other processes since the last load. MongoDB is queried
+        without holding the lock, which is only taken to apply each fetched row, so searches
+        keep running meanwhile. Returns False when the index may still be behind the store
+        (a rebuild or another refresh is in progress, or a needed rebuild was skipped).
+        """
+        if not self._loaded:
+            # Nothing to serve yet, callers wait for the first load
+            with self._load_lock:
+                pass
+            if not self._loaded:
+                self.load()
+            return True
+        if self._rebuild_log is not None:
+            return False  # a rebuild is reading the collection, the next refresh covers what it misses
+        if not force and time.time() - self._checked_at < VECTOR_INDEX_REFRESH_SECONDS:
+            return True
+        if not self._refresh_lock.acquire(blocking=False):
+            return False  # another thread is already refreshing
+        try:
+            self._checked_at = time.time()
+            # A retrained quantizer invalidates every stored code
+            rebuild = self._quantizer_changed()
+            if not rebuild and self._loaded_until is not None:
+                since = self._loaded_until
+                self._fetch({'created_at': {'$gte': since}})
+                # Batches stamped before the watermark but committed after the last refresh
+                window = since - timedelta(seconds=VECTOR_INDEX_REFRESH_WINDOW_SECONDS)
+                missed = [
+                    doc['entry_id'] for doc in self.collection.find(
+                        {'created_at': {'$gte': window, '$lt': since}}, {'_id': 0, 'entry_id': 1})
+                    if doc.get('entry_id') not in self._row_of and doc.get('entry_id') not in self._unindexed
+                ]
+                if missed:
+                    self._fetch({'entry_id': {'$in': missed}})
+
+            # Deletions (or vectors without created_at) are only visible as a count mismatch
+            if not rebuild:
+                rebuild = self.collection.estimated_document_count() != self._size + len(self._unindexed)
+            if rebuild:
+                # Searches keep the current matrix meanwhile; skipped if a rebuild is already running
+                return self.load(wait=False)
+            with self._lock:
+                self._refresh_ann()
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def apply_write(self, entry_id: str, vector, metadata: Dict[str, Any], document_id: Optional[str] = None,
+                    created_at: Optional[datetime] = None):
+        """Reflect a vector just written to MongoDB by this process"""
+        if self._loaded:
+            self.upsert(entry_id, vector, metadata, document_id=document_id, created_at=created_at)
+
+    def apply_writes(self, writes: List[Tuple[str, Any, Dict[str, Any], Optional[str], Optional[datetime]]]):
+        """Reflect a batch of (entry_id, vector, metadata, document_id, created_at) writes"""
+        for entry_id, vector, metadata, document_id, created_at in writes:
+            self.apply_write(entry_id, vector, metadata, document_id=document_id, created_at=created_at)
+
+    def iter_row_blocks(self, start: int = 0, block_rows: int = 4096):
+        """Yield (first_row, block) float32 slices of the stored vectors"""
+        for block_start in range(start, self._size, block_rows):
+            block = self._matrix[block_start:min(block_start + block_rows, self._size)]
+            yield block_start, self.quantizer.decode(block) if self.quantizer is not None else block
+
+    def gather_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the given rows into a new float32 (len(rows), dim) array"""
+        block = self._matrix[rows]
+        return self.quantizer.decode(block) if self.quantizer is not None else block
+
+    def _mark_dead_lists(self):
+        """Hook for stores that keep superseded rows around (see MmapVectorIndex)"""
+
+    def _refresh_ann(self):
+        """(Re)load the IVF engine when a new build has been published"""
+        if VECTOR_SEARCH_ENGINE != 'ivf':
+            return
+        from ann_index import IVFIndex, VECTOR_ANN_PATH
+        mtime = os.path.getmtime(VECTOR_ANN_PATH) if os.path.exists(VECTOR_ANN_PATH) else None
+        if mtime == self._ann_mtime:
+            return
+        self._ann_mtime = mtime
+        self.ann = IVFIndex.load(VECTOR_ANN_PATH) if mtime else None
+        if self.ann is None:
+            return
+        if self.ann.dim != self.dim:
+            print(f"⚠️ Ignoring IVF index built for dimension {self.ann.dim}")
+            self.ann = None
+            return
+        # Reuse the build's assignments; rows written since then get assigned below
+        self._list_of[:self._size] = self.ann.lists_for(self.ids)
+        self._mark_dead_lists()
+        self._ann_pending = True
+        print(f"✅ IVF index attached: {self.ann.describe()}")
+
+    def _assign_pending(self):
+        """Assign rows written since the IVF build to their nearest list"""
+        if self.ann is None or not self._ann_pending:
+            return
+        pending = np.flatnonzero(self._list_of[:self._size] == LIST_PENDING)
+        for block_start in range(0, pending.size, 4096):
+            block = pending[block_start:block_start + 4096]
+            self._list_of[block] = self.ann.assign(self.gather_rows(block))
+        self._ann_pending = False
+
+    def _ann_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows in the IVF lists closest to the query, or None to search exactly"""
+        from ann_index import VECTOR_ANN_MIN_ROWS
+        if self.ann is None or len(self) < VECTOR_ANN_MIN_ROWS:
+            return None
+        self._assign_pending()
+        lists = self.ann.probe(query)
+        return np.flatnonzero(np.isin(self._list_of[:self._size], lists))
+
+    def _coarse_rows(self, query: np.ndarray, rows: Optional[np.ndarray], keep: int) -> Optional[np.ndarray]:
+        """Matryoshka first stage: best `keep` rows by their truncated prefix"""
+        count = self._size if rows is None else rows.shape[0]
+        if not self.coarse_dims or count <= keep:
+            return rows
+        short_query = truncate_vector(query, self.coarse_dims)
+        if rows is None:
+            return top_k(self._coarse[:self._size] @ short_query, keep)
+        return rows[top_k(self._coarse[rows] @ short_query, keep)]
+
+    def _rows_matching(self, field: str, values: List[str]) -> set:
+        """Rows whose field is one of values (posting lists for FILTER_FIELDS, a scan otherwise)"""
+        postings = self._postings.get(field)
+        if postings is None:
+            wanted = set(values)
+            return {i for i, meta in enumerate(self.metadata) if meta.get(field) in wanted}
+        matched = [postings[value] for value in values if value in postings]
+        if len(matched) == 1:
+            return matched[0]
+        return set().union(*matched)
+
+    def _candidate_rows(self, metadata_filters: Optional[Dict[str, List[str]]]) -> Optional[np.ndarray]:
+        """Rows allowed by the filters (sorted), or None when every row is a candidate"""
+        if not metadata_filters:
+            return None
+        # Intersect starting from the most selective filter so the cost follows the result size
+        matches = sorted((self._rows_matching(field, values) for field, values in metadata_filters.items()),
+                         key=len)
+        rows = matches[0].intersection(*matches[1:]) if len(matches) > 1 else matches[0]
+        return np.sort(np.fromiter(rows, dtype=np.int64, count=len(rows)))
+
+    def _score_rows(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Cosine scores for the given rows (all rows when None), approximate in int8 mode"""
+        if self.quantizer is None:
+            if rows is None:
+                return self._matrix[:self._size] @ query
+            return self._matrix[rows] @ query
+        # Upcast block by block so a query never materializes a float32 copy of the corpus
+        count = self._size if rows is None else rows.shape[0]
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, 4096):
+            end = min(start + 4096, count)
+            block = self._matrix[start:end] if rows is None else self._matrix[rows[start:end]]
+            scores[start:end] = self.quantizer.score(block, query)
+        return scores
+
+    def _rerank(self, query: np.ndarray, hit_rows: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Re-score int8 candidates with their full-precision vectors from MongoDB"""
+        ids = [self.ids[row] for row in hit_rows.tolist()]
+        exact = {}
+        for doc in self.collection.find({'entry_id': {'$in': ids}}, {'_id': 0, 'entry_id': 1, 'vector': 1}):
+            if doc.get('vector') is not None:
+                exact[doc['entry_id']] = normalize_vector(doc['vector'])
+        approx = self._score_rows(query, hit_rows)
+        scores = np.array([
+            float(exact[entry_id] @ query) if entry_id in exact else float(approx[i])
+            for i, entry_id in enumerate(ids)
+        ], dtype=np.float32)
+        positions = top_k(scores, top_n)
+        return hit_rows[positions], scores[positions]
+
+    def search(self, query_vector, top_n: int,
+               metadata_filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """
+        Score the query against the matrix and return (entry_id, score, metadata), best first.
+        The metadata is the resident (filterable) subset, see `hydrate`.
+
+        `metadata_filters` maps a metadata field to the allowed values; only rows
+        matching every field are scored.
+        """
+        query = normalize_vector(query_vector)
+        with self._lock:
+            if self._size == 0:
+                return []
+            rows = self._candidate_rows(metadata_filters)
+            if rows is not None and rows.size == 0:
+                return []
+            ann_rows = self._ann_rows(query)
+            if ann_rows is not None:
+                probed = ann_rows if rows is None else np.intersect1d(rows, ann_rows, assume_unique=True)
+                # Selective filters can leave too few rows in the probed lists; stay exact then
+                if probed.size >= top_n:
+                    rows = probed
+            rows = self._coarse_rows(query, rows, max(VECTOR_COARSE_CANDIDATES, top_n))
+            scores = self._score_rows(query, rows)
+            if self.quantizer is not None:
+                from vector_quant import VECTOR_QUANT_RERANK_FACTOR, VECTOR_QUANT_RERANK_MIN
+                candidates = max(top_n * VECTOR_QUANT_RERANK_FACTOR, VECTOR_QUANT_RERANK_MIN)
+                positions = top_k(scores, candidates)
+                hit_rows = positions if rows is None else rows[positions]
+                hit_rows, hit_scores = self._rerank(query, hit_rows, top_n)
+            else:
+                positions = top_k(scores, top_n)
+                hit_rows = positions if rows is None else rows[positions]
+                hit_scores = scores[positions]
+            return [
+                (self.ids[row], float(score), self.metadata[row])
+                for row, score in zip(hit_rows.tolist(), hit_scores.tolist())
+            ]
+
+    def score_entries(self, query_vector, entry_ids: List[str]) -> Dict[str, float]:
+        """Similarity of the query to specific entries (those without a vector are left out)"""
+        query = normalize_vector(query_vector)
+        with self._lock:
+            rows = np.array(sorted(self._row_of[e] for e in entry_ids if e in self._row_of), dtype=np.int64)
+            live = self._candidate_rows(None)
+            if live is not None:
+                rows = np.intersect1d(rows, live)
+            if rows.size == 0:
+                return {}
+            scores = self._score_rows(query, rows)
+            return {self.ids[row]: float(score) for row, score in zip(rows.tolist(), scores.tolist())}
+
+    def hydrate(self, entry_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Full stored metadata of the given entries, fetched with one $in lookup"""
+        if not entry_ids:
+            return {}
+        return {
+            doc['entry_id']: doc.get('metadata') or {}
+            for doc in self.collection.find(
+                {'entry_id': {'$in': list(entry_ids)}},
+                {'_id': 0, 'entry_id': 1, 'metadata': 1}
+            )
+        }
+
+
+_indexes: Dict[str, ResidentVectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_vector_index(db, collection_name: str, dim: int) -> ResidentVectorIndex:
+    """Get the process-wide index for a collection (shared by every VectorSearchService)"""
+    key = f"{db.name}.{collection_name}"
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            if VECTOR_STORE_MODE == 'mmap':
+                from vector_store import MmapVectorIndex
+                index = MmapVectorIndex(db[collection_name], dim)
+            else:
+                index = ResidentVectorIndex(db[collection_name], dim)
+            _indexes[key] = index
+        return index
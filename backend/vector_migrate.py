@@ -0,0 +1,188 @@
+"""
+Offline migrations of the vector_embeddings collection
+Derives new stored representations from the vectors already in MongoDB, so
+none of them require calling Azure OpenAI again.
+
+Usage:
+    python vector_migrate.py short [--dims 256]     backfill Matryoshka prefixes (vector_short)
+    python vector_migrate.py pack                   rewrite BSON double arrays as packed float32
+    python vector_migrate.py unpack                 roll packed vectors back to BSON arrays
+    python vector_migrate.py document-ids           set document_id on legacy RFP row vectors
+
+Readers accept both encodings, so pack/unpack can run while the app is serving.
+Running workers see backfilled document_ids on their next full index reload.
+"""
+
+import sys
+import time
+import argparse
+from typing import Dict, Any
+from pymongo import UpdateOne
+
+import numpy as np
+from bson import Binary, ObjectId
+
+from vector_index import truncate_vector, decode_vector, VECTOR_COARSE_DIMS, BINARY_VECTOR_ENCODING
+
+
+def _run_batches(collection, mongo_filter: Dict[str, Any], projection: Dict[str, int],
+                 build_update, batch_size: int, label: str) -> int:
+    """Stream matching documents and apply build_update(doc) -> $set dict with unordered bulk writes"""
+    started = time.time()
+    updated = 0
+    operations = []
+    for doc in collection.find(mongo_filter, projection).batch_size(batch_size):
+        update = build_update(doc)
+        if not update:
+            continue
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+            print(f"   📊 {label}: {updated} entries")
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    print(f"✅ {label}: {updated} entries updated in {time.time() - started:.1f}s")
+    return updated
+
+
+def backfill_short_vectors(db, dims: int, collection_name: str = 'vector_embeddings',
+                           batch_size: int = 500) -> int:
+    """Store the truncated, renormalized prefix of every vector as vector_short"""
+    def build_update(doc):
+        if doc.get('vector') is None:
+            return None
+        vector = decode_vector(doc['vector'])
+        if vector.shape[0] <= dims:
+            return None
+        short = truncate_vector(vector, dims)
+        packed = doc.get('vector_encoding') == BINARY_VECTOR_ENCODING
+        return {'vector_short': Binary(short.astype('<f4').tobytes()) if packed else short.tolist(),
+                'short_dims': dims}
+
+    return _run_batches(
+        db[collection_name],
+        {'short_dims': {'$ne': dims}},
+        {'vector': 1, 'vector_encoding': 1},
+        build_update,
+        batch_size,
+        f"Matryoshka prefixes ({dims} dims)"
+    )
+
+
+def pack_vectors(db, collection_name: str = 'vector_embeddings', batch_size: int = 500) -> int:
+    """Rewrite vector (and vector_short) as little-endian float32 Binary blobs"""
+    def build_update(doc):
+        if doc.get('vector') is None:
+            return None
+        update = {
+            'vector': Binary(decode_vector(doc['vector']).astype('<f4').tobytes()),
+            'vector_encoding': BINARY_VECTOR_ENCODING
+        }
+        if doc.get('vector_short') is not None:
+            update['vector_short'] = Binary(decode_vector(doc['vector_short']).astype('<f4').tobytes())
+        return update
+
+    return _run_batches(
+        db[collection_name],
+        {'vector_encoding': {'$ne': BINARY_VECTOR_ENCODING}},
+        {'vector': 1, 'vector_short': 1},
+        build_update,
+        batch_size,
+        "Packed float32 vectors"
+    )
+
+
+def unpack_vectors(db, collection_name: str = 'vector_embeddings', batch_size: int = 500) -> int:
+    """Roll packed vectors back to BSON double arrays"""
+    def build_update(doc):
+        if doc.get('vector') is None:
+            return None
+        update = {
+            'vector': decode_vector(doc['vector']).astype(np.float64).tolist(),
+            'vector_encoding': 'array'
+        }
+        if doc.get('vector_short') is not None:
+            update['vector_short'] = decode_vector(doc['vector_short']).astype(np.float64).tolist()
+        return update
+
+    return _run_batches(
+        db[collection_name],
+        {'vector_encoding': BINARY_VECTOR_ENCODING},
+        {'vector': 1, 'vector_short': 1},
+        build_update,
+        batch_size,
+        "Unpacked vectors"
+    )
+
+
+def backfill_document_ids(db, collection_name: str = 'vector_embeddings', batch_size: int = 500) -> int:
+    """
+    Set document_id on vectors written without one (professional mode before document_id was
+    stored), from the rfp_entries row each was embedded from, so document filters and
+    document removal reach them
+    """
+    started = time.time()
+    collection = db[collection_name]
+    updated = 0
+    orphans = 0
+    entry_ids = []
+
+    def flush() -> int:
+        object_ids = [ObjectId(entry_id) for entry_id in entry_ids if ObjectId.is_valid(entry_id)]
+        owners = {
+            str(entry['_id']): str(entry['document_id'])
+            for entry in db.rfp_entries.find({'_id': {'$in': object_ids}, 'document_id': {'$ne': None}},
+                                             {'document_id': 1})
+        }
+        operations = [UpdateOne({'entry_id': entry_id, 'document_id': None},
+                                {'$set': {'document_id': owners[entry_id]}})
+                      for entry_id in entry_ids if entry_id in owners]
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    for doc in collection.find({'document_id': None}, {'_id': 0, 'entry_id': 1}).batch_size(batch_size):
+        entry_ids.append(doc.get('entry_id'))
+        if len(entry_ids) >= batch_size:
+            done = flush()
+            updated += done
+            orphans += len(entry_ids) - done
+            entry_ids = []
+            print(f"   📊 Vector document ids: {updated} entries")
+    if entry_ids:
+        done = flush()
+        updated += done
+        orphans += len(entry_ids) - done
+    print(f"✅ Vector document ids: {updated} entries updated in {time.time() - started:.1f}s"
+          f"{f', {orphans} without an rfp_entries row left as is' if orphans else ''}")
+    return updated
+
+
+if __name__ == '__main__':
+    from services import get_db
+
+    parser = argparse.ArgumentParser(description='Migrate stored vector representations')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    short = subcommands.add_parser('short', help='backfill truncated Matryoshka prefixes')
+    short.add_argument('--dims', type=int, default=VECTOR_COARSE_DIMS or 256)
+    short.add_argument('--batch-size', type=int, default=500)
+    pack = subcommands.add_parser('pack', help='store vectors as packed float32 Binary')
+    pack.add_argument('--batch-size', type=int, default=500)
+    unpack = subcommands.add_parser('unpack', help='store vectors as BSON double arrays')
+    unpack.add_argument('--batch-size', type=int, default=500)
+    document_ids = subcommands.add_parser('document-ids', help='backfill document_id of legacy vectors')
+    document_ids.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == 'short':
+        backfill_short_vectors(get_db(), args.dims, batch_size=args.batch_size)
+    elif args.command == 'pack':
+        pack_vectors(get_db(), batch_size=args.batch_size)
+    elif args.command == 'unpack':
+        unpack_vectors(get_db(), batch_size=args.batch_size)
+    elif args.command == 'document-ids':
+        backfill_document_ids(get_db(), batch_size=args.batch_size)
+    sys.exit(0)
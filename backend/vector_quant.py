@@ -0,0 +1,179 @@
+"""
+Int8 scalar quantization of stored embeddings
+Each dimension is mapped to 256 levels between a per-dimension offset and
+offset + 255 * scale. The resident index scores on the int8 codes (4x less
+memory than float32, 8x less than the BSON doubles it loads today) and
+re-ranks the best candidates against the full-precision vectors.
+
+Usage:
+    VECTOR_QUANTIZATION=int8              enable int8 first-pass scoring
+    python vector_quant.py train          fit offset/scale on the current corpus
+    python vector_quant.py backfill       write vector_q8 codes for existing entries
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any
+import numpy as np
+from bson import Binary
+from pymongo import UpdateOne
+
+from vector_index import decode_vector
+
+# 'none' scores float32 vectors, 'int8' scores codes and re-ranks with float vectors
+VECTOR_QUANTIZATION = os.environ.get('VECTOR_QUANTIZATION', 'none').lower()
+# Candidates re-ranked at full precision: max(top_n * factor, minimum)
+VECTOR_QUANT_RERANK_FACTOR = int(os.environ.get('VECTOR_QUANT_RERANK_FACTOR', '10'))
+VECTOR_QUANT_RERANK_MIN = int(os.environ.get('VECTOR_QUANT_RERANK_MIN', '100'))
+
+META_COLLECTION = 'vector_index_meta'
+QUANTIZER_ID = 'int8_scalar'
+
+
+class ScalarQuantizer:
+    """Per-dimension affine int8 codec: x ~= offset + scale * (code + 128)"""
+
+    def __init__(self, offset: np.ndarray, scale: np.ndarray, version: int = 1):
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.version = version
+
+    @property
+    def dim(self) -> int:
+        return self.offset.shape[0]
+
+    @classmethod
+    def train(cls, sample: np.ndarray, version: int = 1, clip_percentile: float = 0.1) -> 'ScalarQuantizer':
+        """Fit the range of each dimension, ignoring the most extreme values"""
+        low = np.percentile(sample, clip_percentile, axis=0)
+        high = np.percentile(sample, 100 - clip_percentile, axis=0)
+        scale = np.maximum(high - low, 1e-9) / 255.0
+        return cls(low, scale, version)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = np.rint((np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.offset + self.scale * (np.asarray(codes, dtype=np.float32) + 128.0)
+
+    def score(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products of a float query with a block of codes"""
+        weights = query * self.scale
+        bias = float(query @ self.offset) + 128.0 * float(weights.sum())
+        return np.asarray(codes, dtype=np.float32) @ weights + bias
+
+    def to_codes_field(self, vector) -> Binary:
+        """BSON value stored as vector_q8 next to the raw vector"""
+        return Binary(self.encode(np.asarray(vector, dtype=np.float32)[None, :])[0].tobytes())
+
+    @staticmethod
+    def from_codes_field(value) -> np.ndarray:
+        return np.frombuffer(bytes(value), dtype=np.int8)
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            '_id': QUANTIZER_ID,
+            'version': self.version,
+            'dim': self.dim,
+            'offset': Binary(self.offset.tobytes()),
+            'scale': Binary(self.scale.tobytes()),
+            'trained_at': datetime.now()
+        }
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> 'ScalarQuantizer':
+        return cls(
+            np.frombuffer(bytes(doc['offset']), dtype=np.float32),
+            np.frombuffer(bytes(doc['scale']), dtype=np.float32),
+            doc.get('version', 1)
+        )
+
+
+def load_quantizer(db) -> Optional[ScalarQuantizer]:
+    """Trained quantizer of this deployment, or None when int8 mode is off / untrained"""
+    if VECTOR_QUANTIZATION != 'int8':
+        return None
+    doc = db[META_COLLECTION].find_one({'_id': QUANTIZER_ID})
+    return ScalarQuantizer.from_document(doc) if doc else None
+
+
+def quantizer_version(db) -> Optional[int]:
+    doc = db[META_COLLECTION].find_one({'_id': QUANTIZER_ID}, {'version': 1})
+    return doc.get('version') if doc else None
+
+
+def train_quantizer(db, collection_name: str = 'vector_embeddings', sample_size: int = 20000) -> ScalarQuantizer:
+    """Fit offset/scale on a random sample of stored vectors and publish a new version"""
+    sample = [
+        decode_vector(doc['vector']) for doc in db[collection_name].aggregate([
+            {'$sample': {'size': sample_size}},
+            {'$project': {'_id': 0, 'vector': 1}}
+        ]) if doc.get('vector')
+    ]
+    if not sample:
+        raise ValueError("No vectors available to train the quantizer")
+    matrix = np.asarray(sample, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    version = (quantizer_version(db) or 0) + 1
+    quantizer = ScalarQuantizer.train(matrix, version)
+    db[META_COLLECTION].replace_one({'_id': QUANTIZER_ID}, quantizer.to_document(), upsert=True)
+    print(f"✅ Int8 quantizer v{version} trained on {matrix.shape[0]} vectors")
+    return quantizer
+
+
+def backfill_codes(db, quantizer: ScalarQuantizer, collection_name: str = 'vector_embeddings',
+                   batch_size: int = 500) -> int:
+    """Write vector_q8 for every entry whose codes are missing or from an older quantizer"""
+    started = time.time()
+    collection = db[collection_name]
+    cursor = collection.find(
+        {'q8_version': {'$ne': quantizer.version}},
+        {'entry_id': 1, 'vector': 1}
+    ).batch_size(batch_size)
+
+    updated = 0
+    operations = []
+    for doc in cursor:
+        if doc.get('vector') is None:
+            continue
+        vec = decode_vector(doc['vector'])
+        if vec.shape[0] != quantizer.dim:
+            continue
+        vec = vec / max(float(np.linalg.norm(vec)), 1e-12)
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'vector_q8': quantizer.to_codes_field(vec), 'q8_version': quantizer.version}}
+        ))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+            print(f"   📊 Backfilled {updated} entries")
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+
+    print(f"✅ Int8 codes written for {updated} entries in {time.time() - started:.1f}s")
+    return updated
+
+
+if __name__ == '__main__':
+    from services import get_db
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    database = get_db()
+    if command == 'train':
+        backfill_codes(database, train_quantizer(database))
+    elif command == 'backfill':
+        doc = database[META_COLLECTION].find_one({'_id': QUANTIZER_ID})
+        if not doc:
+            print("❌ No quantizer trained yet, run: python vector_quant.py train")
+            sys.exit(1)
+        backfill_codes(database, ScalarQuantizer.from_document(doc))
+    else:
+        print("Usage: python vector_quant.py train|backfill")
+        sys.exit(1)
@@ -0,0 +1,454 @@
+"""
+Memory-mapped on-disk vector store shared across gunicorn workers
+Vectors are persisted as raw float32 shard files next to a JSON manifest.
+Every worker np.memmap's the shards read-only, so the page cache holds a
+single copy no matter how many workers are running.
+
+Usage:
+    VECTOR_STORE_MODE=mmap            enable the store for VectorSearchService
+    python vector_store.py rebuild    re-export vector_embeddings from MongoDB
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+from vector_index import (
+    ResidentVectorIndex, normalize_vector, decode_vector, resident_metadata, metadata_projection,
+    VECTOR_INDEX_REFRESH_SECONDS, LIST_PENDING, LIST_DEAD
+)
+
+VECTOR_STORE_DIR = os.environ.get(
+    'VECTOR_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vector_store')
+)
+VECTOR_SHARD_MAX_ROWS = int(os.environ.get('VECTOR_SHARD_MAX_ROWS', '50000'))
+
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = '.lock'
+
+
+class VectorShardStore:
+    """
+    Writer side of the on-disk store.
+
+    Layout of the store directory:
+        manifest.json                 published state (version, shards, tombstones)
+        shard-<gen>-<n>.f32           row-major normalized float32 vectors
+        shard-<gen>-<n>.jsonl         one {entry_id, document_id, metadata} line per row
+
+    Rows are appended to the active shard and become visible only once a new
+    manifest has been written and os.replace'd into place, so readers never see
+    a half-written row. Upserts append a newer row for the same entry_id and
+    deletions are recorded as (document_id, seq) tombstones; `rebuild_from`
+    compacts both away.
+    """
+
+    def __init__(self, directory: str = VECTOR_STORE_DIR, dim: int = 3072,
+                 max_rows_per_shard: int = VECTOR_SHARD_MAX_ROWS):
+        self.directory = directory
+        self.dim = dim
+        self.max_rows_per_shard = max_rows_per_shard
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    @contextmanager
+    def locked(self):
+        """Exclusive cross-process lock for writers"""
+        with open(self.path(LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, manifest: Dict[str, Any]):
+        """Atomically replace the manifest with a new version"""
+        manifest['version'] = manifest.get('version', 0) + 1
+        manifest['published_at'] = datetime.now().isoformat()
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _empty_manifest(self, generation: int) -> Dict[str, Any]:
+        return {'version': 0, 'generation': generation, 'dim': self.dim, 'shards': [], 'tombstones': []}
+
+    def _write_rows(self, manifest: Dict[str, Any], rows: List[Tuple[str, Optional[str], Any, Dict[str, Any]]]):
+        """Append rows to the active shard(s), rolling over when a shard is full"""
+        pending = list(rows)
+        while pending:
+            shards = manifest['shards']
+            if not shards or shards[-1]['rows'] >= self.max_rows_per_shard:
+                name = f"shard-{manifest['generation']:04d}-{len(shards):05d}"
+                shards.append({'name': name, 'rows': 0})
+            shard = shards[-1]
+            take = pending[:self.max_rows_per_shard - shard['rows']]
+            pending = pending[len(take):]
+
+            block = np.zeros((len(take), self.dim), dtype='<f4')
+            lines = []
+            for i, (entry_id, document_id, vector, metadata) in enumerate(take):
+                block[i] = normalize_vector(vector)
+                lines.append(json.dumps(
+                    {'entry_id': entry_id, 'document_id': document_id, 'metadata': resident_metadata(metadata)},
+                    default=str
+                ))
+
+            vector_path = self.path(f"{shard['name']}.f32")
+            with open(vector_path, 'ab') as f:
+                # Drop any bytes a crashed writer left past the published row count
+                f.truncate(shard['rows'] * self.dim * 4)
+                f.write(block.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            meta_path = self.path(f"{shard['name']}.jsonl")
+            with open(meta_path, 'a', encoding='utf-8') as f:
+                f.truncate(shard.get('meta_bytes', 0))
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                shard['meta_bytes'] = f.tell()
+            shard['rows'] += len(take)
+
+    def append(self, rows: List[Tuple[str, Optional[str], Any, Dict[str, Any]]]) -> int:
+        """Append (entry_id, document_id, vector, metadata) rows and publish, returns new version"""
+        with self.locked():
+            manifest = self.read_manifest() or self._empty_manifest(generation=1)
+            self._write_rows(manifest, rows)
+            self._publish(manifest)
+            return manifest['version']
+
+    def tombstone(self, document_id: str) -> int:
+        """Hide every row of a document written so far, returns new version"""
+        with self.locked():
+            manifest = self.read_manifest() or self._empty_manifest(generation=1)
+            seq = sum(shard['rows'] for shard in manifest['shards'])
+            manifest['tombstones'].append({'document_id': document_id, 'seq': seq})
+            self._publish(manifest)
+            return manifest['version']
+
+    def rebuild_from(self, collection, batch_size: int = 1000) -> int:
+        """Export a MongoDB vector collection into a fresh generation of shards"""
+        with self.locked():
+            return self._rebuild_locked(collection, batch_size)
+
+    def bootstrap_from(self, collection, batch_size: int = 1000) -> Optional[int]:
+        """Build the store from MongoDB unless some worker already published one"""
+        with self.locked():
+            if self.read_manifest() is not None:
+                return None
+            return self._rebuild_locked(collection, batch_size)
+
+    def _rebuild_locked(self, collection, batch_size: int) -> int:
+        started = time.time()
+        previous = self.read_manifest()
+        generation = (previous or {}).get('generation', 0) + 1
+        manifest = self._empty_manifest(generation)
+        manifest['version'] = (previous or {}).get('version', 0)
+
+        batch = []
+        total = 0
+        cursor = collection.find(
+            {}, {'_id': 0, 'entry_id': 1, 'document_id': 1, 'vector': 1, **metadata_projection()}
+        ).batch_size(batch_size)
+        for doc in cursor:
+            if doc.get('vector') is None:
+                continue
+            vector = decode_vector(doc['vector'])
+            if vector.shape[0] != self.dim:
+                continue
+            batch.append((doc['entry_id'], doc.get('document_id'), vector, doc.get('metadata', {})))
+            if len(batch) >= batch_size:
+                self._write_rows(manifest, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self._write_rows(manifest, batch)
+            total += len(batch)
+
+        self._publish(manifest)
+
+        # Readers that still map the old generation keep their (unlinked) files open
+        live = {shard['name'] for shard in manifest['shards']}
+        for shard in (previous or {}).get('shards', []):
+            if shard['name'] not in live:
+                for ext in ('.f32', '.jsonl'):
+                    try:
+                        os.unlink(self.path(shard['name'] + ext))
+                    except FileNotFoundError:
+                        pass
+
+        print(f"✅ Vector store rebuilt: {total} vectors, generation {generation} "
+              f"in {time.time() - started:.2f}s")
+        return manifest['version']
+
+
+class MmapVectorIndex(ResidentVectorIndex):
+    """
+    Read side of the on-disk store, used instead of the in-memory matrix when
+    VECTOR_STORE_MODE=mmap. Vectors stay in the page cache; only ids and
+    metadata are held per worker.
+    """
+
+    def __init__(self, collection, dim: int, store: Optional[VectorShardStore] = None):
+        super().__init__(collection, dim)
+        self.store = store or VectorShardStore(dim=dim)
+        self._version = None
+        self._generation = None
+        self._shards: List[Dict[str, Any]] = []  # name, rows, offset, mmap, meta_offset
+        self._alive = np.zeros(0, dtype=bool)
+        self._tombstones_applied = 0
+
+    def _reset(self, expected_rows: int = 0):
+        super()._reset(0)
+        self._shards = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._tombstones_applied = 0
+        self._version = None
+        self._generation = None
+
+    def __len__(self) -> int:
+        return int(self._alive[:self._size].sum())
+
+    def _append_row(self, entry_id: str, document_id: Optional[str], metadata: Dict[str, Any]):
+        row = self._size
+        if row >= self._alive.shape[0]:
+            grown = np.zeros(max(1024, self._alive.shape[0] * 2), dtype=bool)
+            grown[:self._alive.shape[0]] = self._alive
+            self._alive = grown
+        self._reserve_lists(row + 1)
+        self._reserve_coarse(row + 1)
+        previous = self._row_of.get(entry_id)
+        if previous is not None:
+            self._kill_row(previous)
+        self._row_of[entry_id] = row
+        self._alive[row] = True
+        self._list_of[row] = LIST_PENDING
+        self._ann_pending = True
+        self.ids.append(entry_id)
+        self.document_ids.append(document_id)
+        self.metadata.append(metadata)
+        self._post(row)
+        self._size += 1
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._alive[:self._size])
+
+    def _kill_row(self, row: int):
+        if self._alive[row]:
+            self._unpost(row)
+        self._alive[row] = False
+        self._list_of[row] = LIST_DEAD
+
+    def _mark_dead_lists(self):
+        self._list_of[:self._size][~self._alive[:self._size]] = LIST_DEAD
+
+    def _map_manifest(self, manifest: Dict[str, Any]):
+        """Map shards/rows/tombstones published since the last call"""
+        if manifest['generation'] != self._generation:
+            self._reset()
+            self._generation = manifest['generation']
+
+        offset = 0
+        for i, shard in enumerate(manifest['shards']):
+            if i >= len(self._shards):
+                self._shards.append({'name': shard['name'], 'rows': 0, 'offset': offset,
+                                     'mmap': None, 'meta_offset': 0})
+            mapped = self._shards[i]
+            if shard['rows'] > mapped['rows']:
+                with open(self.store.path(f"{shard['name']}.jsonl"), encoding='utf-8') as f:
+                    f.seek(mapped['meta_offset'])
+                    for _ in range(shard['rows'] - mapped['rows']):
+                        record = json.loads(f.readline())
+                        self._append_row(record['entry_id'], record.get('document_id'),
+                                         record.get('metadata', {}))
+                    mapped['meta_offset'] = f.tell()
+                mapped['mmap'] = np.memmap(
+                    self.store.path(f"{shard['name']}.f32"), dtype='<f4', mode='r',
+                    shape=(shard['rows'], self.dim)
+                )
+                if self.coarse_dims:
+                    # Prefixes of the new rows live in worker memory (dims/dim of the shard size)
+                    start = offset + mapped['rows']
+                    new_rows = np.asarray(mapped['mmap'][mapped['rows']:shard['rows'], :self.coarse_dims])
+                    norms = np.linalg.norm(new_rows, axis=1, keepdims=True)
+                    self._coarse[start:offset + shard['rows']] = new_rows / np.maximum(norms, 1e-12)
+                mapped['rows'] = shard['rows']
+            offset += shard['rows']
+
+        for tombstone in manifest['tombstones'][self._tombstones_applied:]:
+            for row in range(min(tombstone['seq'], self._size)):
+                if self.document_ids[row] == tombstone['document_id'] and self._alive[row]:
+                    self._kill_row(row)
+                    if self._row_of.get(self.ids[row]) == row:
+                        del self._row_of[self.ids[row]]
+        self._tombstones_applied = len(manifest['tombstones'])
+        self._version = manifest['version']
+
+    def load(self, wait: bool = True) -> bool:
+        """
+        Map the published store, bootstrapping it from MongoDB on first use. Returns False
+        when wait is False and another thread is already loading.
+        """
+        from vector_quant import VECTOR_QUANTIZATION
+        if VECTOR_QUANTIZATION == 'int8':
+            print("⚠️ VECTOR_QUANTIZATION=int8 applies to the in-memory store only; mmap shards stay float32")
+        if not self._load_lock.acquire(blocking=wait):
+            return False
+        try:
+            started = time.time()
+            with self._lock:
+                manifest = self.store.read_manifest()
+                if manifest is None:
+                    # Only the first worker to take the lock exports from MongoDB
+                    self.store.bootstrap_from(self.collection)
+                    manifest = self.store.read_manifest()
+                self._reset()
+                self._map_manifest(manifest)
+                self._loaded = True
+                self._checked_at = time.time()
+                self._ann_mtime = None
+                self._refresh_ann()
+            print(f"✅ Memory-mapped vector store v{self._version} mapped: {len(self)} vectors "
+                  f"in {time.time() - started:.2f}s")
+            return True
+        finally:
+            self._load_lock.release()
+
+    def refresh(self, force: bool = False) -> bool:
+        """Map whatever other workers have published since the last check (always catches up)"""
+        if not self._loaded:
+            self.load()
+            return True
+        with self._lock:
+            if not force and time.time() - self._checked_at < VECTOR_INDEX_REFRESH_SECONDS:
+                return True
+            self._checked_at = time.time()
+            manifest = self.store.read_manifest()
+            if manifest and manifest['version'] != self._version:
+                generation = self._generation
+                self._map_manifest(manifest)
+                if manifest['generation'] != generation:
+                    self._ann_mtime = None
+            self._refresh_ann()
+            return True
+
+    def apply_write(self, entry_id: str, vector, metadata: Dict[str, Any], document_id: Optional[str] = None,
+                    created_at: Optional[datetime] = None):
+        """Append the vector to the active shard and publish a new store version"""
+        self.store.append([(entry_id, document_id, vector, metadata)])
+        if self._loaded:
+            self.refresh(force=True)
+
+    def apply_writes(self, writes: List[Tuple[str, Any, Dict[str, Any], Optional[str], Optional[datetime]]]):
+        """Append a batch of writes with a single store publish"""
+        self.store.append([
+            (entry_id, document_id, vector, metadata)
+            for entry_id, vector, metadata, document_id, _ in writes
+        ])
+        if self._loaded:
+            self.refresh(force=True)
+
+    def upsert(self, entry_id: str, vector, metadata: Dict[str, Any], document_id: Optional[str] = None,
+               created_at: Optional[datetime] = None, codes: Optional[np.ndarray] = None,
+               short=None) -> bool:
+        """Append a row; shards hold float32 vectors only, so int8 codes and prefixes are not used"""
+        if vector is None:
+            return False
+        self.apply_write(entry_id, vector, metadata, document_id=document_id, created_at=created_at)
+        return True
+
+    def remove_document(self, document_id: str) -> int:
+        with self._lock:
+            before = len(self)
+            self.store.tombstone(document_id)
+            if self._loaded:
+                self.refresh(force=True)
+            return before - len(self)
+
+    def remove_entries(self, entry_ids: List[str]) -> int:
+        """Tombstones are per document, so re-export the store after MongoDB dropped the entries"""
+        with self._lock:
+            before = len(self)
+            if any(entry_id in self._row_of for entry_id in entry_ids):
+                self.store.rebuild_from(self.collection)
+                if self._loaded:
+                    self.refresh(force=True)
+            return before - len(self)
+
+    def _candidate_rows(self, metadata_filters: Optional[Dict[str, List[str]]]) -> Optional[np.ndarray]:
+        rows = super()._candidate_rows(metadata_filters)
+        alive = self._alive[:self._size]
+        if rows is None:
+            return None if alive.all() else np.flatnonzero(alive)
+        return rows[alive[rows]]
+
+    def iter_row_blocks(self, start: int = 0, block_rows: int = 4096):
+        for shard in self._shards:
+            shard_end = shard['offset'] + shard['rows']
+            if shard_end <= start or not shard['rows']:
+                continue
+            for block_start in range(max(start, shard['offset']), shard_end, block_rows):
+                block_end = min(block_start + block_rows, shard_end)
+                yield block_start, shard['mmap'][block_start - shard['offset']:block_end - shard['offset']]
+
+    def gather_rows(self, rows: np.ndarray) -> np.ndarray:
+        block = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        for shard in self._shards:
+            if not shard['rows']:
+                continue
+            start, end = shard['offset'], shard['offset'] + shard['rows']
+            in_shard = (rows >= start) & (rows < end)
+            if in_shard.any():
+                block[in_shard] = shard['mmap'][rows[in_shard] - start]
+        return block
+
+    def _score_rows(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Score shard by shard straight out of the page cache"""
+        if rows is None:
+            return np.concatenate([
+                np.asarray(shard['mmap'] @ query, dtype=np.float32)
+                for shard in self._shards if shard['rows']
+            ])
+        scores = np.empty(rows.shape[0], dtype=np.float32)
+        for shard in self._shards:
+            if not shard['rows']:
+                continue
+            start, end = shard['offset'], shard['offset'] + shard['rows']
+            in_shard = (rows >= start) & (rows < end)
+            if in_shard.any():
+                scores[in_shard] = shard['mmap'][rows[in_shard] - start] @ query
+        return scores
+
+
+if __name__ == '__main__':
+    from services import get_db
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    if command == 'rebuild':
+        VectorShardStore().rebuild_from(get_db()['vector_embeddings'])
+    else:
+        print(f"Unknown command: {command} (expected: rebuild)")
+        sys.exit(1)
@@ -41,8 +41,9 @@ for doc_id in "${FAILED_DOCS[@]}"; do
   http_code=$(echo "$response" | tail -n1)
   body=$(echo "$response" | sed '$d')
   
-  if [ "$http_code" = "200" ]; then
-    echo "  ✅ SUCCESS"
+  # 202: queued as a background job, already committed batches are skipped
+  if [ "$http_code" = "200" ] || [ "$http_code" = "202" ]; then
+    echo "  ✅ QUEUED"
     ((SUCCESS_COUNT++))
   else
     echo "  ❌ FAILED (HTTP $http_code)"